@@ -0,0 +1,95 @@
+# bench_catalog_load.py
+# Purpose: Load-time benchmark of the processed catalog: the CSV every consumer
+# used to parse in full versus the typed Parquet copy, with and without column
+# projection. Also reports the memory per column, and in total, of the catalog
+# as all-object columns versus with the catalog_io schema applied. Uses the real
+# Stage 1 output when present, otherwise a synthetic catalog built by bench_stage_1.
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import statistics
+
+import pandas as pd
+
+import catalog_io
+import payload_encoder as encoder
+
+# --- CONFIGURATION ---
+REPEATS = 5
+SYNTHETIC_ROWS = 113_000
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def _time_load(fn) -> tuple:
+    """Returns (median seconds, resident size of the frame in MiB)."""
+    timings, df = [], None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        df = fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), df.memory_usage(deep=True).sum() / 2**20
+
+
+def _prepare_files(work_dir: str) -> tuple:
+    """Returns (csv_path, parquet_path), writing a synthetic catalog if Stage 1 has not run."""
+    csv_path, parquet_path = catalog_io.PROCESSED_CATALOG_CSV_PATH, catalog_io.PROCESSED_CATALOG_PARQUET_PATH
+    if os.path.exists(csv_path):
+        if not os.path.exists(parquet_path) or os.path.getmtime(csv_path) > os.path.getmtime(parquet_path):
+            parquet_path = os.path.join(work_dir, "catalog.parquet")
+            catalog_io.write_processed_catalog(pd.read_csv(csv_path, dtype={'ID': str}, low_memory=False),
+                                               os.path.join(work_dir, "catalog.csv"), parquet_path)
+            csv_path = os.path.join(work_dir, "catalog.csv")
+        return csv_path, parquet_path
+
+    import bench_stage_1
+    import v2_stage_1_filter as stage_1
+    mapping_dict = bench_stage_1.load_mapping_dict()
+    df_processed, _ = stage_1.run_stage_1_processing(bench_stage_1.make_catalog(mapping_dict, SYNTHETIC_ROWS), mapping_dict)
+    csv_path, parquet_path = os.path.join(work_dir, "catalog.csv"), os.path.join(work_dir, "catalog.parquet")
+    catalog_io.write_processed_catalog(df_processed, csv_path, parquet_path)
+    return csv_path, parquet_path
+
+
+def run_benchmark():
+    if catalog_io.pq is None:
+        print("pyarrow is not installed; nothing to compare.")
+        return
+    work_dir = tempfile.mkdtemp(prefix="bench_catalog_")
+    try:
+        csv_path, parquet_path = _prepare_files(work_dir)
+        pass_1_cols = encoder.PASS_1_CATALOG_COLUMNS
+        cases = {
+            "CSV, all columns (previous readers)": lambda: pd.read_csv(csv_path, dtype={'ID': str}, low_memory=False),
+            "CSV, Pass 1 columns (usecols)": lambda: catalog_io.load_processed_catalog(pass_1_cols, csv_path, parquet_path + ".missing"),
+            "Parquet, all columns": lambda: catalog_io.load_processed_catalog(None, csv_path, parquet_path),
+            "Parquet, Pass 1 columns": lambda: catalog_io.load_processed_catalog(pass_1_cols, csv_path, parquet_path),
+            "Parquet, ID + title": lambda: catalog_io.load_processed_catalog(['title'], csv_path, parquet_path),
+        }
+        results = {name: _time_load(fn) for name, fn in cases.items()}
+        n_rows = len(pd.read_parquet(parquet_path, columns=['ID']))
+        as_objects = pd.read_csv(csv_path, dtype=object, low_memory=False)
+        memory = catalog_io.memory_report(as_objects, catalog_io.apply_schema(as_objects.copy()))
+        sizes = {"CSV": os.path.getsize(csv_path), "Parquet": os.path.getsize(parquet_path)}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = results["CSV, all columns (previous readers)"][0]
+    print("\n" + "=" * 80)
+    print(f"--- CATALOG LOAD BENCHMARK ({n_rows:,} CDEs; CSV {sizes['CSV'] / 2**20:.1f} MiB, "
+          f"Parquet {sizes['Parquet'] / 2**20:.1f} MiB) ---")
+    for name, (seconds, frame_mb) in results.items():
+        print(f"{name:<38} {seconds * 1000:9.1f} ms  {frame_mb:8.1f} MiB in memory  {baseline / seconds:6.1f}x")
+    print("-" * 80)
+    print("Memory by column, all-object columns -> catalog schema (catalog_io.apply_schema):")
+    for name, row in memory.iterrows():
+        print(f"{name:<28} {row['dtype_before']:>8} -> {row['dtype_after']:<10} "
+              f"{row['mib_before']:8.2f} -> {row['mib_after']:8.2f} MiB  ({row['saved_pct']:5.1f}% saved)")
+    print("=" * 80 + "\n")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,119 @@
+# bench_response_parsing.py
+# Purpose: Microbenchmark of the Stage 3 response hot path over recorded raw responses.
+# Compares the original handling (decode the body to dump it, decode it again to
+# return it, re-parse the prompt for the group id, then extract and validate)
+# with the current one (write the bytes as-is, decode once, validate the text).
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import statistics
+from typing import List, Callable
+
+import shared_utils as utils
+import response_reader as reader
+
+# --- CONFIGURATION ---
+RAW_RESPONSE_DIRS = [
+    utils.RAW_DIR_PASS_1,
+    os.path.join(utils.OUTPUT_DIR, "raw_responses"),
+]
+ITERATIONS = 200
+REPEATS = 5
+# A representative prompt payload, as built by payload_encoder
+SAMPLE_PROMPT = json.dumps({"group_id_for_request": "grp_0", "cde_group_for_review": [{"ID": "1", "title": "x"}] * 25})
+
+
+class _RecordedResponse:
+    """Mimics the parts of requests.Response used on the hot path."""
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _load_bodies() -> List[bytes]:
+    bodies = []
+    for raw_dir in RAW_RESPONSE_DIRS:
+        if not os.path.isdir(raw_dir):
+            continue
+        for filename in sorted(os.listdir(raw_dir)):
+            if filename.endswith('.json'):
+                with open(os.path.join(raw_dir, filename), 'rb') as f:
+                    bodies.append(f.read())
+    return bodies
+
+
+def _validate(output_text: str):
+    """Validates the model output the same way Pass 1 does; invalid output still costs a parse."""
+    try:
+        utils.AIResponsePass1.model_validate_json(output_text)
+    except utils.ValidationError:
+        pass
+
+
+def legacy_path(resp: _RecordedResponse, out_dir: str):
+    """The original generate_content_via_rest + caller handling."""
+    group_id = json.loads(SAMPLE_PROMPT).get("group_id_for_request")
+    with open(os.path.join(out_dir, f"{group_id}_response.json"), 'w', encoding='utf-8') as f:
+        json.dump(resp.json(), f, indent=2)
+    response_json = resp.json()
+    output_text = response_json.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+    if output_text:
+        _validate(output_text)
+
+
+def current_path(resp: _RecordedResponse, out_dir: str):
+    """The single-parse hot path."""
+    with open(os.path.join(out_dir, "grp_0_response.json"), 'wb') as f:
+        f.write(resp.content)
+    response_json = utils.decode_json(resp.content)
+    output_text = utils.extract_response_text(response_json)
+    if output_text:
+        _validate(output_text)
+
+
+def _time_path(fn: Callable, responses: List[_RecordedResponse], out_dir: str) -> tuple:
+    """Returns the (best, median) mean time per response in microseconds over REPEATS runs."""
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            for resp in responses:
+                fn(resp, out_dir)
+        timings.append((time.perf_counter() - start) / (ITERATIONS * len(responses)) * 1e6)
+    return min(timings), statistics.median(timings)
+
+
+def run_benchmark():
+    bodies = _load_bodies()
+    if not bodies:
+        print(f"No recorded responses found in {RAW_RESPONSE_DIRS}.")
+        return
+    responses = [_RecordedResponse(body) for body in bodies]
+    out_dir = tempfile.mkdtemp(prefix="bench_responses_")
+    try:
+        legacy_best, legacy_median = _time_path(legacy_path, responses, out_dir)
+        current_best, current_median = _time_path(current_path, responses, out_dir)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    print("\n" + "=" * 80)
+    print(f"--- RESPONSE PARSING BENCHMARK ({len(bodies)} recorded response(s), "
+          f"{sum(map(len, bodies)) / len(bodies) / 1024:.1f} KiB avg, decoder: {'orjson' if reader.orjson else 'json'}) ---")
+    print(f"Legacy path:  best {legacy_best:9.1f} us/response, median {legacy_median:9.1f}")
+    print(f"Current path: best {current_best:9.1f} us/response, median {current_median:9.1f}")
+    print(f"Speed-up:     {legacy_best / current_best:.2f}x")
+    print("=" * 80 + "\n")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,367 @@
+# bench_stage_1.py
+# Purpose: Benchmark of Stage 1 permissible-value mapping on a synthetic catalog.
+# Compares the original row-by-row implementation (iterrows + single-cell .loc
+# writes, one provenance dict per cell) with the vectorized join in
+# v2_stage_1_filter.apply_pv_mapping and the columnar provenance diff, and checks
+# that both produce the same catalog, counters and mapped-cell provenance. Also
+# reports the extra CDEs matched through pv_mapping's canonical keys, the time
+# saved by evaluating the PV rules once per unique value, the single-pass format
+# classifier against the previous per-pattern passes, how many CDEs the
+# structured PV parser resolves, Step 0's JSON relocation against the old
+# moveJSONtoValMap.py loop, and how the partitioned process pool
+# (PARALLEL_WORKERS) scales on a 1M-row catalog.
+
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import tempfile
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+import v2_stage_1_filter as stage_1
+import stage_1_filter as stage_1_legacy_script
+from provenance import ProvenanceWriter, read_provenance_log
+from pv_mapping import PVMappingIndex
+import pv_classifier
+
+# --- CONFIGURATION ---
+N_ROWS = 113_000
+MAPPED_SHARE = 0.25            # Share of rows whose PV matches a mapping key
+VARIANT_SHARE = 0.02           # Share of rows whose PV is a mapping key with curly quotes, other casing or a trailing period
+SEED = 7
+PARALLEL_ROWS = 1_000_000
+JSON_SHARE = 0.1               # Share of rows whose PV is a JSON object in the JSON relocation comparison
+MAPPING_FILE_PATH = stage_1.MAPPING_FILE_PATH
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def legacy_apply_pv_mapping(df_processed: pd.DataFrame, mapping_dict: dict, summary_counters: dict) -> list:
+    """The original Step 2 loop, kept as the reference implementation."""
+    change_log = []
+    id_col, pv_col = stage_1.COLUMN_MAP['ID'], stage_1.COLUMN_MAP['PV']
+    df_processed['__processed_pv'] = False
+    for index, row in df_processed.iterrows():
+        original_value = str(row[pv_col]).strip()
+        if not original_value or original_value.lower() == 'nan':
+            df_processed.loc[index, '__processed_pv'] = True
+            continue
+
+        if original_value in mapping_dict:
+            cde_id = row[id_col]
+            map_entry = mapping_dict[original_value]
+            summary_counters['transformed_from_map'] += 1
+            for key, std_val in map_entry.items():
+                target_col = stage_1.COLUMN_MAP.get(key)
+                if pd.notna(std_val) and std_val != '' and target_col:
+                    original_target_val = row[target_col]
+                    df_processed.loc[index, target_col] = std_val
+                    change_log.append({
+                        'cde_id': cde_id,
+                        'column_changed': target_col,
+                        'action_taken': f'Applied from map: {original_value}',
+                        'original_value': original_target_val,
+                        'new_value': std_val
+                    })
+            df_processed.loc[index, 'pv_was_standardized'] = True
+            df_processed.loc[index, '__processed_pv'] = True
+    df_processed.drop(columns=['__processed_pv'], inplace=True)
+    return change_log
+
+
+def load_mapping_dict() -> dict:
+    """The real mapping table when present, otherwise a small synthetic one."""
+    if os.path.exists(MAPPING_FILE_PATH):
+        df_map = pd.read_csv(MAPPING_FILE_PATH, keep_default_na=False)
+        return {
+            row['original_expression'].strip(): {
+                'PV': row['standardized_pv'], 'UM': row['standardized_unit'],
+                'VF': row['standardized_value_format'], 'VM': row['standardized_value_mapping']
+            } for _, row in df_map.iterrows()
+        }
+    return {
+        f"0: No, 1: Yes ({i})": {'PV': 'No|Yes', 'UM': 'N/A' if i % 2 else '', 'VF': 'categorical',
+                                 'VM': '{"0": "No", "1": "Yes"}' if i % 3 else ''}
+        for i in range(40)
+    }
+
+
+def make_catalog(mapping_dict: dict, n_rows: int = N_ROWS) -> pd.DataFrame:
+    """A catalog with the Stage 1 columns and a realistic mix of PV values."""
+    rng = np.random.default_rng(SEED)
+    keys = np.array(list(mapping_dict.keys()), dtype=object)
+    other_pvs = np.array(['Yes|No', '(y >= 0)', 'Permissible values: 1-10', 'Response', '1', 'nan', '', 'NaN',
+                          'mg/dL', 'free text answer', ':Male|Female'], dtype=object)
+    is_mapped = rng.random(n_rows) < MAPPED_SHARE
+    pvs = np.where(is_mapped, keys[rng.integers(0, len(keys), n_rows)], other_pvs[rng.integers(0, len(other_pvs), n_rows)])
+    # Some mapped values arrive with surrounding whitespace, as in the real catalog
+    padded = rng.random(n_rows) < 0.1
+    pvs = np.where(padded, np.char.add(np.char.add(' ', pvs.astype(str)), ' ').astype(object), pvs)
+    # ...and some only match once quotes, case and punctuation are normalized
+    variants = np.array([[key.upper(), key + '.', key.replace('“', '"').replace('”', '"').replace(', ', ',  ')][i % 3]
+                         for i, key in enumerate(keys)], dtype=object)
+    is_variant = ~is_mapped & (rng.random(n_rows) < VARIANT_SHARE)
+    pvs = np.where(is_variant, variants[rng.integers(0, len(keys), n_rows)], pvs)
+    units = np.array(['mg', np.nan, 'N/A', 'years'], dtype=object)
+    formats = np.array(['categorical', 'Free Entry', 'numeric', np.nan], dtype=object)
+    return pd.DataFrame({
+        'ID': [str(i) for i in range(n_rows)],
+        'title': [f"CDE title number {i}" for i in range(n_rows)],
+        'short_description': [f"Short description for element {i} of the catalog" for i in range(n_rows)],
+        'variable_name': [f"var_{i}" for i in range(n_rows)],
+        'permissible_values': pvs,
+        'value_format': formats[rng.integers(0, len(formats), n_rows)],
+        'unit_of_measure': units[rng.integers(0, len(units), n_rows)],
+        'value_mapping': np.where(rng.random(n_rows) < 0.05, '{"1": "Yes"}', None).astype(object),
+    })
+
+
+def _run_legacy(catalog: pd.DataFrame, mapping_dict: dict) -> tuple:
+    """The full Stage 1 processing with the original Step 2 swapped in; returns its dict-based log."""
+    change_log = []
+
+    def _legacy_step_2(df_processed, mapping, counters):
+        change_log.extend(legacy_apply_pv_mapping(df_processed, mapping, counters))
+
+    original = stage_1.apply_pv_mapping
+    stage_1.apply_pv_mapping = _legacy_step_2
+    try:
+        start = time.perf_counter()
+        df_processed, counters = stage_1.run_stage_1_processing(catalog.copy(), mapping_dict)
+        return time.perf_counter() - start, df_processed, change_log, counters
+    finally:
+        stage_1.apply_pv_mapping = original
+
+
+def _run_current(catalog: pd.DataFrame, mapping_dict: dict, out_dir: str) -> tuple:
+    """The current Stage 1 processing, writing its provenance log to `out_dir`."""
+    provenance = ProvenanceWriter(os.path.join(out_dir, "provenance.parquet"), os.path.join(out_dir, "provenance.csv"))
+    start = time.perf_counter()
+    df_processed, counters = stage_1.run_stage_1_processing(catalog.copy(), mapping_dict, provenance)
+    provenance.close()
+    elapsed = time.perf_counter() - start
+    log_path = provenance.parquet_path or provenance.csv_path
+    return elapsed, df_processed, read_provenance_log(log_path), counters
+
+
+def _run_with(catalog: pd.DataFrame, mapping_dict: dict, **options) -> tuple:
+    """The current Stage 1 processing with the given configuration constants overridden (e.g. FACTORIZE_PV_RULES=False)."""
+    original = {name: getattr(stage_1, name) for name in options}
+    for name, value in options.items():
+        setattr(stage_1, name, value)
+    try:
+        start = time.perf_counter()
+        df_processed, counters = stage_1.run_stage_1_processing(catalog.copy(), mapping_dict)
+        return time.perf_counter() - start, df_processed, None, counters
+    finally:
+        for name, value in original.items():
+            setattr(stage_1, name, value)
+
+
+# The patterns debug_values.diagnose_formats tried one at a time, in order
+LEGACY_FORMAT_PATTERNS = {
+    'placeholder': re.compile(r'^(free text|numeric|integer|float|text|boolean)$', re.IGNORECASE),
+    'key_value_meta': re.compile(r'min:.*max:', re.IGNORECASE),
+    'ordinal_scale': re.compile(r'(\d+:\s*[\w\s]+)', re.IGNORECASE),
+    'interval_simple': re.compile(r'^\s*(\d+\.?\d*)\s*-\s*(\d+\.?\d*)\s*$'),
+    'json_array': re.compile(r'^\s*\[.*\]\s*$'),
+    'pipe_separated': re.compile(r'.*\|.*'),
+    'constraint_expression': re.compile(r'^\(y>=.*\)$', re.IGNORECASE),
+}
+
+
+def _bench_format_classifier(pvs: pd.Series) -> tuple:
+    """
+    Row-wise (no factorization) cost of classifying every PV: the previous per-pattern loop
+    plus Step 4's three structure passes, versus one scan of the combined pattern.
+    Returns (multi-pass seconds, single-pass seconds) and checks the structure flags agree.
+    """
+    start = time.perf_counter()
+    text = pvs.astype(str)
+    [next((name for name, pattern in LEGACY_FORMAT_PATTERNS.items() if pattern.search(value)), 'Unmatched')
+     for value in text.fillna('nan')]
+    is_constraint = text.str.match(r'^\(y\s*[<>=!].*\)$', na=False)
+    is_pipe = text.str.contains('|', regex=False, na=False)
+    is_empty_or_nan = pd.isna(pvs) | text.isin(['', 'nan'])
+    legacy_structured = (is_pipe | is_constraint | is_empty_or_nan).to_numpy()
+    multi_pass = time.perf_counter() - start
+
+    start = time.perf_counter()
+    features = pv_classifier.classify_series(pvs)
+    structured = features[list(pv_classifier.STRUCTURED_FEATURES)].any(axis=1).to_numpy()
+    single_pass = time.perf_counter() - start
+    assert (legacy_structured == structured).all(), "format classifier: structure flags differ"
+    return multi_pass, single_pass
+
+
+def legacy_move_json_pvs(df: pd.DataFrame) -> pd.DataFrame:
+    """The loop of the original moveJSONtoValMap.py (after its fillna(''))."""
+    df = df.fillna('')
+    for index, row in df.iterrows():
+        pv = row['permissible_values']
+        vm = row['value_mapping']
+        if vm.strip() == '':
+            try:
+                parsed_json = json.loads(pv)
+                if isinstance(parsed_json, dict):
+                    df.at[index, 'value_mapping'] = json.dumps(parsed_json)
+                    df.at[index, 'permissible_values'] = ''
+            except (json.JSONDecodeError, TypeError):
+                continue
+    return df
+
+
+def _bench_json_pvs(catalog: pd.DataFrame) -> tuple:
+    """
+    Times the legacy loop against Step 0 on the catalog with a share of its PVs replaced by
+    JSON objects (plus arrays and broken JSON that must stay put). Returns (legacy seconds,
+    Step 0 seconds, CDEs moved) and checks both leave the same PV and value_mapping.
+    """
+    rng = np.random.default_rng(SEED)
+    df = catalog[['ID', 'permissible_values', 'value_mapping']].copy()
+    json_pvs = np.array(['{"0": "No", "1": "Yes"}', ' {"min": 0, "max": 10, "unit": "mg/dL"}', '{"1": "Mild", "2": "Severe"}',
+                         '{"a": {"b": [1, 2]}}', '{}', '[1, 2, 3]', '{"1": "Yes", 2}', '{not json'], dtype=object)
+    is_json = rng.random(len(df)) < JSON_SHARE
+    df.loc[is_json, 'permissible_values'] = json_pvs[rng.integers(0, len(json_pvs), int(is_json.sum()))]
+
+    start = time.perf_counter()
+    legacy = legacy_move_json_pvs(df.copy())
+    legacy_seconds = time.perf_counter() - start
+    counters = defaultdict(int)
+    current = df.copy()
+    start = time.perf_counter()
+    stage_1.move_json_pvs(current, counters)
+    step_0_seconds = time.perf_counter() - start
+    pd.testing.assert_frame_equal(legacy, current.fillna(''), check_dtype=False)
+    return legacy_seconds, step_0_seconds, counters['moved_json_to_value_mapping']
+
+
+def _check_identical(label: str, reference: tuple, candidate: tuple):
+    _, ref_df, _, ref_counters = reference
+    _, df, _, counters = candidate
+    pd.testing.assert_frame_equal(ref_df, df, check_dtype=False)
+    assert ref_df.to_csv(index=False) == df.to_csv(index=False), f"{label}: catalog CSV differs"
+    shared = set(ref_counters) & set(counters)
+    assert all(ref_counters[k] == counters[k] for k in shared), f"{label}: counters differ"
+
+
+def _check_provenance(legacy_log: list, current_log: pd.DataFrame):
+    """The mapping rows of the new log are the legacy entries that actually changed a cell."""
+    cols = ['cde_id', 'column_changed', 'original_value', 'new_value']
+    legacy = pd.DataFrame(legacy_log)[cols].astype(object).fillna('nan').astype(str).replace('None', 'nan')
+    legacy = legacy[legacy['original_value'] != legacy['new_value']]
+    current = current_log[current_log['rule_id'] == 'pv_map'][cols].astype(object).fillna('nan').astype(str)
+    key = ['cde_id', 'column_changed']
+    legacy = legacy.sort_values(key).reset_index(drop=True)
+    current = current.sort_values(key).reset_index(drop=True)
+    pd.testing.assert_frame_equal(legacy, current)
+
+
+def run_benchmark():
+    mapping_dict = load_mapping_dict()
+    catalog = make_catalog(mapping_dict)
+
+    out_dir = tempfile.mkdtemp(prefix="bench_stage_1_")
+    try:
+        legacy = _run_legacy(catalog, mapping_dict)
+        current = _run_current(catalog, mapping_dict, out_dir)
+        start = time.perf_counter()
+        legacy_script = stage_1_legacy_script.run_stage_1_processing(catalog.copy(), mapping_dict)
+        legacy_script = (time.perf_counter() - start,) + legacy_script
+        _check_identical("v2_stage_1_filter", legacy, current)
+        # The original script predates the PV parser and the pv_format_class column
+        unparsed = _run_with(catalog, mapping_dict, PARSE_STRUCTURED_PVS=False)
+        _check_identical("stage_1_filter", unparsed[:1] + (unparsed[1].drop(columns=['pv_was_parsed', 'pv_format_class']),) + unparsed[2:],
+                         legacy_script)
+        _check_provenance(legacy[2], current[2])
+        log_sizes = {name: os.path.getsize(os.path.join(out_dir, name)) for name in os.listdir(out_dir)}
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    step_2_counters = defaultdict(int)
+    step_2_input = catalog.copy()
+    step_2_input['pv_was_standardized'] = False
+    start = time.perf_counter()
+    stage_1.apply_pv_mapping(step_2_input, mapping_dict, step_2_counters)
+    step_2_only = time.perf_counter() - start
+
+    canonical_counters = defaultdict(int)
+    step_2_input = catalog.copy()
+    start = time.perf_counter()
+    stage_1.apply_pv_mapping(step_2_input, PVMappingIndex(mapping_dict), canonical_counters)
+    step_2_canonical = time.perf_counter() - start
+
+    per_row = _run_with(catalog, mapping_dict, FACTORIZE_PV_RULES=False)
+    per_value = _run_with(catalog, mapping_dict, FACTORIZE_PV_RULES=True)
+    _check_identical("FACTORIZE_PV_RULES", per_row, per_value)
+    n_unique = per_value[3]['pv_unique_values']
+    multi_pass, single_pass = _bench_format_classifier(catalog['permissible_values'])
+    json_legacy, json_step_0, n_moved = _bench_json_pvs(catalog)
+
+    print("\n" + "=" * 80)
+    print(f"--- STAGE 1 PV MAPPING BENCHMARK ({len(catalog):,} rows, {len(mapping_dict)} mapping keys, "
+          f"{len(current[2]):,} provenance entries) ---")
+    print(f"Legacy log:             {len(legacy[2]):,} dict entries, {pd.DataFrame(legacy[2]).memory_usage(deep=True).sum() / 2**20:.1f} MiB as a frame")
+    print("Columnar log on disk:   " + ", ".join(f"{name} {size / 2**20:.2f} MiB" for name, size in sorted(log_sizes.items())))
+    print(f"Row-by-row (iterrows):  {legacy[0]:8.2f}s for the full Stage 1 processing")
+    print(f"Vectorized join:        {current[0]:8.2f}s for the full Stage 1 processing ({step_2_only:.3f}s in Step 2)")
+    print(f"Speed-up:               {legacy[0] / current[0]:.1f}x")
+    print("Outputs identical:      yes (catalog and counters for both Stage 1 scripts; mapped-cell provenance)")
+    print(f"Per-value PV rules:     {n_unique:,} unique PVs for {len(catalog):,} rows ({n_unique / len(catalog):.2%}); "
+          f"{per_row[0]:.2f}s per row -> {per_value[0]:.2f}s per unique value (saves {per_row[0] - per_value[0]:.2f}s)")
+    print(f"PV format classifier:   {multi_pass:.2f}s for 8 per-pattern passes -> {single_pass:.2f}s single pass "
+          f"({multi_pass / single_pass:.1f}x, all {len(catalog):,} rows, no factorization)")
+    print(f"Structured PV parser:   {current[3]['transformed_by_parser']:,} CDEs given a parsed value mapping; "
+          f"{unparsed[3]['flagged_bad_permissibles']:,} -> {current[3]['flagged_bad_permissibles']:,} flagged PVs; "
+          f"{per_value[0] - unparsed[0]:+.2f}s for Step 2b")
+    print(f"JSON PV relocation:     {json_legacy:.2f}s row-by-row -> {json_step_0:.3f}s in Step 0 "
+          f"({json_legacy / json_step_0:.0f}x, {n_moved:,} of {len(catalog):,} CDEs moved, outputs identical)")
+    print(f"Canonical-key matching: {canonical_counters['transformed_from_map']:,} CDEs mapped "
+          f"(+{canonical_counters['transformed_from_map_canonical_key']:,} over exact matching) in {step_2_canonical:.3f}s")
+    print("=" * 80 + "\n")
+
+
+def run_parallel_benchmark():
+    """Full Stage 1 processing on PARALLEL_ROWS rows for 1, 2, 4, ... workers; every output must match the serial one."""
+    mapping_dict = load_mapping_dict()
+    catalog = make_catalog(mapping_dict, PARALLEL_ROWS)
+    n_cpus = os.cpu_count() or 1
+    worker_counts = sorted({1, 2} | {n for n in (4, 8, 16, n_cpus) if n <= n_cpus})
+    original = (stage_1.PARALLEL_WORKERS, stage_1.PARALLEL_MIN_ROWS)
+    timings, reference = {}, None
+    try:
+        for workers in worker_counts:
+            stage_1.PARALLEL_WORKERS, stage_1.PARALLEL_MIN_ROWS = workers, 1
+            stage_1._EXECUTOR = None
+            if workers > 1:
+                stage_1._parallel_executor().submit(int).result()  # Pool start-up is not part of the timing
+            start = time.perf_counter()
+            df_processed, counters = stage_1.run_stage_1_processing(catalog.copy(), mapping_dict)
+            timings[workers] = time.perf_counter() - start
+            if stage_1._EXECUTOR is not None:
+                stage_1._EXECUTOR.shutdown()
+            result = (timings[workers], df_processed, None, counters)
+            if reference is None:
+                reference = result
+            else:
+                _check_identical(f"{workers} workers", reference, result)
+    finally:
+        stage_1.PARALLEL_WORKERS, stage_1.PARALLEL_MIN_ROWS = original
+        stage_1._EXECUTOR = None
+
+    print("\n" + "=" * 80)
+    print(f"--- STAGE 1 PARALLEL HEURISTICS ({len(catalog):,} rows, {n_cpus} CPUs available) ---")
+    for workers, seconds in timings.items():
+        print(f"{workers:>2} worker(s):  {seconds:8.2f}s  {timings[1] / seconds:5.2f}x")
+    print("Outputs identical:      yes (catalog and counters for every worker count)")
+    print("=" * 80 + "\n")
+
+
+if __name__ == "__main__":
+    run_benchmark()
+    run_parallel_benchmark()
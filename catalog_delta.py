@@ -0,0 +1,85 @@
+# catalog_delta.py
+# Purpose: Incremental Stage 1.
+# Every merged source row gets a content hash, which is stored next to
+# `cde_catalog_processed` together with a fingerprint of everything else the
+# output depends on (mapping file, processing logic version, source columns).
+# On a rerun, only new or changed rows are reprocessed. The rest are carried
+# forward from the previous catalog. Each run writes a delta CSV (ID, change)
+# listing the CDEs that were added, changed or removed.
+
+import os
+import json
+import hashlib
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# --- 1. CONFIGURATION ---
+
+DELTA_COLUMNS = ['ID', 'change']        # change: added | changed | removed
+_MISSING = '\x00'                       # Stands in for missing values when hashing
+
+
+# --- 2. HASHING ---
+
+def row_hashes(df: pd.DataFrame) -> pd.Series:
+    """A 64-bit content hash per row over all source columns (as text), as hex strings."""
+    text = pd.DataFrame({col: df[col].astype(object).where(df[col].notna(), _MISSING).astype(str)
+                         for col in df.columns})
+    hashes = pd.util.hash_pandas_object(text, index=False).to_numpy()
+    return pd.Series(np.char.mod('%016x', hashes), index=df.index, dtype=object)
+
+
+def run_fingerprint(mapping_path: str, logic_version, source_columns) -> str:
+    """
+    Changes whenever a carried-forward row could come out differently: mapping file, logic
+    version (any JSON value, e.g. a version number plus matching options) or source columns.
+    """
+    digest = hashlib.sha256()
+    with open(mapping_path, 'rb') as f:
+        digest.update(f.read())
+    digest.update(json.dumps([logic_version, list(source_columns)]).encode())
+    return digest.hexdigest()
+
+
+# --- 3. STATE AND DELTA ---
+
+def load_row_hashes(path: str) -> Tuple[Optional[str], pd.Series]:
+    """Returns (fingerprint, hashes indexed by ID) of the previous run; (None, empty) when there is none."""
+    if not os.path.exists(path):
+        return None, pd.Series(dtype=object)
+    with open(path, 'r') as f:
+        state = json.load(f)
+    return state.get('fingerprint'), pd.Series(state.get('hashes', {}), dtype=object)
+
+
+def save_row_hashes(path: str, fingerprint: str, ids: pd.Series, hashes: pd.Series):
+    with open(path, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'hashes': dict(zip(ids.astype(str), hashes))}, f)
+    logging.info(f"Saved {len(hashes)} row hashes to: {path}")
+
+
+def diff_rows(ids: pd.Series, hashes: pd.Series, previous: pd.Series, full_rebuild: bool) -> Tuple[np.ndarray, pd.DataFrame]:
+    """
+    Compares this run's rows with the previous run's hashes. Returns a boolean mask of
+    the rows to reprocess and the delta frame. On a full rebuild every previously known
+    row counts as changed.
+    """
+    previous_hash = previous.reindex(ids.to_numpy()).to_numpy()
+    is_new = pd.isna(previous_hash)
+    is_changed = ~is_new & (np.full(len(ids), True) if full_rebuild else previous_hash != hashes.to_numpy())
+    removed = previous.index.difference(pd.Index(ids))
+    delta = pd.DataFrame({
+        'ID': np.concatenate([ids.to_numpy()[is_new], ids.to_numpy()[is_changed], removed.to_numpy()]),
+        'change': ['added'] * int(is_new.sum()) + ['changed'] * int(is_changed.sum()) + ['removed'] * len(removed),
+    }, columns=DELTA_COLUMNS)
+    return is_new | is_changed, delta
+
+
+def write_delta(path: str, delta: pd.DataFrame):
+    delta.to_csv(path, index=False)
+    counts = delta['change'].value_counts()
+    logging.info(f"Saved catalog delta to {path}: " +
+                 ", ".join(f"{counts.get(change, 0)} {change}" for change in ('added', 'changed', 'removed')))
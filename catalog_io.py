@@ -0,0 +1,205 @@
+# catalog_io.py
+# Purpose: The typed Parquet copy of the Stage 1 catalog and the shared loader
+# used by every downstream consumer.
+# Stage 1 writes `cde_catalog_processed.parquet` next to the CSV. In it, the flag
+# columns are booleans, `value_format`, `unit_of_measure` and `pv_format_class`
+# are dictionary-encoded (categorical) and everything else is text.
+# `load_processed_catalog(columns)` reads only the requested columns. It falls
+# back to the CSV when pyarrow or the Parquet file is missing, or when the CSV is
+# newer. Either way `apply_schema` gives the frame the same memory-efficient
+# dtypes: bool flags, categoricals, and Arrow-backed strings for the text
+# (missing values stay NaN, never the string 'nan').
+
+import os
+import logging
+from typing import List, Optional, Iterable
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# --- 1. CONFIGURATION ---
+
+PROCESSED_CATALOG_CSV_PATH = os.path.join('outputs', 'stage_1', 'cde_catalog_processed.csv')
+PROCESSED_CATALOG_PARQUET_PATH = os.path.join('outputs', 'stage_1', 'cde_catalog_processed.parquet')
+PARQUET_COMPRESSION = 'zstd'
+
+BOOLEAN_COLUMNS = ('pv_was_standardized', 'pv_was_parsed', 'needs_audit')
+BOOLEAN_PREFIXES = ('flag_',)
+CATEGORICAL_COLUMNS = ('value_format', 'unit_of_measure', 'pv_format_class')
+_BOOLEAN_TEXT = {'True': True, 'False': False, 'true': True, 'false': False}
+
+
+def _text_dtype():
+    """Arrow-backed strings with NaN as the missing value (object without pyarrow or on old pandas)."""
+    if pa is None:
+        return object
+    try:
+        return pd.StringDtype('pyarrow', na_value=np.nan)     # pandas >= 2.3
+    except TypeError:
+        pass
+    try:
+        return pd.StringDtype('pyarrow_numpy')                 # pandas 2.1 / 2.2
+    except (TypeError, ValueError):
+        return object
+
+
+TEXT_DTYPE = _text_dtype()
+
+
+def _is_boolean_column(name: str) -> bool:
+    return name in BOOLEAN_COLUMNS or name.startswith(BOOLEAN_PREFIXES)
+
+
+# --- 2. WRITING ---
+
+def arrow_schema(columns: Iterable[str]):
+    """The catalog schema: booleans for flags, dictionary-encoded categoricals, text for the rest."""
+    fields = []
+    for name in columns:
+        if _is_boolean_column(name):
+            fields.append(pa.field(name, pa.bool_()))
+        elif name in CATEGORICAL_COLUMNS:
+            fields.append(pa.field(name, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+
+def to_arrow_table(df: pd.DataFrame, schema=None):
+    """Converts a processed catalog frame to an Arrow table with the catalog schema."""
+    schema = schema or arrow_schema(df.columns)
+    arrays = []
+    for field in schema:
+        values = df[field.name]
+        if pa.types.is_boolean(field.type):
+            arrays.append(pa.array(values.astype(object).where(values.notna(), None).to_numpy(), type=pa.bool_()))
+            continue
+        # Text exactly as the CSV carries it; missing values stay null
+        text = values.astype(object).where(values.notna(), None).to_numpy()
+        try:
+            array = pa.array(text, type=pa.string())
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            # Mixed or numeric column: stringify the non-text values first
+            array = pa.array([v if v is None or isinstance(v, str) else str(v) for v in text], type=pa.string())
+        arrays.append(array.dictionary_encode() if pa.types.is_dictionary(field.type) else array)
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class CatalogParquetWriter:
+    """Writes the processed catalog as Parquet, one row group per call (a no-op without pyarrow)."""
+
+    def __init__(self, path: str = PROCESSED_CATALOG_PARQUET_PATH):
+        self.path = path
+        self.rows_written = 0
+        self._schema = None
+        self._writer = None
+        if pq is None:
+            logging.warning("pyarrow is not installed; skipping the Parquet catalog (readers will use the CSV).")
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def write(self, df: pd.DataFrame):
+        if pq is None:
+            return
+        if self._writer is None:
+            self._schema = arrow_schema(df.columns)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._writer = pq.ParquetWriter(self.path, self._schema, compression=PARQUET_COMPRESSION)
+        self._writer.write_table(to_arrow_table(df, self._schema))
+        self.rows_written += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            logging.info(f"Saved typed Parquet catalog with {self.rows_written} CDEs to: {self.path}")
+
+
+def write_processed_catalog(df: pd.DataFrame, csv_path: str = PROCESSED_CATALOG_CSV_PATH,
+                            parquet_path: str = PROCESSED_CATALOG_PARQUET_PATH):
+    """Rewrites both copies of the catalog (CSV first, so the Parquet file is the newer one)."""
+    df.to_csv(csv_path, index=False)
+    writer = CatalogParquetWriter(parquet_path)
+    writer.write(df)
+    writer.close()
+
+
+# --- 3. SCHEMA ---
+
+def column_dtype(name: str, categorical: bool = True):
+    """The pandas dtype of a catalog column."""
+    if _is_boolean_column(name):
+        return bool
+    if categorical and name in CATEGORICAL_COLUMNS:
+        return 'category'
+    return TEXT_DTYPE
+
+
+def apply_schema(df: pd.DataFrame, categorical: bool = True) -> pd.DataFrame:
+    """
+    Converts a catalog (or source) frame to the catalog dtypes in place and returns it.
+    Boolean columns read as text ('True'/'False') become bool, or nullable 'boolean' when
+    values are missing. Pass `categorical=False` to keep the categorical columns as text.
+    """
+    for name in df.columns:
+        values, dtype = df[name], column_dtype(name, categorical)
+        if dtype is bool:
+            if values.dtype != bool:
+                flags = values.map(lambda v: _BOOLEAN_TEXT.get(v, v) if isinstance(v, str) else v)
+                df[name] = flags.astype('boolean' if flags.isna().any() else bool)
+        elif dtype == 'category':
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                df[name] = values.astype(TEXT_DTYPE).astype('category')
+        elif values.dtype != dtype:
+            df[name] = values.astype(dtype)
+    return df
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """Deep memory usage (MiB) per column, and in total, of a frame before and after apply_schema."""
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str), 'dtype_after': after.dtypes.astype(str),
+        'mib_before': before.memory_usage(deep=True, index=False) / 2**20,
+        'mib_after': after.memory_usage(deep=True, index=False) / 2**20,
+    })
+    report.loc['TOTAL'] = ['', '', report['mib_before'].sum(), report['mib_after'].sum()]
+    report['saved_pct'] = 100 * (1 - report['mib_after'] / report['mib_before'].where(report['mib_before'] > 0))
+    return report
+
+
+# --- 4. READING ---
+
+def _use_parquet(csv_path: str, parquet_path: str) -> bool:
+    if pq is None or not os.path.exists(parquet_path):
+        return False
+    if os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(parquet_path):
+        logging.warning(f"'{csv_path}' is newer than '{parquet_path}'; reading the CSV.")
+        return False
+    return True
+
+
+def load_processed_catalog(columns: Optional[List[str]] = None, csv_path: str = PROCESSED_CATALOG_CSV_PATH,
+                           parquet_path: str = PROCESSED_CATALOG_PARQUET_PATH, categorical: bool = True) -> pd.DataFrame:
+    """
+    Loads the processed catalog, reading only `columns` (plus 'ID') when given.
+    Requested columns that the catalog does not have are skipped. Pass
+    `categorical=False` when the caller assigns new values into the categorical columns.
+    """
+    wanted = None
+    if columns is not None:
+        wanted = ['ID'] + [col for col in dict.fromkeys(columns) if col != 'ID']
+
+    if _use_parquet(csv_path, parquet_path):
+        if wanted is not None:
+            available = set(pq.read_schema(parquet_path).names)
+            wanted = [col for col in wanted if col in available]
+        return apply_schema(pd.read_parquet(parquet_path, columns=wanted), categorical)
+
+    usecols = (lambda col: col in wanted) if wanted is not None else None
+    return apply_schema(pd.read_csv(csv_path, dtype=str, usecols=usecols, low_memory=False), categorical)
@@ -0,0 +1,128 @@
+# catalog_sources.py
+# Purpose: Source loading shared by Stage 1 and Stage 2.
+# SQLite reads select only the needed columns, push ID null-dropping (and, for
+# Stage 2, numeric-ID filtering) into SQL, and fetch rows in chunks with
+# `fetchmany`. The CSV/SQLite merge is a hash join on ID: each output column is
+# built once, without the `_csv`/`_sqlite` duplicate columns a pandas merge creates.
+
+import sqlite3
+import logging
+from typing import List, Optional, Iterator
+
+import pandas as pd
+
+# --- 1. CONFIGURATION ---
+
+SQLITE_FETCH_SIZE = 20000
+
+# ID filters applied in SQL. IDs are returned as text either way.
+ID_FILTERS = {
+    # Any non-null ID
+    "not_null": ("ID IS NOT NULL", "CAST(ID AS TEXT)"),
+    # Integer IDs only (numbers or all-digit text), normalised to their integer form
+    "numeric": ("ID IS NOT NULL AND (typeof(ID) IN ('integer', 'real') OR "
+                "(trim(ID) <> '' AND trim(ID) NOT GLOB '*[^0-9]*'))",
+                "CAST(CAST(ID AS INTEGER) AS TEXT)"),
+}
+
+
+def _quote(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def table_columns(conn: sqlite3.Connection, table_name: str) -> List[str]:
+    """Column names of a table, in table order."""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table_name)})")]
+
+
+# --- 2. SQLITE READS ---
+
+def iter_sqlite_chunks(db_path: str, table_name: str, columns: Optional[List[str]] = None, id_filter: str = "not_null",
+                       chunk_size: int = SQLITE_FETCH_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Yields the table in chunks of `chunk_size` rows, projected onto `columns` (table order;
+    requested columns the table lacks are skipped). 'ID' is always included, as text.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        available = table_columns(conn, table_name)
+        if 'ID' not in available:
+            raise ValueError(f"The table '{table_name}' must have an 'ID' column.")
+        selected = [col for col in available if columns is None or col == 'ID' or col in columns]
+        where, id_expr = ID_FILTERS[id_filter]
+        select = ", ".join(f"{id_expr} AS ID" if col == 'ID' else _quote(col) for col in selected)
+        cursor = conn.execute(f"SELECT {select} FROM {_quote(table_name)} WHERE {where}")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=selected, coerce_float=True)
+    finally:
+        conn.close()
+
+
+def read_sqlite_table(db_path: str, table_name: str, columns: Optional[List[str]] = None, id_filter: str = "not_null",
+                      chunk_size: int = SQLITE_FETCH_SIZE) -> pd.DataFrame:
+    """Reads the (projected, filtered) table into one DataFrame."""
+    chunks = list(iter_sqlite_chunks(db_path, table_name, columns, id_filter, chunk_size))
+    if not chunks:
+        conn = sqlite3.connect(db_path)
+        try:
+            available = table_columns(conn, table_name)
+        finally:
+            conn.close()
+        return pd.DataFrame(columns=[col for col in available if columns is None or col == 'ID' or col in columns])
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+
+# --- 3. JOINING THE SOURCES ---
+
+def coalesce_merged(df_merged: pd.DataFrame) -> pd.DataFrame:
+    """Coalesces the suffixed columns of a CSV/SQLite merge, prioritizing the CSV file for competing values."""
+    common_cols = [col.replace('_csv', '') for col in df_merged.columns if '_csv' in col]
+    for col in common_cols:
+        csv_col = f"{col}_csv"
+        sqlite_col = f"{col}_sqlite"
+        # The CSV value takes priority. If it's missing, the SQLite value is used.
+        df_merged[col] = df_merged[csv_col].combine_first(df_merged[sqlite_col])
+
+    # Drop the temporary, suffixed columns
+    cols_to_drop = [col for col in df_merged.columns if '_csv' in col or '_sqlite' in col]
+    df_merged.drop(columns=cols_to_drop, inplace=True)
+    return df_merged
+
+
+def join_sources(df_csv: pd.DataFrame, df_sqlite: pd.DataFrame) -> pd.DataFrame:
+    """
+    Full outer join of both sources on ID, sorted by ID, with shared columns coalesced
+    (CSV first). Gives the same rows and column order as a pandas outer merge followed by
+    `coalesce_merged`, but as a hash join. Duplicate IDs fall back to that merge.
+    """
+    csv_ids, sqlite_ids = pd.Index(df_csv['ID']), pd.Index(df_sqlite['ID'])
+    if not (csv_ids.is_unique and sqlite_ids.is_unique):
+        logging.warning("Duplicate IDs in the sources; using a pandas merge instead of the hash join.")
+        merged = pd.merge(df_csv, df_sqlite, on='ID', how='outer', suffixes=('_csv', '_sqlite'))
+        return coalesce_merged(merged)
+
+    all_ids = csv_ids.union(sqlite_ids, sort=True)
+    csv_pos, sqlite_pos = csv_ids.get_indexer(all_ids), sqlite_ids.get_indexer(all_ids)
+
+    def _take(df: pd.DataFrame, col: str, positions) -> pd.Series:
+        return pd.Series(pd.api.extensions.take(df[col].to_numpy() if df[col].dtype.kind in 'biufcmM' else df[col].array,
+                                                positions, allow_fill=True), name=col)
+
+    sqlite_cols = [col for col in df_sqlite.columns if col != 'ID']
+    common = [col for col in df_csv.columns if col != 'ID' and col in set(sqlite_cols)]
+    columns = {}
+    # Same order as the merge: CSV-only columns (with ID), SQLite-only columns, then the coalesced ones
+    for col in df_csv.columns:
+        if col == 'ID':
+            columns['ID'] = pd.Series(all_ids.to_numpy(), name='ID', dtype=df_csv['ID'].dtype)
+        elif col not in common:
+            columns[col] = _take(df_csv, col, csv_pos)
+    for col in sqlite_cols:
+        if col not in common:
+            columns[col] = _take(df_sqlite, col, sqlite_pos)
+    for col in common:
+        columns[col] = _take(df_csv, col, csv_pos).combine_first(_take(df_sqlite, col, sqlite_pos))
+    return pd.DataFrame(columns)
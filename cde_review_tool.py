@@ -7,9 +7,11 @@ import pandas as pd
 import os
 import json
 import time
-from tqdm import tqdm
 from typing import Dict, List, Any
 
+import response_reader as reader
+from catalog_io import load_processed_catalog
+
 # --- CONFIGURATION ---
 CDE_CATALOG_PATH = os.path.join('outputs', 'stage_1', 'cde_catalog_processed.csv')
 COMMUNITY_DEFS_PATH = os.path.join('outputs', 'stage_2', 'community_definitions.json')
@@ -25,7 +27,8 @@ def load_cde_catalog():
     if not os.path.exists(CDE_CATALOG_PATH):
         st.error(f"CDE Catalog not found. Expected at: {CDE_CATALOG_PATH}")
         return None
-    return pd.read_csv(CDE_CATALOG_PATH, dtype={'ID': str}, low_memory=False)
+    # Plain text columns: accepted suggestions are written back into them
+    return load_processed_catalog(csv_path=CDE_CATALOG_PATH, categorical=False)
 
 @st.cache_data
 def load_community_definitions():
@@ -42,28 +45,11 @@ def load_and_process_suggestions(suggestions_dir: str):
     Aggregates all raw suggestions from Pass 1 into a structured format.
     Returns a tuple: (all_suggestions_dict, list_of_failed_files_with_errors)
     """
-    all_suggestions, failed_files = {}, []
     if not os.path.exists(suggestions_dir):
         st.error(f"Suggestions directory not found. Expected at: {suggestions_dir}")
         return {}, []
-    files_to_process = [f for f in os.listdir(suggestions_dir) if f.endswith(('.json', '.txt'))]
-    for filename in tqdm(files_to_process, desc="Loading AI Suggestions"):
-        filepath = os.path.join(suggestions_dir, filename)
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-            try:
-                data, suggestions_list = json.loads(content), []
-                if isinstance(data, dict) and "candidates" in data:
-                    text_content = data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-                    if text_content: suggestions_list = json.loads(text_content)
-                elif isinstance(data, list):
-                    suggestions_list = data
-                for sug in suggestions_list:
-                    if cde_id := sug.get("ID"):
-                        all_suggestions[str(cde_id)] = sug.get("suggestions", {})
-            except (json.JSONDecodeError, IndexError, TypeError) as e:
-                failed_files.append({"file": filename, "error": str(e), "content": content})
-    return all_suggestions, failed_files
+    # Parsed files are memoized by (path, mtime, size), so a refresh only re-reads changed files
+    return reader.load_suggestions(suggestions_dir)
 
 # --- STATE MANAGEMENT ---
 def load_review_state():
@@ -0,0 +1,181 @@
+# cluster_unmapped_values.py
+# Purpose: Groups the PVs Stage 1 could neither map nor parse into clusters of
+# near-duplicates, so one curated row in mapping/permissible_values_map.csv can
+# be copied across a whole cluster.
+# Each distinct value (on its pv_mapping canonical key) gets a MinHash signature
+# over character shingles. LSH banding only compares values that share a band,
+# so there is no all-pairs comparison. Candidate pairs whose estimated Jaccard
+# similarity clears the threshold are merged with union-find. Clusters are ranked
+# by the number of CDEs they cover, and the top ones get a draft mapping CSV with
+# the mapping file's header and columns. Once filled in, its rows (not the header)
+# are appended to the mapping file.
+
+import os
+import sys
+import glob
+import zlib
+import logging
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from pv_mapping import canonical_key
+
+# --- Basic Logging Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- 1. CONFIGURATION ---
+STAGE_1_OUTPUT_DIR = "outputs/stage_1"
+UNPARSED_REPORT_PATH = os.path.join(STAGE_1_OUTPUT_DIR, "unparsed_pv_report.csv")     # PV, n_cdes (preferred input)
+UNPARSABLE_LOG_PATH = os.path.join(STAGE_1_OUTPUT_DIR, "unparsable_values_log.csv")   # ID, PV (fallback input)
+OUTPUT_DIR = "outputs/pv_clusters"
+CLUSTERS_FILENAME = "pv_clusters.csv"
+DRAFT_FILENAME_TEMPLATE = "draft_map_cluster_{rank:04d}.csv"
+DRAFT_FILENAME_GLOB = "draft_map_cluster_*.csv"
+
+SHINGLE_SIZE = 4               # Characters per shingle
+NUM_PERMUTATIONS = 64          # MinHash signature length (= BANDS * ROWS_PER_BAND)
+BANDS = 16
+ROWS_PER_BAND = 4              # Pairs above ~(1/BANDS)^(1/ROWS_PER_BAND) = 0.5 similarity usually share a band
+SIMILARITY_THRESHOLD = 0.6     # Estimated Jaccard similarity required to merge a candidate pair
+MAX_DRAFT_CLUSTERS = 50        # Draft mapping files are written for this many top-ranked clusters
+SEED = 42
+
+MAPPING_COLUMNS = ['original_expression', 'standardized_pv', 'standardized_unit',
+                   'standardized_value_format', 'standardized_value_mapping']
+_PRIME = (1 << 31) - 1
+
+
+# --- 2. LOADING ---
+
+def load_unmapped_values() -> pd.DataFrame:
+    """Distinct unmapped PVs with their CDE counts, from the unparsed-PV report or else the unparsable-values log."""
+    if os.path.exists(UNPARSED_REPORT_PATH):
+        logging.info(f"Reading unmapped values from: {UNPARSED_REPORT_PATH}")
+        df = pd.read_csv(UNPARSED_REPORT_PATH, keep_default_na=False)
+        return df[['permissible_values', 'n_cdes']]
+    logging.info(f"Reading unmapped values from: {UNPARSABLE_LOG_PATH}")
+    df = pd.read_csv(UNPARSABLE_LOG_PATH, dtype=str, keep_default_na=False)
+    return df.groupby('permissible_values').size().rename('n_cdes').reset_index()
+
+
+# --- 3. MINHASH AND LSH ---
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """CRC32 hashes of the distinct character shingles of `text` (the whole text when it is shorter)."""
+    padded = f" {text} "
+    shingles = {padded[i:i + SHINGLE_SIZE] for i in range(max(len(padded) - SHINGLE_SIZE + 1, 1))}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signatures(texts: list) -> np.ndarray:
+    """One MinHash signature per text (rows), from NUM_PERMUTATIONS universal hash functions."""
+    rng = np.random.default_rng(SEED)
+    a = rng.integers(1, _PRIME, NUM_PERMUTATIONS, dtype=np.uint64)[:, None]
+    b = rng.integers(0, _PRIME, NUM_PERMUTATIONS, dtype=np.uint64)[:, None]
+    signatures = np.empty((len(texts), NUM_PERMUTATIONS), dtype=np.uint64)
+    for i, text in enumerate(texts):
+        hashes = shingle_hashes(text) % _PRIME
+        signatures[i] = ((a * hashes + b) % _PRIME).min(axis=1)
+    return signatures
+
+
+def _find(parent: np.ndarray, i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def lsh_clusters(signatures: np.ndarray) -> np.ndarray:
+    """
+    Cluster label per signature. Rows sharing a band bucket are compared with the bucket's
+    first member and merged (union-find) when their estimated similarity clears the threshold.
+    """
+    n = len(signatures)
+    parent = np.arange(n)
+    for band in range(BANDS):
+        buckets = defaultdict(list)
+        band_rows = signatures[:, band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        for i, row in enumerate(band_rows):
+            buckets[row.tobytes()].append(i)
+        for members in buckets.values():
+            first = members[0]
+            for other in members[1:]:
+                if (signatures[first] == signatures[other]).mean() >= SIMILARITY_THRESHOLD:
+                    root_a, root_b = _find(parent, first), _find(parent, other)
+                    if root_a != root_b:
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+    return np.array([_find(parent, i) for i in range(n)])
+
+
+def cluster_values(values: pd.DataFrame) -> pd.DataFrame:
+    """
+    Clusters the distinct PVs. Returns one row per PV with its cluster rank (1 = most CDEs),
+    the cluster's size and CDE total, ordered by rank and then by the PV's own CDE count.
+    """
+    values = values.copy()
+    values['canonical_key'] = values['permissible_values'].map(canonical_key)
+    keys = values['canonical_key'].drop_duplicates().tolist()
+    logging.info(f"Computing MinHash signatures for {len(keys)} canonical keys ({len(values)} distinct values)...")
+    labels = lsh_clusters(minhash_signatures(keys))
+    values['cluster'] = values['canonical_key'].map(dict(zip(keys, labels)))
+
+    totals = values.groupby('cluster').agg(cluster_n_cdes=('n_cdes', 'sum'), cluster_size=('n_cdes', 'size'))
+    totals = totals.sort_values(['cluster_n_cdes', 'cluster_size'], ascending=False, kind='stable')
+    totals['cluster_rank'] = np.arange(1, len(totals) + 1)
+    values = values.join(totals, on='cluster')
+    values = values.sort_values(['cluster_rank', 'n_cdes', 'permissible_values'], ascending=[True, False, True])
+    return values[['cluster_rank', 'cluster_size', 'cluster_n_cdes', 'permissible_values', 'n_cdes']].reset_index(drop=True)
+
+
+# --- 4. OUTPUTS ---
+
+def write_drafts(clusters: pd.DataFrame, output_dir: str) -> int:
+    """
+    Writes a draft mapping CSV (mapping-file header, standardized fields blank) for each top
+    cluster, after removing the drafts of earlier runs so none are left over from other clusters.
+    """
+    for stale in glob.glob(os.path.join(output_dir, DRAFT_FILENAME_GLOB)):
+        os.remove(stale)
+    written = 0
+    for rank, members in clusters.groupby('cluster_rank', sort=True):
+        if written >= MAX_DRAFT_CLUSTERS:
+            break
+        draft = pd.DataFrame({col: '' for col in MAPPING_COLUMNS}, index=range(len(members)))
+        draft['original_expression'] = members['permissible_values'].to_numpy()
+        # Same line endings as mapping/permissible_values_map.csv, so the rows below the header can be appended as-is
+        draft.to_csv(os.path.join(output_dir, DRAFT_FILENAME_TEMPLATE.format(rank=rank)), index=False, lineterminator='\r\n')
+        written += 1
+    return written
+
+
+def main():
+    """Clusters the unmapped PVs and writes the ranked cluster list and the draft mapping files."""
+    try:
+        values = load_unmapped_values()
+    except FileNotFoundError as e:
+        logging.error(f"No Stage 1 output to cluster ({e}). Run Stage 1 first.")
+        sys.exit(1)
+    values = values[values['permissible_values'].astype(str).str.strip() != '']
+    if values.empty:
+        logging.info("No unmapped values to cluster.")
+        return
+
+    clusters = cluster_values(values)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    clusters_path = os.path.join(OUTPUT_DIR, CLUSTERS_FILENAME)
+    clusters.to_csv(clusters_path, index=False)
+    n_drafts = write_drafts(clusters, OUTPUT_DIR)
+
+    n_clusters = clusters['cluster_rank'].nunique()
+    top = clusters.drop_duplicates('cluster_rank').head(MAX_DRAFT_CLUSTERS)
+    logging.info(f"Grouped {len(clusters)} distinct values into {n_clusters} clusters "
+                 f"({int((clusters['cluster_size'] > 1).sum())} values in multi-value clusters). Saved to: {clusters_path}")
+    logging.info(f"Wrote {n_drafts} draft mapping files to {OUTPUT_DIR}; they cover "
+                 f"{int(top['cluster_n_cdes'].sum())} of {int(clusters['n_cdes'].sum())} unmapped CDEs.")
+
+
+if __name__ == "__main__":
+    main()
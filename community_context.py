@@ -0,0 +1,216 @@
+# community_context.py
+# Purpose: Builds the community context text that is stored in the Stage 3 cache.
+# Titles are deduplicated, ranked by proximity to the sub-group hubs and cut at a
+# token cap, instead of joining every member title of the parent community.
+# Run this file directly to compare cache size and redundancy-detection recall
+# against the original full-context strategy.
+
+import os
+import re
+import json
+import math
+import logging
+import threading
+import unicodedata
+from typing import List, Dict, Any, Optional, Iterable
+
+import response_reader as reader
+
+# --- 1. CONFIGURATION ---
+
+# Maximum estimated tokens of community context placed in a cache.
+CONTEXT_MAX_TOKENS = 8000
+CHARS_PER_TOKEN_ESTIMATE = 4.0
+# Separator used between titles (matches the original cache layout).
+TITLE_SEPARATOR = "\n- "
+
+# -- Budget report --
+COMMUNITY_DEFINITIONS_PATH = os.path.join('outputs', 'stage_2', 'community_definitions.json')
+PASS_1_RAW_DIR = os.path.join('stage3_adjudication_output', 'pass_1_raw_responses')
+REPORT_FILENAME = os.path.join('stage3_adjudication_output', 'logs', 'context_budget_report.csv')
+
+
+# --- 2. RANKING AND BUILDING ---
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the token count of a text from its character length."""
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN_ESTIMATE))
+
+
+def normalize_title(title: Any) -> str:
+    """Canonical form used to detect duplicate titles (case, whitespace and punctuation insensitive)."""
+    if not isinstance(title, str):
+        return ''
+    text = unicodedata.normalize('NFKC', title).casefold()
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+def _as_dict(community: Any) -> Dict[str, Any]:
+    """Accepts either a ParentCommunity model or its plain-dict form."""
+    return community.model_dump() if hasattr(community, 'model_dump') else community
+
+
+def rank_members_by_hub_proximity(community: Any, focus_group_ids: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Orders community members by relevance to the sub-groups.
+    Stage 2 lists each hub-and-spoke group as [hub] + spokes sorted by edge weight
+    to the hub, so a member's position within its group is its hub proximity.
+    Members of `focus_group_ids` come first; the rest are interleaved round-robin
+    (every hub, then every hub's nearest spoke, ...), hub-and-spoke before orphans.
+    """
+    community = _as_dict(community)
+    focus = set(focus_group_ids or [])
+    ranked_entries = []
+    for group_index, group in enumerate(community.get('sub_groups', [])):
+        is_focus = group['group_id'] in focus
+        is_orphan = group.get('group_type') == 'orphan'
+        for depth, cde_id in enumerate(group.get('member_cde_ids', [])):
+            ranked_entries.append(((not is_focus, depth, is_orphan, group_index), str(cde_id)))
+    ranked_entries.sort(key=lambda entry: entry[0])
+
+    ranked_ids, seen = [], set()
+    for _, cde_id in ranked_entries:
+        if cde_id not in seen:
+            seen.add(cde_id)
+            ranked_ids.append(cde_id)
+    # Members not assigned to any sub-group go last, in their original order.
+    for cde_id in community.get('member_cde_ids', []):
+        if str(cde_id) not in seen:
+            seen.add(str(cde_id))
+            ranked_ids.append(str(cde_id))
+    return ranked_ids
+
+
+def build_community_context(
+    community: Any,
+    cde_lookup: Dict[str, Dict],
+    max_tokens: int = CONTEXT_MAX_TOKENS,
+    focus_group_ids: Optional[Iterable[str]] = None
+) -> str:
+    """Returns deduplicated, relevance-ranked member titles, cut at `max_tokens`."""
+    lines, seen_titles = [], set()
+    used_tokens = 0
+    for cde_id in rank_members_by_hub_proximity(community, focus_group_ids):
+        title = cde_lookup.get(cde_id, {}).get('title')
+        key = normalize_title(title)
+        if not key or key in seen_titles:
+            continue
+        line_tokens = estimate_tokens(TITLE_SEPARATOR + title.strip())
+        if used_tokens + line_tokens > max_tokens:
+            break
+        seen_titles.add(key)
+        lines.append(title.strip())
+        used_tokens += line_tokens
+    return TITLE_SEPARATOR.join(lines)
+
+
+class CommunityContextBuilder:
+    """Builds community contexts lazily and memoizes them (thread-safe)."""
+
+    def __init__(self, cde_lookup: Dict[str, Dict], community_definitions: Iterable[Any], max_tokens: int = CONTEXT_MAX_TOKENS):
+        self.cde_lookup = cde_lookup
+        self.max_tokens = max_tokens
+        self.communities = {c['community_id']: c for c in (_as_dict(c) for c in community_definitions)}
+        self._group_of_cde = {}
+        for comm in self.communities.values():
+            for group in comm['sub_groups']:
+                for cde_id in group['member_cde_ids']:
+                    self._group_of_cde.setdefault(str(cde_id), group['group_id'])
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, community_id: str, focus_group_ids: Optional[Iterable[str]] = None) -> str:
+        """Returns the context for a community, building it on first use."""
+        key = (community_id, frozenset(focus_group_ids or []))
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+        community = self.communities.get(community_id)
+        context = build_community_context(community, self.cde_lookup, self.max_tokens, focus_group_ids) if community else ""
+        with self._lock:
+            self._cache[key] = context
+        return context
+
+    def get_for_cdes(self, community_id: str, cde_ids: Iterable[str]) -> str:
+        """Returns the context focused on the sub-groups that contain `cde_ids`."""
+        focus = {self._group_of_cde[str(cde_id)] for cde_id in cde_ids if str(cde_id) in self._group_of_cde}
+        return self.get(community_id, focus)
+
+
+# --- 3. BUDGET REPORT ---
+
+def _load_redundancy_pairs(raw_dir: str) -> List[tuple]:
+    """Reads (cde_id, redundant_with_id) pairs flagged by the model in recorded Pass 1 responses."""
+    pairs = []
+    if not os.path.isdir(raw_dir):
+        return pairs
+    for filename in reader.list_response_files(raw_dir, ('.json',)):
+        parsed = reader.read_response(os.path.join(raw_dir, filename))
+        if parsed.status == 'malformed':
+            logging.warning(f"Skipping unreadable response file {filename}: {parsed.error}")
+            continue
+        for item in parsed.items:
+            suggestions = item.get("suggestions")
+            if isinstance(suggestions, dict) and suggestions.get("redundancy_flag") and suggestions.get("redundant_with_ids"):
+                for other_id in str(suggestions["redundant_with_ids"]).split('|'):
+                    if other_id.strip():
+                        pairs.append((str(item.get("ID")), other_id.strip()))
+    return pairs
+
+
+def run_context_budget_report(max_tokens: int = CONTEXT_MAX_TOKENS):
+    """
+    Compares full vs bounded context per community. Recall is the share of
+    redundancy partners flagged in Pass 1 whose title is still in the bounded context.
+    """
+    import pandas as pd
+    from catalog_io import load_processed_catalog
+
+    with open(COMMUNITY_DEFINITIONS_PATH, 'r', encoding='utf-8') as f:
+        community_definitions = json.load(f)
+    cde_df = load_processed_catalog(columns=['title'])
+    cde_lookup = cde_df.set_index('ID').to_dict('index')
+    community_of_cde = {str(cde_id): c['community_id'] for c in community_definitions for cde_id in c['member_cde_ids']}
+    pairs = _load_redundancy_pairs(PASS_1_RAW_DIR)
+
+    rows = []
+    for comm in community_definitions:
+        member_titles = [cde_lookup.get(str(i), {}).get('title') for i in comm['member_cde_ids']]
+        full_text = TITLE_SEPARATOR.join(t for t in member_titles if isinstance(t, str) and t)
+        bounded_text = build_community_context(comm, cde_lookup, max_tokens)
+        kept_titles = {normalize_title(t) for t in bounded_text.split(TITLE_SEPARATOR)}
+        comm_pairs = [p for p in pairs if community_of_cde.get(p[1]) == comm['community_id']]
+        recalled = sum(1 for _, other_id in comm_pairs if normalize_title(cde_lookup.get(other_id, {}).get('title')) in kept_titles)
+        rows.append({
+            'community_id': comm['community_id'],
+            'member_count': comm['total_cde_count'],
+            'full_tokens': estimate_tokens(full_text),
+            'bounded_tokens': estimate_tokens(bounded_text),
+            'redundancy_pairs': len(comm_pairs),
+            'pairs_recalled': recalled,
+        })
+
+    report_df = pd.DataFrame(rows)
+    os.makedirs(os.path.dirname(REPORT_FILENAME), exist_ok=True)
+    report_df.to_csv(REPORT_FILENAME, index=False)
+
+    full_total, bounded_total = int(report_df['full_tokens'].sum()), int(report_df['bounded_tokens'].sum())
+    pair_total, recalled_total = int(report_df['redundancy_pairs'].sum()), int(report_df['pairs_recalled'].sum())
+    print("\n" + "=" * 80)
+    print(f"--- COMMUNITY CONTEXT BUDGET REPORT (cap: {max_tokens:,} tokens) ---")
+    print(f"Communities: {len(report_df):,}")
+    print(f"Cached context tokens (full):    {full_total:>12,}")
+    print(f"Cached context tokens (bounded): {bounded_total:>12,}  "
+          f"({100.0 * (1 - bounded_total / max(full_total, 1)):.2f}% reduction)")
+    if pair_total:
+        print(f"Redundancy-partner recall:       {recalled_total:,}/{pair_total:,} ({100.0 * recalled_total / pair_total:.2f}%)")
+    else:
+        print("Redundancy-partner recall:       n/a (no redundancy pairs found in Pass 1 responses)")
+    print(f"Per-community detail saved to: {REPORT_FILENAME}")
+    print("=" * 80 + "\n")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    run_context_budget_report()
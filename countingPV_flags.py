@@ -1,7 +1,7 @@
-import pandas as pd
+from catalog_io import load_processed_catalog
 
-# Load the CSV file
-df = pd.read_csv('outputs/stage_1/cde_catalog_processed.csv')
+# Load only the flag column (from the typed Parquet catalog when available)
+df = load_processed_catalog(columns=['flag_bad_permissibles'])
 
 # Count how many times 'True' appears in 'flag_bad_permissibles'
 flag_count = (df['flag_bad_permissibles'] == True).sum()
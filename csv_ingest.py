@@ -0,0 +1,246 @@
+# csv_ingest.py
+# Purpose: Fault-isolating CSV ingestion for the source catalog.
+# The catalog CSV used to be read with `engine='python', on_bad_lines='warn'`.
+# That is slow, and bad lines were dropped with nothing but a console warning.
+# Here the file is first scanned through a memory map: NUL bytes, invalid UTF-8,
+# stray quotes and records with too many fields are located with numpy over the
+# raw bytes. Only the quote runs go through a small state machine, which follows
+# the C parser's quoting rules. Records with a problem are written to a
+# quarantine CSV with their line numbers. The remaining records are streamed
+# straight from the map into pandas' C parser.
+# Run directly to scan a file and write its quarantine report (this replaces
+# the manual debugCSVread / debug_file_integrity / debug_pandas_chunking checks).
+
+import io
+import os
+import sys
+import mmap
+import logging
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+
+# --- 1. CONFIGURATION ---
+
+# The C parser infers column types like the python engine did. The 'pyarrow' engine is faster
+# on multi-core machines, but it rejects short rows and infers timestamps from date-like text.
+PARSER_ENGINE = 'c'
+
+TARGET_FILE = os.path.join('cdeCatalogs', 'cdeCatalog.csv')
+QUARANTINE_FILE = os.path.join('outputs', 'stage_1', 'quarantined_csv_lines.csv')
+DECODE_CHUNK_BYTES = 16 * 2**20       # UTF-8 validation works in newline-aligned blocks of this size
+QUARANTINE_COLUMNS = ['line_number', 'n_lines', 'reason', 'raw_text']
+
+_NEWLINE, _CARRIAGE_RETURN, _QUOTE, _COMMA, _NUL = 10, 13, 34, 44, 0
+
+
+class CsvScan(NamedTuple):
+    size: int
+    n_lines: int
+    n_records: int                    # Including the header
+    good_ranges: List[Tuple[int, int]]  # Byte ranges of the records to parse, in file order
+    quarantine: pd.DataFrame          # QUARANTINE_COLUMNS, one row per rejected record
+
+
+# --- 2. SCANNING ---
+
+def _invalid_utf8_offsets(mm, size: int) -> List[int]:
+    """Byte offsets of invalid UTF-8 sequences, found by decoding newline-aligned blocks."""
+    offsets, pos = [], 0
+    while pos < size:
+        end = size if pos + DECODE_CHUNK_BYTES >= size else mm.rfind(b'\n', pos, pos + DECODE_CHUNK_BYTES) + 1
+        if end <= pos:
+            end = min(size, pos + DECODE_CHUNK_BYTES)
+        block, start = mm[pos:end], 0
+        while True:
+            try:
+                block[start:].decode('utf-8')
+                break
+            except UnicodeDecodeError as e:
+                offsets.append(pos + start + e.start)
+                start += e.end
+        pos = end
+    return offsets
+
+
+def _quoted_intervals(buf: np.ndarray, line_starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+    """
+    Byte intervals [open, close) inside quoted fields, and the lines holding a stray quote.
+    A run of quotes opens a field when it has odd length at the start of a field. Inside a
+    field, an odd run closes it (the others are "" escapes). As in the C parser, a quote in
+    the middle of an unquoted field is literal. A closing quote followed by anything but a
+    delimiter or line end means the field was never meant to open. Its opening line is then
+    marked bad and scanning resumes there. A field still open at the end of the file is
+    handled the same way.
+    """
+    quotes = np.flatnonzero(buf == _QUOTE)
+    if not len(quotes):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), []
+    is_run_start = np.r_[True, np.diff(quotes) != 1]
+    run_starts = quotes[is_run_start]
+    run_lengths = np.diff(np.r_[np.flatnonzero(is_run_start), len(quotes)])
+    run_ends = run_starts + run_lengths
+    prev_bytes = np.where(run_starts > 0, buf[np.maximum(run_starts - 1, 0)], _NEWLINE)
+    next_bytes = np.where(run_ends < len(buf), buf[np.minimum(run_ends, len(buf) - 1)], _NEWLINE)
+    at_field_start = np.isin(prev_bytes, (_COMMA, _NEWLINE)).tolist()
+    closes_cleanly = np.isin(next_bytes, (_COMMA, _NEWLINE, _CARRIAGE_RETURN)).tolist()
+    run_lines = (np.searchsorted(line_starts, run_starts, side='right') - 1).tolist()
+
+    opens, closes, stray_lines = [], [], []
+    inside, open_pos, open_line = False, 0, 0
+    for start, length, end, field_start, clean, line in zip(run_starts.tolist(), run_lengths.tolist(), run_ends.tolist(),
+                                                            at_field_start, closes_cleanly, run_lines):
+        if inside:
+            if length % 2 == 0:
+                continue
+            if clean:
+                opens.append(open_pos)
+                closes.append(end - 1)
+                inside = False
+                continue
+            stray_lines.append(open_line)
+            inside = False
+        if field_start and length % 2:
+            inside, open_pos, open_line = True, start, line
+    if inside:
+        stray_lines.append(open_line)
+    return np.array(opens, dtype=np.int64), np.array(closes, dtype=np.int64), stray_lines
+
+
+def _is_quoted(positions: np.ndarray, opens: np.ndarray, closes: np.ndarray) -> np.ndarray:
+    k = np.searchsorted(opens, positions, side='right')
+    return (k > 0) & (positions < closes[np.maximum(k - 1, 0)]) if len(opens) else np.zeros(len(positions), dtype=bool)
+
+
+def scan_csv(mm, size: int) -> CsvScan:
+    """Locates the records of a mapped CSV file and the ones that would not parse cleanly."""
+    buf = np.frombuffer(mm, dtype=np.uint8, count=size)
+    newlines = np.flatnonzero(buf == _NEWLINE)
+    line_starts = np.r_[0, newlines + 1]
+    if line_starts[-1] == size:
+        line_starts = line_starts[:-1]
+    n_lines = len(line_starts)
+
+    def _line_of(positions) -> np.ndarray:
+        return np.searchsorted(line_starts, np.asarray(positions, dtype=np.int64), side='right') - 1
+
+    opens, closes, stray_lines = _quoted_intervals(buf, line_starts)
+    # A line continues the previous record when the newline before it is inside a quoted field
+    continues = np.r_[False, _is_quoted(line_starts[1:] - 1, opens, closes)]
+    record_of_line = np.cumsum(~continues) - 1
+    record_first_line = np.flatnonzero(~continues)
+    n_records = len(record_first_line)
+
+    reasons = {}
+    for reason, lines in (('nul_byte', _line_of(np.flatnonzero(buf == _NUL))),
+                          ('invalid_utf8', _line_of(_invalid_utf8_offsets(mm, size))),
+                          ('unbalanced_quote', np.asarray(stray_lines, dtype=np.int64))):
+        for record in np.unique(record_of_line[lines]).tolist():
+            reasons.setdefault(record, []).append(reason)
+
+    commas = np.flatnonzero(buf == _COMMA)
+    commas = commas[~_is_quoted(commas, opens, closes)]
+    n_fields = np.bincount(record_of_line[_line_of(commas)], minlength=n_records) + 1
+    if 0 in reasons:
+        raise ValueError(f"The CSV header is unreadable ({', '.join(reasons[0])}).")
+    for record in np.flatnonzero(n_fields > n_fields[0]).tolist():
+        reasons.setdefault(record, []).append('too_many_fields')
+    del buf
+
+    record_starts = line_starts[record_first_line]
+    record_ends = np.r_[record_starts[1:], size]
+    bad = np.zeros(n_records, dtype=bool)
+    bad[list(reasons)] = True
+    rows = []
+    for record in sorted(reasons):
+        start, end = int(record_starts[record]), int(record_ends[record])
+        raw = mm[start:end].decode('utf-8', 'backslashreplace').replace('\x00', '\\x00').rstrip('\r\n')
+        next_first = record_first_line[record + 1] if record + 1 < n_records else n_lines
+        rows.append((int(record_first_line[record]) + 1, int(next_first - record_first_line[record]),
+                     ';'.join(reasons[record]), raw))
+
+    # Runs of consecutive good records become one byte range each
+    good = ~bad
+    run_starts = good & np.r_[True, bad[:-1]]
+    run_ends = good & np.r_[bad[1:], True]
+    good_ranges = list(zip(record_starts[run_starts].tolist(), record_ends[run_ends].tolist()))
+    return CsvScan(size, n_lines, n_records, good_ranges, pd.DataFrame(rows, columns=QUARANTINE_COLUMNS))
+
+
+# --- 3. READING ---
+
+class _ByteRanges(io.RawIOBase):
+    """A read-only stream over selected byte ranges of a memory map."""
+
+    def __init__(self, mm, ranges: List[Tuple[int, int]]):
+        self._mm, self._ranges, self._index = mm, ranges, 0
+        self._pos = ranges[0][0] if ranges else 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while self._index < len(self._ranges):
+            end = self._ranges[self._index][1]
+            if self._pos < end:
+                n = min(len(b), end - self._pos)
+                b[:n] = self._mm[self._pos:self._pos + n]
+                self._pos += n
+                return n
+            self._index += 1
+            if self._index < len(self._ranges):
+                self._pos = self._ranges[self._index][0]
+        return 0
+
+
+def write_quarantine(quarantine: pd.DataFrame, quarantine_path: str):
+    """Writes the rejected records (an empty file with the header when there are none)."""
+    os.makedirs(os.path.dirname(quarantine_path) or '.', exist_ok=True)
+    quarantine.to_csv(quarantine_path, index=False)
+    if len(quarantine):
+        counts = quarantine['reason'].str.split(';').explode().value_counts()
+        logging.warning(f"Quarantined {len(quarantine)} unparseable CSV records to {quarantine_path}: " +
+                        ", ".join(f"{count} {reason}" for reason, count in counts.items()))
+
+
+@contextmanager
+def checked_csv(path: str, quarantine_path: str) -> Iterator[io.BufferedReader]:
+    """
+    Scans `path`, writes its quarantine file and yields a binary stream of the remaining
+    records (header first) for pd.read_csv. The stream is valid inside the `with` block.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            raise ValueError(f"'{path}' is empty.")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            scan = scan_csv(mm, size)
+            logging.info(f"Scanned {path}: {scan.n_records - 1:,} records on {scan.n_lines:,} lines, "
+                         f"{len(scan.quarantine)} quarantined.")
+            write_quarantine(scan.quarantine, quarantine_path)
+            stream = io.BufferedReader(_ByteRanges(mm, scan.good_ranges), buffer_size=2**20)
+            try:
+                yield stream
+            finally:
+                stream.close()
+        finally:
+            mm.close()
+
+
+def read_csv_checked(path: str, quarantine_path: str, **read_csv_kwargs) -> pd.DataFrame:
+    """pd.read_csv of the records that passed the scan."""
+    with checked_csv(path, quarantine_path) as stream:
+        return pd.read_csv(stream, engine=PARSER_ENGINE, **read_csv_kwargs)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    target = sys.argv[1] if len(sys.argv) > 1 else TARGET_FILE
+    if not os.path.exists(target):
+        logging.error(f"File not found: {target}")
+        sys.exit(1)
+    df = read_csv_checked(target, QUARANTINE_FILE, dtype=str)
+    logging.info(f"Parsed {len(df):,} rows and {len(df.columns)} columns with the '{PARSER_ENGINE}' engine.")
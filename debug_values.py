@@ -1,9 +1,10 @@
 import pandas as pd
-import re
 import os
 import sys
 import logging
 
+from pv_classifier import classify_series, UNMATCHED
+
 # --- Basic Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -17,35 +18,15 @@ DIAGNOSTIC_FILENAME = "diagnostic_format_report.csv"
 def diagnose_formats(df: pd.DataFrame) -> pd.DataFrame:
     """
     Analyzes the 'Values' column and generates a report on which patterns match.
+    Uses the single-pass classifier shared with Stage 1 (first matching class wins).
     """
     logging.info("Starting format diagnosis...")
     
-    # Define all patterns we intend to handle
-    patterns = {
-        'placeholder': re.compile(r'^(free text|numeric|integer|float|text|boolean)$', re.IGNORECASE),
-        'key_value_meta': re.compile(r'min:.*max:', re.IGNORECASE),
-        'ordinal_scale': re.compile(r'(\d+:\s*[\w\s]+)', re.IGNORECASE),
-        'interval_simple': re.compile(r'^\s*(\d+\.?\d*)\s*-\s*(\d+\.?\d*)\s*$'),
-        'json_array': re.compile(r'^\s*\[.*\]\s*$'),
-        'pipe_separated': re.compile(r'.*\|.*'),
-        'constraint_expression': re.compile(r'^\(y>=.*\)$', re.IGNORECASE)
-    }
-    
-    results = []
-    
-    unique_values = df['Values'].astype(str).dropna().unique()
+    unique_values = pd.Series(df['Values'].astype(str).dropna().unique(), dtype=object)
     logging.info(f"Analyzing {len(unique_values)} unique 'Values' entries...")
 
-    for value in unique_values:
-        matched_pattern = "Unmatched" # Default
-        for name, pattern in patterns.items():
-            if pattern.search(value):
-                matched_pattern = name
-                break # Stop after first match
-        
-        results.append({'value': value, 'matched_pattern': matched_pattern})
-        
-    return pd.DataFrame(results)
+    matched = classify_series(unique_values)['format_class'].replace(UNMATCHED, "Unmatched")
+    return pd.DataFrame({'value': unique_values, 'matched_pattern': matched})
 
 def main():
     """Main function to run the diagnostic process."""
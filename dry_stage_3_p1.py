@@ -7,13 +7,15 @@
 import os
 import json
 import logging
-import pandas as pd
 from dotenv import load_dotenv
 import time
 from typing import Tuple, Optional
 
 # --- Import from the shared utility module ---
 import v2_shared_utils as utils
+import payload_encoder as encoder
+from community_context import CommunityContextBuilder
+from catalog_io import load_processed_catalog
 # --- Import prompts from the main scripts ---
 from v4_stage_3_pass_1 import SYSTEM_PROMPT_PASS_1
 from v4_stage_3_pass_2 import SYSTEM_PROMPT_PASS_2, AIResponsePass2, aggregate_and_filter_pass_1_results, create_pass_2_batches
@@ -46,13 +48,12 @@ def run_test(api_key: str, pass_number: int, group_id: str, dry_run: bool = Fals
 
     # --- 1. Load Common Files ---
     community_definitions_path = os.path.join('outputs', 'stage_2', 'community_definitions.json')
-    processed_catalog_path = os.path.join('outputs', 'stage_1', 'cde_catalog_processed.csv')
 
     try:
         with open(community_definitions_path, 'r') as f:
             community_definitions = [utils.ParentCommunity.model_validate(item) for item in json.load(f)]
-        cde_df = pd.read_csv(processed_catalog_path, dtype={'ID': str}, low_memory=False)
-        cde_df['title'] = cde_df['title'].astype(str).fillna('')
+        cde_df = load_processed_catalog(columns=encoder.PASS_1_CATALOG_COLUMNS + encoder.PASS_2_CATALOG_COLUMNS)
+        cde_df['title'] = cde_df['title'].fillna('')
         cde_lookup = cde_df.set_index('ID').to_dict('index')
     except Exception as e:
         logging.fatal(f"Could not load critical input files: {e}")
@@ -70,15 +71,7 @@ def run_test(api_key: str, pass_number: int, group_id: str, dry_run: bool = Fals
         for cde_id in target_group.get("member_cde_ids", []):
             full_cde = cde_lookup.get(str(cde_id))
             if full_cde:
-                minimal_cde = {
-                    "ID": full_cde.get('ID'), "title": full_cde.get('title'),
-                    "short_description": full_cde.get('short_description'),
-                    "variable_name": full_cde.get('variable_name'),
-                    "permissible_values": full_cde.get('permissible_values'),
-                    "value_mapping": full_cde.get('value_mapping'),
-                    "quality_flags": {"is_bad_variable_name": full_cde.get('flag_bad_variable_name', False)}
-                }
-                cde_group_data.append(minimal_cde)
+                cde_group_data.append(encoder.build_pass_1_record(str(cde_id), full_cde, encoder.USE_SHORT_KEYS))
         prompt_payload = {"group_id_for_request": group_id, "cde_group_for_review": cde_group_data}
     elif pass_number == 2:
         cdes_to_process = aggregate_and_filter_pass_1_results(utils.RAW_DIR_PASS_1)
@@ -92,7 +85,7 @@ def run_test(api_key: str, pass_number: int, group_id: str, dry_run: bool = Fals
         logging.error("Invalid pass number specified. Must be 1 or 2.")
         return
 
-    prompt_text_for_api = json.dumps(prompt_payload)
+    prompt_text_for_api = encoder.encode_prompt_payload(prompt_payload["group_id_for_request"], prompt_payload["cde_group_for_review"])
 
     # --- 3. Execute Dry Run or Full Run ---
     if dry_run:
@@ -117,18 +110,16 @@ def run_test(api_key: str, pass_number: int, group_id: str, dry_run: bool = Fals
         # Re-fetch context info needed for a full run
         if pass_number == 1:
             _, parent_community = find_group_in_communities(group_id, [c.model_dump() for c in community_definitions])
-            community_member_titles = [str(cde_lookup.get(str(id), {}).get('title', '')) for id in parent_community['member_cde_ids']]
-            community_context_text = "\n- ".join(filter(None, community_member_titles))
-            system_prompt = SYSTEM_PROMPT_PASS_1
+            community_context_text = CommunityContextBuilder(cde_lookup, community_definitions).get(parent_community['community_id'])
+            system_prompt = encoder.system_prompt_with_legend(SYSTEM_PROMPT_PASS_1)
             cache_display_name = f"test_cache_{group_id}"
             raw_response_dir = utils.RAW_DIR_PASS_1
         elif pass_number == 2:
             pass_2_batches = create_pass_2_batches(aggregate_and_filter_pass_1_results(utils.RAW_DIR_PASS_1), [c.model_dump() for c in community_definitions], cde_lookup)
             target_batch = next((batch for batch in pass_2_batches if batch['group_id'] == group_id), None)
             parent_community_id = target_batch['community_id']
-            community_context_map = {comm.community_id: "\n- ".join(filter(None, [str(cde_lookup.get(str(id), {}).get('title', '')) for id in comm.member_cde_ids])) for comm in community_definitions}
-            community_context_text = community_context_map.get(parent_community_id, "")
-            system_prompt = SYSTEM_PROMPT_PASS_2
+            community_context_text = CommunityContextBuilder(cde_lookup, community_definitions).get_for_cdes(parent_community_id, target_batch["cde_ids"])
+            system_prompt = encoder.system_prompt_with_legend(SYSTEM_PROMPT_PASS_2)
             cache_display_name = f"test_cache_{group_id}"
             raw_response_dir = utils.RAW_DIR_PASS_2
 
@@ -0,0 +1,269 @@
+# hedged_requests.py
+# Purpose: Optional request hedging for Stage 3 generateContent calls.
+# When a call runs longer than a dynamic percentile of recently observed latencies,
+# a duplicate is issued (within a hedge budget). The first valid response wins;
+# the loser is cancelled if it has not started, otherwise its result is discarded
+# and its token usage is still logged, because the API bills it either way.
+
+import time
+import logging
+import threading
+import concurrent.futures
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple
+
+import requests
+
+import shared_utils as utils
+from run_metrics import METRICS
+
+# --- 1. CONFIGURATION ---
+
+ENABLE_HEDGING = False
+HEDGE_PERCENTILE = 95          # Hedge once a call exceeds this percentile of observed latency
+HEDGE_MIN_SAMPLES = 20         # No hedging until this many latencies have been observed
+HEDGE_MIN_DELAY_S = 30.0       # Never hedge earlier than this
+HEDGE_BUDGET_FRACTION = 0.10   # At most this share of requests may be hedged
+LATENCY_WINDOW = 500           # Number of recent latencies used for the percentile
+LOSER_DRAIN_TIMEOUT_S = 60.0   # How long to wait for in-flight losers at the end of a run
+
+
+# --- 2. LATENCY TRACKING AND STATISTICS ---
+
+class LatencyTracker:
+    """Keeps a sliding window of valid call latencies, hedge losers included (thread-safe)."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if not self._latencies:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def hedge_delay(self) -> Optional[float]:
+        """Returns the hedge trigger delay, or None while there are too few samples."""
+        with self._lock:
+            sample_count = len(self._latencies)
+        if sample_count < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY_S, self.percentile(HEDGE_PERCENTILE))
+
+
+class HedgeStats:
+    """Counts hedges and collects loser usage for the token log (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges_issued = 0
+        self.hedge_wins = 0
+        self.losers_cancelled = 0
+        self.loser_cost_usd = 0.0
+        self.time_saved_s = 0.0
+        self._pending_loser_usage: List[Tuple[str, Dict[str, int]]] = []
+        self._outstanding_losers: List[concurrent.futures.Future] = []
+
+    def start_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def try_acquire_hedge(self) -> bool:
+        """Reserves a hedge if the budget allows it."""
+        with self._lock:
+            if self.hedges_issued + 1 > HEDGE_BUDGET_FRACTION * self.requests:
+                return False
+            self.hedges_issued += 1
+            return True
+
+    def record_win(self, hedge_won: bool):
+        with self._lock:
+            if hedge_won:
+                self.hedge_wins += 1
+
+    def record_loser(self, group_id: str, usage: Dict[str, int]):
+        with self._lock:
+            self._pending_loser_usage.append((group_id, usage))
+            self.loser_cost_usd += utils.compute_call_cost(usage)
+
+    def record_cancelled(self):
+        with self._lock:
+            self.losers_cancelled += 1
+
+    def record_time_saved(self, seconds: float):
+        with self._lock:
+            self.time_saved_s += max(0.0, seconds)
+
+    def track_outstanding(self, future: concurrent.futures.Future):
+        with self._lock:
+            self._outstanding_losers.append(future)
+
+    def drain_loser_usage(self) -> List[Tuple[str, Dict[str, int]]]:
+        with self._lock:
+            drained, self._pending_loser_usage = self._pending_loser_usage, []
+        return drained
+
+    def wait_for_losers(self, timeout: float = LOSER_DRAIN_TIMEOUT_S):
+        with self._lock:
+            outstanding = [f for f in self._outstanding_losers if not f.done()]
+        if outstanding:
+            logging.info(f"Waiting up to {timeout:.0f}s for {len(outstanding)} in-flight hedge loser(s) to report usage...")
+            concurrent.futures.wait(outstanding, timeout=timeout)
+
+    def report(self, pass_name: str):
+        """Logs the latency/cost trade-off of hedging for this run."""
+        with self._lock:
+            if not self.hedges_issued:
+                logging.info(f"[{pass_name}] Request hedging: no hedges issued across {self.requests} requests.")
+                return
+            p50, p95 = LATENCY.percentile(50), LATENCY.percentile(95)
+            logging.info(
+                f"[{pass_name}] Request hedging: {self.hedges_issued}/{self.requests} requests hedged "
+                f"({100.0 * self.hedges_issued / max(self.requests, 1):.1f}%), hedge won {self.hedge_wins}, "
+                f"{self.losers_cancelled} loser(s) cancelled before sending. "
+                f"Extra cost: ${self.loser_cost_usd:.4f}. Observed wall-time saved: {self.time_saved_s:.0f}s. "
+                f"Latency p50/p95: {p50 or 0:.1f}s/{p95 or 0:.1f}s."
+            )
+
+
+LATENCY = LatencyTracker()
+HEDGE_STATS = HedgeStats()
+_ATTEMPT_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=utils.MAX_WORKERS * 2, thread_name_prefix="hedge")
+
+
+# --- 3. HEDGED CALL ---
+
+def _timed_post(prompt_text: str, cache_name: str, api_key: str) -> Tuple[requests.Response, Optional[dict], float, float]:
+    """Performs one attempt. Returns (response, decoded body or None, start time, latency)."""
+    start = time.monotonic()
+    with requests.Session() as session:
+        resp = utils.post_generate_content(prompt_text, cache_name, api_key, session=session)
+    latency = time.monotonic() - start
+    # Decode the body exactly once; every later check reuses this structure
+    try:
+        body = utils.decode_json(resp.content)
+    except ValueError:
+        body = None
+    return resp, body if isinstance(body, dict) else None, start, latency
+
+
+def _is_valid(resp: requests.Response, body: Optional[dict]) -> bool:
+    """A valid response is a 2xx JSON body with at least one candidate."""
+    return resp.ok and body is not None and bool(body.get("candidates"))
+
+
+def _record_latency(future: concurrent.futures.Future):
+    """Done callback for every attempt: valid responses, winner or loser, feed the latency window."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    resp, body, _, latency = future.result()
+    # Fast 429/5xx answers would drag the percentiles (and the hedge trigger) towards error latency
+    if _is_valid(resp, body):
+        LATENCY.record(latency)
+
+
+def _submit_attempt(prompt_text: str, cache_name: str, api_key: str) -> concurrent.futures.Future:
+    future = _ATTEMPT_EXECUTOR.submit(_timed_post, prompt_text, cache_name, api_key)
+    future.add_done_callback(_record_latency)
+    return future
+
+
+def _billed_prompt_usage(winner_usage: Dict[str, int]) -> Dict[str, int]:
+    """Usage to log for a loser that returned no usage: the prompt was still billed."""
+    return {
+        "promptTokenCount": winner_usage.get("promptTokenCount", 0),
+        "cachedContentTokenCount": winner_usage.get("cachedContentTokenCount", 0),
+        "candidatesTokenCount": 0,
+        "totalTokenCount": winner_usage.get("promptTokenCount", 0),
+    }
+
+
+def _account_for_loser(group_id: str, loser: concurrent.futures.Future, winner_usage: Dict[str, int], winner_finished_at: float, is_primary: bool):
+    """Cancels the loser if possible; otherwise logs its usage once it completes."""
+    if loser.cancel():
+        HEDGE_STATS.record_cancelled()
+        return
+    HEDGE_STATS.track_outstanding(loser)
+
+    def _on_done(future: concurrent.futures.Future):
+        try:
+            resp, body, start, latency = future.result()
+            # Non-2xx responses (429/5xx) are not billed
+            usage = ((body or {}).get("usageMetadata") or {}) if resp.ok else {}
+            if is_primary:
+                HEDGE_STATS.record_time_saved(start + latency - winner_finished_at)
+        except Exception:
+            # The loser failed after the winner returned; the prompt was still billed.
+            usage = _billed_prompt_usage(winner_usage)
+        HEDGE_STATS.record_loser(group_id, usage)
+
+    loser.add_done_callback(_on_done)
+
+
+def generate_content_hedged(prompt_text: str, cache_name: str, api_key: str, raw_response_dir: str, group_id: str) -> dict:
+    """
+    Drop-in replacement for `utils.generate_content_via_rest` that hedges slow calls.
+    Falls back to a single plain call when hedging is disabled.
+    """
+    if not ENABLE_HEDGING:
+        return utils.generate_content_via_rest(prompt_text, cache_name, api_key, raw_response_dir, group_id)
+
+    HEDGE_STATS.start_request()
+    attempts = [_submit_attempt(prompt_text, cache_name, api_key)]
+    hedge_delay = LATENCY.hedge_delay()
+
+    if hedge_delay is not None:
+        done, _ = concurrent.futures.wait(attempts, timeout=hedge_delay)
+        if not done and HEDGE_STATS.try_acquire_hedge():
+            logging.info(f"Hedging {group_id}: no response after {hedge_delay:.1f}s, issuing a duplicate request.")
+            METRICS.record_hedge()
+            attempts.append(_submit_attempt(prompt_text, cache_name, api_key))
+
+    # Wait for the first valid response; fall back to the last completed attempt if none is valid.
+    pending, winner, last_completed = set(attempts), None, None
+    while pending and winner is None:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None and _is_valid(*future.result()[:2]):
+                winner = future
+                break
+            last_completed = future
+    if winner is None:
+        winner = last_completed
+
+    resp, body, start, latency = winner.result()  # Re-raises the attempt's exception if every attempt failed
+    if len(attempts) > 1:
+        HEDGE_STATS.record_win(winner is not attempts[0])
+        winner_usage = body.get("usageMetadata", {}) if _is_valid(resp, body) else {}
+        for loser in attempts:
+            if loser is not winner:
+                _account_for_loser(group_id, loser, winner_usage, start + latency, is_primary=loser is attempts[0])
+
+    utils.save_raw_response(resp, raw_response_dir, group_id)
+    resp.raise_for_status()
+    if body is None:
+        raise ValueError("API response body is not a JSON object.")
+    return body
+
+
+def log_loser_usage(pass_name: str):
+    """Writes usage of completed hedge losers to the token log. Call from the main thread."""
+    for group_id, usage in HEDGE_STATS.drain_loser_usage():
+        utils.log_token_usage(f"{group_id}_hedge", usage, pass_name)
+
+
+def finish_run(pass_name: str):
+    """Waits for in-flight losers, logs their usage and reports the hedging trade-off."""
+    if not ENABLE_HEDGING:
+        return
+    HEDGE_STATS.wait_for_losers()
+    log_loser_usage(pass_name)
+    HEDGE_STATS.report(pass_name)
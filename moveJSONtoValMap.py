@@ -1,3 +1,8 @@
+# moveJSONtoValMap.py
+# Purpose: Moves JSON objects found in permissible_values into an empty value_mapping.
+# Superseded by Step 0 of v2_stage_1_filter.py (move_json_pvs, MOVE_JSON_PVS), which
+# does this during Stage 1 with provenance. Kept for one-off cleanup of a raw CSV.
+
 import pandas as pd
 import json
 import os
@@ -0,0 +1,235 @@
+# payload_encoder.py
+# Purpose: Builds the compact JSON payloads sent to Gemini in Stage 3.
+# Null/NaN/empty fields are dropped, each pass only sends the columns it needs,
+# and keys can optionally be abbreviated (the legend lives in the cached system prompt).
+# Run this file directly to print a token-savings report for a real community.
+
+import os
+import json
+import math
+import logging
+from typing import List, Dict, Any, Optional
+
+# --- 1. CONFIGURATION ---
+
+# Set to True to send abbreviated keys. The legend is appended to the cached
+# system prompt via `key_legend_text()`, so it is paid for once per cache.
+USE_SHORT_KEYS = False
+
+# Minimal separators: no whitespace after ',' and ':'.
+COMPACT_SEPARATORS = (',', ':')
+
+# -- Columns projected into each pass's payload (in output order) --
+PASS_1_FIELDS = [
+    'ID',
+    'title',
+    'short_description',
+    'variable_name',
+    'permissible_values',
+    'value_mapping',
+]
+PASS_2_FIELDS = [
+    'ID',
+    'title',
+    'short_description',
+    'preferred_question_text',
+    'permissible_values',
+    'value_format',
+    'unit_of_measure',
+    'value_mapping',
+]
+# Catalog columns each pass loads: its payload fields plus what the record builders consult
+PASS_1_CATALOG_COLUMNS = PASS_1_FIELDS + ['flag_bad_variable_name']
+PASS_2_CATALOG_COLUMNS = PASS_2_FIELDS + ['pv_was_parsed']
+
+# -- Abbreviated keys (full name -> short key). 'ID' is kept as-is because the
+# model must echo it back unchanged in its output. --
+SHORT_KEY_MAP = {
+    'title': 't',
+    'short_description': 'd',
+    'variable_name': 'v',
+    'permissible_values': 'pv',
+    'value_mapping': 'vm',
+    'value_format': 'vf',
+    'unit_of_measure': 'u',
+    'preferred_question_text': 'q',
+    'is_bad_variable_name': 'bv',
+}
+
+# String values that carry no information (Stage 1 writes NaN as the literal 'nan').
+EMPTY_STRING_VALUES = {'', 'nan', 'none', 'null'}
+
+# -- Token-savings report --
+COMMUNITY_DEFINITIONS_PATH = os.path.join('outputs', 'stage_2', 'community_definitions.json')
+REPORT_COMMUNITY_ID = None  # None = the largest community in the file
+CHARS_PER_TOKEN_ESTIMATE = 4.0
+USE_COUNT_TOKENS_API = False  # Set to True to get exact counts from the countTokens endpoint
+
+
+# --- 2. ENCODING HELPERS ---
+
+def is_empty_value(value: Any) -> bool:
+    """Returns True for None, NaN, and blank or placeholder strings."""
+    if value is None:
+        return True
+    if isinstance(value, float) and math.isnan(value):
+        return True
+    if isinstance(value, str) and value.strip().lower() in EMPTY_STRING_VALUES:
+        return True
+    return False
+
+
+def _to_native(value: Any) -> Any:
+    """Converts numpy scalars (as found in DataFrame records) to plain Python types."""
+    if hasattr(value, 'item') and not isinstance(value, (str, bytes)):
+        return value.item()
+    return value
+
+
+def build_cde_record(cde_id: str, cde_details: Dict[str, Any], fields: List[str], short_keys: bool = False) -> Dict[str, Any]:
+    """
+    Projects a catalog row onto `fields`, dropping empty values.
+    `cde_details` may or may not contain 'ID' (rows from `set_index('ID').to_dict('index')` do not).
+    """
+    record = {}
+    for field in fields:
+        value = cde_id if field == 'ID' else cde_details.get(field)
+        if is_empty_value(value):
+            continue
+        key = SHORT_KEY_MAP.get(field, field) if short_keys else field
+        record[key] = _to_native(value)
+    return record
+
+
+def build_pass_1_record(cde_id: str, cde_details: Dict[str, Any], short_keys: bool = False) -> Dict[str, Any]:
+    """Builds a Pass 1 record. The bad-variable-name flag is only sent when it is set."""
+    record = build_cde_record(cde_id, cde_details, PASS_1_FIELDS, short_keys)
+    if bool(cde_details.get('flag_bad_variable_name', False)) is True:
+        if short_keys:
+            record[SHORT_KEY_MAP['is_bad_variable_name']] = True
+        else:
+            record["quality_flags"] = {"is_bad_variable_name": True}
+    return record
+
+
+def build_pass_2_record(cde_id: str, cde_details: Dict[str, Any], short_keys: bool = False) -> Dict[str, Any]:
+    """Builds a Pass 2 record with only the value-definition columns."""
+    return build_cde_record(cde_id, cde_details, PASS_2_FIELDS, short_keys)
+
+
+def encode_prompt_payload(group_id: str, cde_records: List[Dict[str, Any]]) -> str:
+    """Serializes the request payload with minimal separators."""
+    prompt_payload = {
+        "group_id_for_request": group_id,
+        "cde_group_for_review": cde_records,
+    }
+    return json.dumps(prompt_payload, separators=COMPACT_SEPARATORS, ensure_ascii=False)
+
+
+def key_legend_text() -> str:
+    """Returns the key legend to append to a cached system prompt when short keys are used."""
+    legend_lines = [f"- `{short}` = `{full}`" for full, short in SHORT_KEY_MAP.items()]
+    return (
+        "\n### INPUT KEY LEGEND ###\n"
+        "CDE objects in the input use abbreviated keys. Fields that are empty are omitted.\n"
+        + "\n".join(legend_lines)
+        + "\nYour output MUST still use the full field names defined above.\n"
+    )
+
+
+def system_prompt_with_legend(system_prompt: str, short_keys: bool = USE_SHORT_KEYS) -> str:
+    """Appends the key legend to a system prompt if short keys are enabled."""
+    return system_prompt + key_legend_text() if short_keys else system_prompt
+
+
+# --- 3. TOKEN-SAVINGS REPORT ---
+
+def _legacy_pass_1_payload(group_id: str, member_ids: List[int], cde_lookup: Dict[str, Dict]) -> str:
+    """Reproduces the original Pass 1 payload format for comparison."""
+    cde_group_data = []
+    for cde_id in member_ids:
+        cde_details = cde_lookup.get(str(cde_id))
+        if cde_details:
+            cde_group_data.append({
+                "ID": cde_details.get('ID'),
+                "title": cde_details.get('title'),
+                "short_description": cde_details.get('short_description'),
+                "variable_name": cde_details.get('variable_name'),
+                "permissible_values": cde_details.get('permissible_values'),
+                "value_mapping": cde_details.get('value_mapping'),
+                "quality_flags": {"is_bad_variable_name": cde_details.get('flag_bad_variable_name', False)},
+            })
+    return json.dumps({"group_id_for_request": group_id, "cde_group_for_review": cde_group_data}, default=str)
+
+
+def _compact_pass_1_payload(group_id: str, member_ids: List[int], cde_lookup: Dict[str, Dict], short_keys: bool) -> str:
+    records = [
+        build_pass_1_record(str(cde_id), cde_lookup[str(cde_id)], short_keys)
+        for cde_id in member_ids if str(cde_id) in cde_lookup
+    ]
+    return encode_prompt_payload(group_id, records)
+
+
+def _count_tokens(text: str, api_key: Optional[str]) -> int:
+    """Counts tokens via the API when enabled, otherwise estimates from character length."""
+    if api_key:
+        import shared_utils as utils
+        result = utils.count_tokens_via_rest(api_key, text)
+        if result:
+            return result.get('totalTokens', 0)
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN_ESTIMATE))
+
+
+def run_token_savings_report(api_key: Optional[str] = None):
+    """Compares the legacy, compact and compact+short-key Pass 1 payloads for one community."""
+    from catalog_io import load_processed_catalog
+
+    with open(COMMUNITY_DEFINITIONS_PATH, 'r', encoding='utf-8') as f:
+        community_definitions = json.load(f)
+    cde_df = load_processed_catalog(columns=PASS_1_CATALOG_COLUMNS)
+    cde_lookup = cde_df.set_index('ID', drop=False).to_dict('index')
+
+    if REPORT_COMMUNITY_ID:
+        community = next((c for c in community_definitions if c['community_id'] == REPORT_COMMUNITY_ID), None)
+        if community is None:
+            logging.error(f"Community '{REPORT_COMMUNITY_ID}' not found in {COMMUNITY_DEFINITIONS_PATH}.")
+            return
+    else:
+        community = max(community_definitions, key=lambda c: c['total_cde_count'])
+
+    variants = {"legacy": 0, "compact": 0, "compact_short_keys": 0}
+    token_totals = dict(variants)
+    for group in community['sub_groups']:
+        texts = {
+            "legacy": _legacy_pass_1_payload(group['group_id'], group['member_cde_ids'], cde_lookup),
+            "compact": _compact_pass_1_payload(group['group_id'], group['member_cde_ids'], cde_lookup, short_keys=False),
+            "compact_short_keys": _compact_pass_1_payload(group['group_id'], group['member_cde_ids'], cde_lookup, short_keys=True),
+        }
+        for name, text in texts.items():
+            variants[name] += len(text)
+            token_totals[name] += _count_tokens(text, api_key)
+
+    # The legend is paid once per cache, not once per request.
+    legend_tokens = _count_tokens(key_legend_text(), api_key)
+    token_source = "countTokens API" if api_key else f"estimate (~{CHARS_PER_TOKEN_ESTIMATE:g} chars/token)"
+
+    print("\n" + "=" * 80)
+    print(f"--- PAYLOAD TOKEN-SAVINGS REPORT: {community['community_id']} "
+          f"({community['total_cde_count']} CDEs, {len(community['sub_groups'])} groups) ---")
+    print(f"Token counts: {token_source}")
+    baseline = token_totals["legacy"] or 1
+    for name in variants:
+        saved = 100.0 * (1 - token_totals[name] / baseline)
+        print(f"{name:<20} chars: {variants[name]:>12,}  tokens: {token_totals[name]:>10,}  saved vs legacy: {saved:6.2f}%")
+    print(f"Short-key legend (one-off, cached): {legend_tokens:,} tokens")
+    print("=" * 80 + "\n")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    report_api_key = None
+    if USE_COUNT_TOKENS_API:
+        from dotenv import load_dotenv
+        load_dotenv()
+        report_api_key = os.getenv("GOOGLE_API_KEY")
+    run_token_savings_report(report_api_key)
@@ -0,0 +1,239 @@
+# profiling.py
+# Purpose: An opt-in profiling mode shared by every stage.
+# Run any stage with `--profile` (cProfile, main thread) or `--profile=sampling`
+# (a stack sampler that also sees worker threads, e.g. the Stage 3 pools).
+# Records per-phase wall and CPU time, peak RSS and the tracemalloc top allocators,
+# and writes a machine-readable JSON run report to outputs/profiles/.
+# Without the flag, every hook here is a no-op.
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import logging
+import platform
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import List, Dict, Any, Optional
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+# --- 1. CONFIGURATION ---
+
+PROFILE_FLAG = "--profile"
+PROFILE_DIR = os.path.join('outputs', 'profiles')
+TRACE_MALLOC = True            # Track Python allocations (roughly doubles allocation cost)
+TRACEMALLOC_FRAMES = 1
+TRACEMALLOC_TOP_N = 25
+CPROFILE_TOP_N = 40
+SAMPLING_INTERVAL_S = 0.01
+SAMPLING_TOP_N = 40
+
+
+def requested_mode(argv: Optional[List[str]] = None) -> Optional[str]:
+    """Returns 'cprofile', 'sampling' or None from the command line (or CDE_PROFILE)."""
+    for arg in (argv if argv is not None else sys.argv[1:]):
+        if arg == PROFILE_FLAG:
+            return "cprofile"
+        if arg.startswith(PROFILE_FLAG + "="):
+            return arg.split("=", 1)[1] or "cprofile"
+    return os.getenv("CDE_PROFILE") or None
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far, in MiB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+# --- 2. SAMPLING PROFILER ---
+
+class StackSampler:
+    """Samples every thread's stack at a fixed interval; counts inclusive and leaf frames."""
+
+    def __init__(self, interval_s: float = SAMPLING_INTERVAL_S):
+        self.interval_s = interval_s
+        self.samples = 0
+        self.leaf_counts = Counter()
+        self.inclusive_counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.samples += 1
+                seen = set()
+                leaf = True
+                while frame is not None:
+                    code = frame.f_code
+                    key = f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+                    if leaf:
+                        self.leaf_counts[key] += 1
+                        leaf = False
+                    if key not in seen:
+                        self.inclusive_counts[key] += 1
+                        seen.add(key)
+                    frame = frame.f_back
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, top_n: int = SAMPLING_TOP_N) -> Dict[str, Any]:
+        def _rows(counter):
+            return [{"function": k, "samples": n, "share": round(n / max(self.samples, 1), 4)} for k, n in counter.most_common(top_n)]
+        return {"interval_s": self.interval_s, "samples": self.samples,
+                "top_inclusive": _rows(self.inclusive_counts), "top_self": _rows(self.leaf_counts)}
+
+
+# --- 3. RUN PROFILER ---
+
+class RunProfiler:
+    """Collects phase timings and profiler output for one stage run."""
+
+    def __init__(self, stage_name: str, mode: str):
+        self.stage_name = stage_name
+        self.mode = mode
+        self.phases: List[Dict[str, Any]] = []
+        self._stack: List[str] = []
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._sampler: Optional[StackSampler] = None
+        self._started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def start(self):
+        if TRACE_MALLOC:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        if self.mode == "sampling":
+            self._sampler = StackSampler()
+            self._sampler.start()
+        else:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        logging.info(f"Profiling {self.stage_name} ({self.mode}); report will be written to {PROFILE_DIR}")
+
+    @contextmanager
+    def phase(self, name: str):
+        """Times a named phase (wall and process CPU time). Phases may nest; call from the main thread."""
+        parent = self._stack[-1] if self._stack else None
+        self._stack.append(name)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            entry = {
+                "phase": name,
+                "parent": parent,
+                "wall_s": round(time.perf_counter() - wall_start, 4),
+                "cpu_s": round(time.process_time() - cpu_start, 4),
+                "peak_rss_mb_after": peak_rss_mb(),
+            }
+            if tracemalloc.is_tracing():
+                entry["traced_peak_mb_so_far"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+            self.phases.append(entry)
+
+    def _cprofile_report(self, prof_path: str) -> Dict[str, Any]:
+        self._cprofile.disable()
+        self._cprofile.dump_stats(prof_path)
+        stats = pstats.Stats(self._cprofile)
+        rows = []
+        for (filename, line, func), (cc, nc, tt, ct, _) in stats.stats.items():
+            rows.append({"function": f"{filename}:{line}({func})", "calls": nc, "primitive_calls": cc,
+                         "self_s": round(tt, 4), "cumulative_s": round(ct, 4)})
+        return {
+            "pstats_file": prof_path,
+            "top_cumulative": sorted(rows, key=lambda r: r["cumulative_s"], reverse=True)[:CPROFILE_TOP_N],
+            "top_self": sorted(rows, key=lambda r: r["self_s"], reverse=True)[:CPROFILE_TOP_N],
+        }
+
+    def finish(self) -> str:
+        """Stops profiling and writes the JSON run report. Returns its path."""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        base = os.path.join(PROFILE_DIR, f"{self.stage_name}_{stamp}")
+
+        report: Dict[str, Any] = {
+            "stage": self.stage_name,
+            "mode": self.mode,
+            "started_at": self._started_at,
+            "argv": sys.argv,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "total_wall_s": round(time.perf_counter() - self._wall_start, 4),
+            "total_cpu_s": round(time.process_time() - self._cpu_start, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "phases": self.phases,
+        }
+        if self._cprofile is not None:
+            report["cprofile"] = self._cprofile_report(base + ".prof")
+        if self._sampler is not None:
+            self._sampler.stop()
+            report["sampling"] = self._sampler.report()
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:TRACEMALLOC_TOP_N]
+            tracemalloc.stop()
+            report["tracemalloc"] = {
+                "current_mb": round(current / (1024 * 1024), 2),
+                "peak_mb": round(peak / (1024 * 1024), 2),
+                "top_allocators": [{"location": str(s.traceback), "size_mb": round(s.size / (1024 * 1024), 3), "count": s.count} for s in top],
+            }
+
+        report_path = base + ".json"
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"Profile report saved to: {report_path} (wall {report['total_wall_s']:.1f}s, "
+                     f"CPU {report['total_cpu_s']:.1f}s, peak RSS {report['peak_rss_mb']} MiB)")
+        return report_path
+
+
+# --- 4. MODULE-LEVEL HOOKS ---
+
+_ACTIVE: Optional[RunProfiler] = None
+
+
+def start_run(stage_name: str, argv: Optional[List[str]] = None) -> Optional[RunProfiler]:
+    """Starts profiling when `--profile` was given; otherwise returns None."""
+    global _ACTIVE
+    mode = requested_mode(argv)
+    if not mode:
+        return None
+    if mode not in ("cprofile", "sampling"):
+        logging.warning(f"Unknown profile mode '{mode}'; using cprofile.")
+        mode = "cprofile"
+    _ACTIVE = RunProfiler(stage_name, mode)
+    _ACTIVE.start()
+    return _ACTIVE
+
+
+def finish_run() -> Optional[str]:
+    """Writes the report for the active run, if any."""
+    global _ACTIVE
+    if _ACTIVE is None:
+        return None
+    profiler, _ACTIVE = _ACTIVE, None
+    return profiler.finish()
+
+
+def phase(name: str):
+    """Context manager timing a phase of the active run (no-op when not profiling)."""
+    return _ACTIVE.phase(name) if _ACTIVE is not None else nullcontext()
@@ -0,0 +1,170 @@
+# provenance.py
+# Purpose: Columnar change-provenance log for Stage 1.
+# Changes are recorded as a vectorized before/after diff of one column at a time
+# and written out in row groups, so memory is bounded by the buffered rows
+# rather than growing with one Python dict per changed cell.
+# Writes zstd-compressed Parquet, with an optional CSV copy. Without pyarrow,
+# it falls back to CSV only. Incremental runs carry the previous log's rows for
+# the CDEs they do not reprocess into the new log.
+
+import os
+import logging
+from collections import Counter
+from typing import Optional, Dict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# --- 1. CONFIGURATION ---
+
+PROVENANCE_COLUMNS = ['cde_id', 'column_changed', 'rule_id', 'original_value', 'new_value']
+PARQUET_COMPRESSION = 'zstd'
+FLUSH_ROWS = 250_000           # Buffered rows before a row group (and CSV block) is written
+PREVIOUS_SUFFIX = '.previous'  # The last run's log is kept under this suffix until carry_forward is done
+
+
+def _comparable(values: np.ndarray) -> np.ndarray:
+    """Values as text for comparison; every missing value (NaN, None, pd.NA) reads as 'nan'."""
+    return np.where(pd.isna(values), 'nan', values.astype(str))
+
+
+def _as_text(values: np.ndarray) -> np.ndarray:
+    """Values as strings, with missing values kept as None (written as null / empty)."""
+    missing = pd.isna(values)
+    text = values.astype(str).astype(object)
+    text[missing] = None
+    return text
+
+
+class ProvenanceWriter:
+    """Accumulates provenance diffs and streams them to Parquet (and optionally CSV)."""
+
+    def __init__(self, parquet_path: str, csv_path: Optional[str] = None, write_csv: bool = False, keep_previous: bool = False):
+        self.parquet_path = parquet_path if pq is not None else None
+        self.csv_path = csv_path if (write_csv or pq is None) else None
+        if pq is None:
+            logging.warning("pyarrow is not installed; writing the provenance log as CSV only.")
+            if self.csv_path is None:
+                self.csv_path = os.path.splitext(parquet_path)[0] + ".csv"
+        self.rule_counts = Counter()
+        self.rows_written = 0
+        self._buffer = []
+        self._buffered_rows = 0
+        self._parquet_writer = None
+        self._csv_started = False
+        # Each run writes a fresh log; with keep_previous the old one is set aside for carry_forward
+        self._previous_paths = []
+        for path in (self.parquet_path, self.csv_path):
+            if not path:
+                continue
+            previous_path = path + PREVIOUS_SUFFIX
+            if keep_previous and os.path.exists(previous_path):
+                # Set aside by a run that did not finish: it still matches the saved row hashes,
+                # while `path` holds that run's partial log
+                self._previous_paths.append(previous_path)
+            elif keep_previous and os.path.exists(path):
+                os.replace(path, previous_path)
+                self._previous_paths.append(previous_path)
+            elif os.path.exists(previous_path):
+                os.remove(previous_path)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def record_diff(self, cde_ids, column: str, rule_id: str, before: pd.Series, after: pd.Series) -> int:
+        """
+        Records every cell of `column` whose value differs between `before` and `after`
+        (compared as text, so NaN and 'nan' count as unchanged). Returns the number of changes.
+        """
+        before_values, after_values = before.to_numpy(dtype=object), after.to_numpy(dtype=object)
+        changed = _comparable(before_values) != _comparable(after_values)
+        n_changed = int(changed.sum())
+        if not n_changed:
+            return 0
+        self._buffer.append(pd.DataFrame({
+            'cde_id': np.asarray(cde_ids, dtype=object)[changed],
+            'column_changed': column,
+            'rule_id': rule_id,
+            'original_value': _as_text(before_values[changed]),
+            'new_value': _as_text(after_values[changed]),
+        }, columns=PROVENANCE_COLUMNS))
+        self._buffered_rows += n_changed
+        self.rule_counts[rule_id] += n_changed
+        if self._buffered_rows >= FLUSH_ROWS:
+            self.flush()
+        return n_changed
+
+    def _iter_previous_blocks(self):
+        """The set-aside log in blocks of at most FLUSH_ROWS rows (Parquet preferred over the CSV copy)."""
+        previous_path = self._previous_paths[0]
+        if previous_path.endswith('.parquet' + PREVIOUS_SUFFIX) and pq is not None:
+            for batch in pq.ParquetFile(previous_path).iter_batches(batch_size=FLUSH_ROWS, columns=PROVENANCE_COLUMNS):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(previous_path, dtype=str, keep_default_na=False, na_values=[''], chunksize=FLUSH_ROWS)
+
+    def carry_forward(self, cde_ids) -> int:
+        """
+        Copies the previous log's rows for `cde_ids` (CDEs carried forward unchanged) into this
+        log, so it covers the whole catalog. Returns the number of rows carried.
+        """
+        if not self._previous_paths:
+            logging.warning("No previous provenance log to carry forward; the log covers only the reprocessed CDEs.")
+            return 0
+        keep_ids = pd.Index(np.asarray(cde_ids, dtype=object).astype(str))
+        n_carried = 0
+        for block in self._iter_previous_blocks():
+            block = block[block['cde_id'].isin(keep_ids)]
+            if block.empty:
+                continue
+            self._buffer.append(block[PROVENANCE_COLUMNS].astype(object).where(block.notna(), None).reset_index(drop=True))
+            self._buffered_rows += len(block)
+            self.rule_counts.update({rule_id: int(count) for rule_id, count in block['rule_id'].value_counts().items()})
+            n_carried += len(block)
+            if self._buffered_rows >= FLUSH_ROWS:
+                self.flush()
+        logging.info(f"Carried {n_carried} provenance entries forward for {len(keep_ids)} unchanged CDEs.")
+        return n_carried
+
+    def flush(self):
+        if not self._buffer:
+            return
+        block = pd.concat(self._buffer, ignore_index=True)
+        self._buffer, self._buffered_rows = [], 0
+        if self.parquet_path:
+            table = pa.Table.from_pandas(block, schema=pa.schema([(col, pa.string()) for col in PROVENANCE_COLUMNS]),
+                                         preserve_index=False)
+            if self._parquet_writer is None:
+                os.makedirs(os.path.dirname(self.parquet_path) or '.', exist_ok=True)
+                self._parquet_writer = pq.ParquetWriter(self.parquet_path, table.schema, compression=PARQUET_COMPRESSION)
+            self._parquet_writer.write_table(table)
+        if self.csv_path:
+            block.to_csv(self.csv_path, mode='a', header=not self._csv_started, index=False)
+            self._csv_started = True
+        self.rows_written += len(block)
+
+    def close(self) -> Dict[str, int]:
+        """Writes any buffered rows and returns the number of changes per rule."""
+        self.flush()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        for previous_path in self._previous_paths:
+            os.remove(previous_path)
+        self._previous_paths = []
+        if self.rows_written:
+            targets = ", ".join(p for p in (self.parquet_path, self.csv_path) if p)
+            logging.info(f"Saved provenance log with {self.rows_written} entries to: {targets}")
+        return dict(self.rule_counts)
+
+
+def read_provenance_log(path: str) -> pd.DataFrame:
+    """Reads a provenance log written by ProvenanceWriter (Parquet or CSV)."""
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''])
@@ -3,11 +3,14 @@
 # reference "ICD9" from the primary processed catalog.
 
 import os
-import pandas as pd
 import shutil
 
+from catalog_io import load_processed_catalog, write_processed_catalog
+
 # --- CONFIGURATION ---
 CDE_CATALOG_PATH = os.path.join('outputs', 'stage_1', 'cde_catalog_processed.csv')
+# The typed copy written by Stage 1; both copies are rewritten together
+PARQUET_CATALOG_PATH = os.path.join('outputs', 'stage_1', 'cde_catalog_processed.parquet')
 # The substring to search for (case-insensitive)
 SUBSTRING_TO_DELETE = "ICD9"
 # --- NEW: Define all columns to search ---
@@ -25,11 +28,13 @@ def purge_icd9():
         print(f"Error: CDE Catalog not found at '{CDE_CATALOG_PATH}'. Aborting.")
         return
 
-    # 2. Create a backup
-    backup_path = CDE_CATALOG_PATH + ".bak"
+    # 2. Create a backup (of both copies)
     try:
-        shutil.copy2(CDE_CATALOG_PATH, backup_path)
-        print(f"Successfully created a backup of the original file at: {backup_path}")
+        for path in (CDE_CATALOG_PATH, PARQUET_CATALOG_PATH):
+            if os.path.exists(path):
+                backup_path = path + ".bak"
+                shutil.copy2(path, backup_path)
+                print(f"Successfully created a backup of the original file at: {backup_path}")
     except Exception as e:
         print(f"Error: Could not create backup file. Aborting to prevent data loss. Details: {e}")
         return
@@ -37,11 +42,11 @@ def purge_icd9():
     # 3. Load the data
     print(f"Loading data from '{CDE_CATALOG_PATH}'...")
     try:
-        df = pd.read_csv(CDE_CATALOG_PATH, dtype={'ID': str}, low_memory=False)
+        df = load_processed_catalog(csv_path=CDE_CATALOG_PATH, parquet_path=PARQUET_CATALOG_PATH)
         initial_row_count = len(df)
         print(f"Successfully loaded {initial_row_count:,} CDEs.")
     except Exception as e:
-        print(f"Error: Could not read the CSV file. Details: {e}")
+        print(f"Error: Could not read the catalog. Details: {e}")
         return
 
     # 4. Identify and delete rows
@@ -65,7 +70,7 @@ def purge_icd9():
         
         # 5. Save the cleaned data, overwriting the original file
         try:
-            df_cleaned.to_csv(CDE_CATALOG_PATH, index=False)
+            write_processed_catalog(df_cleaned, CDE_CATALOG_PATH, PARQUET_CATALOG_PATH)
             print(f"Successfully saved the cleaned catalog. New row count: {len(df_cleaned):,}.")
         except Exception as e:
             print(f"Error: Could not save the cleaned file. Your original data is safe in the backup. Details: {e}")
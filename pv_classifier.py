@@ -0,0 +1,63 @@
+# pv_classifier.py
+# Purpose: Single-pass format classifier for permissible values.
+# Every format feature (placeholder, key/value meta, ordinal scale, interval,
+# JSON array, pipe list, constraint, empty) is a named lookahead in one
+# compiled regex. One anchored match per value therefore reports all features
+# at once. The format class is the first feature present, in priority order.
+# Used by Stage 1 (`pv_format_class`, and the Step 4 structure check) and by
+# debug_values.diagnose_formats.
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# --- 1. CONFIGURATION ---
+
+UNMATCHED = 'unmatched'
+
+# (class, pattern) in priority order. Each pattern is applied from the start of the value;
+# a leading `[\s\S]*?` (`[^|]*` for the pipe) makes it a search anywhere in the value.
+FORMAT_FEATURES = [
+    ('empty', r'(?:nan)?\Z'),
+    ('placeholder', r'(?i:(?:free text|numeric|integer|float|text|boolean)$)'),
+    ('key_value_meta', r'[\s\S]*?(?i:min:.*max:)'),
+    ('ordinal_scale', r'[\s\S]*?\d+:\s*[\w\s]+'),
+    ('interval_simple', r'\s*\d+\.?\d*\s*-\s*\d+\.?\d*\s*$'),
+    ('json_array', r'\s*\[.*\]\s*$'),
+    ('pipe_separated', r'[^|]*\|'),
+    ('constraint_expression', r'\(y\s*[<>=!].*\)$'),
+]
+FORMAT_CLASSES = [name for name, _ in FORMAT_FEATURES] + [UNMATCHED]
+
+# Classes Stage 1 accepts as structured PVs (flag_bad_permissibles is raised for the rest, unless free entry)
+STRUCTURED_FEATURES = ('empty', 'pipe_separated', 'constraint_expression')
+
+# Each feature is an optional lookahead at position 0 followed by an empty named group, so one
+# match sets (to '') the group of every feature that applies and leaves the others None
+FORMAT_PATTERN = re.compile('^' + ''.join(f'(?:(?={pattern})(?P<{name}>)|)' for name, pattern in FORMAT_FEATURES))
+_NO_FEATURES = (None,) * len(FORMAT_FEATURES)
+
+
+def classify_value(value) -> str:
+    """The format class of a single value."""
+    if not isinstance(value, str):
+        return 'empty' if pd.isna(value) else classify_value(str(value))
+    groups = FORMAT_PATTERN.match(value).groupdict()
+    return next((name for name, _ in FORMAT_FEATURES if groups[name] is not None), UNMATCHED)
+
+
+def classify_series(values: pd.Series) -> pd.DataFrame:
+    """
+    Scans every value once. Returns a frame aligned with `values` with one boolean
+    column per feature and `format_class`, the first feature present (or 'unmatched').
+    Missing values are 'empty'.
+    """
+    match = FORMAT_PATTERN.match
+    groups = [match(value).groups() if isinstance(value, str) else _NO_FEATURES for value in values.astype(str)]
+    present = pd.DataFrame.from_records(groups, columns=[name for name, _ in FORMAT_FEATURES], nrows=len(groups)).notna()
+    features = present.set_axis(values.index)
+    features['empty'] |= pd.isna(values).to_numpy()
+    conditions = [features[name].to_numpy() for name, _ in FORMAT_FEATURES]
+    features['format_class'] = np.select(conditions, [name for name, _ in FORMAT_FEATURES], default=UNMATCHED).astype(object)
+    return features
@@ -0,0 +1,86 @@
+# pv_mapping.py
+# Purpose: The permissible-values mapping engine used by Stage 1.
+# The mapping table (original_expression -> standardized PV/UM/VF/VM) used to be
+# matched on the exact `.strip()`-ed string, so variants with curly quotes,
+# different whitespace, casing or a trailing period fell through to
+# `flag_bad_permissibles`. PVMappingIndex is built once per run. It keeps the
+# exact keys and adds a canonical-key index (Unicode NFKC, quote folding,
+# whitespace collapse, trailing punctuation, casefold). Each unique catalog
+# value is resolved once with dict lookups and the result broadcast to its rows.
+
+import re
+import logging
+import unicodedata
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# --- 1. CONFIGURATION ---
+
+# Typographic quotes, primes and accents that stand in for ASCII quotes
+_QUOTE_TABLE = str.maketrans({
+    '“': '"', '”': '"', '„': '"', '‟': '"', '«': '"', '»': '"',
+    '‘': "'", '’': "'", '‚': "'", '‛': "'", '′': "'", '`': "'", '´': "'",
+})
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = '.;,'
+
+
+def canonical_key(value) -> str:
+    """The matching key of a PV expression: NFKC, ASCII quotes, single spaces, no trailing punctuation, casefolded."""
+    text = unicodedata.normalize('NFKC', str(value)).translate(_QUOTE_TABLE)
+    text = _WHITESPACE.sub(' ', text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION).rstrip().casefold()
+
+
+class PVMappingIndex:
+    """
+    Exact and canonical lookups over the mapping table. A canonical key shared by
+    original expressions with different mapping entries is ambiguous and only
+    matches exactly.
+    """
+
+    def __init__(self, mapping_dict: dict, canonical: bool = True):
+        self.mapping_dict = mapping_dict
+        self.canonical = canonical
+        # One row per original expression, built once and reindexed per batch of matches
+        self.table = pd.DataFrame.from_dict(mapping_dict, orient='index')
+        self._canonical_keys = {}
+        if not canonical:
+            return
+        ambiguous = set()
+        for key, entry in mapping_dict.items():
+            ckey = canonical_key(key)
+            existing = self._canonical_keys.get(ckey)
+            if existing is None:
+                self._canonical_keys[ckey] = key
+            elif mapping_dict[existing] != entry:
+                ambiguous.add(ckey)
+        for ckey in ambiguous:
+            del self._canonical_keys[ckey]
+        if ambiguous:
+            logging.warning(f"{len(ambiguous)} canonical PV keys map to conflicting entries; they only match exactly.")
+
+    def __len__(self) -> int:
+        return len(self.mapping_dict)
+
+    def _lookup(self, value) -> Tuple[object, bool]:
+        if not isinstance(value, str):
+            return None, False
+        if value in self.mapping_dict:
+            return value, False
+        key = self._canonical_keys.get(canonical_key(value)) if self.canonical else None
+        return key, key is not None
+
+    def resolve(self, pv_keys: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Resolves stripped PV strings to mapping keys. Returns (keys, via_canonical): the
+        matched original expression per row (None when unmatched) and whether it only
+        matched through its canonical key.
+        """
+        codes, uniques = pd.factorize(pv_keys, use_na_sentinel=False)
+        resolved = [self._lookup(value) for value in uniques]
+        keys = np.array([key for key, _ in resolved], dtype=object)
+        via_canonical = np.array([flag for _, flag in resolved], dtype=bool)
+        return keys[codes], via_canonical[codes]
@@ -0,0 +1,172 @@
+# pv_parser.py
+# Purpose: Deterministic parser for machine-readable permissible values.
+# A small tokenizer feeds four recognizers, tried in order:
+#   code/label lists   "0: No, 1: Yes", "1=Mild; 2=Severe", "0 (None), 1 (Mild)"
+#   constraints        "(y>=0)", "(y>=0) & (y<=10)"
+#   ranges             "50-400 mg/dL", "0 to 10"
+#   pipe lists         "1|2|3|4|5", "Yes|No|Unknown"
+# Each result follows the conventions of the PV mapping table: a pipe-separated
+# PV, a value format, a unit, and the value_mapping JSON (codes -> labels, or
+# min/max/unit). Results are memoized per unique string. Anything else returns
+# None and is listed in Stage 1's unparsed-PV report.
+
+import re
+import json
+import unicodedata
+from functools import lru_cache
+from typing import NamedTuple, Optional, List, Tuple
+
+import pandas as pd
+
+from pv_mapping import _QUOTE_TABLE
+
+# --- 1. CONFIGURATION ---
+
+MAX_UNIT_LENGTH = 20
+_STRIP_CHARS = ' \t\r\n"\''
+
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<NUM>\d+(?:\.\d+)?)
+  | (?P<CMP>>=|<=|<|>)
+  | (?P<CODESEP>[:=])
+  | (?P<LISTSEP>[|;,\n])
+  | (?P<LPAREN>\()
+  | (?P<RPAREN>\))
+  | (?P<DASH>[-–—])
+  | (?P<AMP>&)
+  | (?P<SPACE>\s+)
+  | (?P<WORD>[^\s\d:=|;,()<>&\-–—]+)
+""", re.VERBOSE)
+
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+    start: int
+    end: int
+
+
+class ParsedPV(NamedTuple):
+    kind: str                   # code_label | constraint | range | pipe_list
+    permissible_values: str
+    value_format: str
+    unit_of_measure: str        # '' when not applicable
+    value_mapping: str          # JSON, '' when the PV carries no mapping
+
+
+def tokenize(text: str) -> List[Token]:
+    """Splits a PV string into tokens (whitespace dropped)."""
+    return [Token(m.lastgroup, m.group(), m.start(), m.end())
+            for m in _TOKEN_PATTERN.finditer(text) if m.lastgroup != 'SPACE']
+
+
+def _number(text: str):
+    return float(text) if '.' in text else int(text)
+
+
+def _signed_number(tokens: List[Token], i: int) -> Tuple[Optional[str], int]:
+    """Reads an optionally negative NUM at tokens[i]; returns (its text, next index)."""
+    if i + 1 < len(tokens) and tokens[i].kind == 'DASH' and tokens[i + 1].kind == 'NUM':
+        return '-' + tokens[i + 1].text, i + 2
+    if i < len(tokens) and tokens[i].kind == 'NUM':
+        return tokens[i].text, i + 1
+    return None, i
+
+
+# --- 2. RECOGNIZERS ---
+
+def _parse_code_label(text: str, tokens: List[Token]) -> Optional[ParsedPV]:
+    # An item starts at the beginning or after a list separator, with a code followed by ':', '=' or '('
+    starts = []
+    for i in range(len(tokens)):
+        if i and tokens[i - 1].kind != 'LISTSEP':
+            continue
+        code, j = _signed_number(tokens, i)
+        if code is not None and j < len(tokens) and tokens[j].kind in ('CODESEP', 'LPAREN'):
+            starts.append((i, code, j))
+    if len(starts) < 2 or starts[0][0] != 0:
+        return None
+
+    mapping = {}
+    for n, (i, code, j) in enumerate(starts):
+        label_end = tokens[starts[n + 1][0] - 1].start if n + 1 < len(starts) else len(text)
+        label = text[tokens[j].end:label_end].strip(_STRIP_CHARS)
+        if tokens[j].kind == 'LPAREN':
+            if not label.endswith(')'):
+                return None
+            label = label[:-1].strip(_STRIP_CHARS)
+        if not label or code in mapping or '|' in label:
+            return None
+        mapping[code] = label
+    return ParsedPV('code_label', '|'.join(mapping.values()), 'categorical', '', json.dumps(mapping, ensure_ascii=False))
+
+
+def _parse_constraint(tokens: List[Token]) -> Optional[ParsedPV]:
+    keys = {'>=': 'min', '<=': 'max', '>': 'min_exclusive', '<': 'max_exclusive'}
+    bounds, i = {}, 0
+    while i < len(tokens):
+        if bounds:
+            if tokens[i].kind != 'AMP':
+                return None
+            i += 1
+        if not (i + 2 < len(tokens) and tokens[i].kind == 'LPAREN' and tokens[i + 1].text == 'y' and tokens[i + 2].kind == 'CMP'):
+            return None
+        op = tokens[i + 2].text
+        number, i = _signed_number(tokens, i + 3)
+        if number is None or op in bounds or i >= len(tokens) or tokens[i].kind != 'RPAREN':
+            return None
+        bounds[op] = number
+        i += 1
+    if not bounds:
+        return None
+    pv = ' & '.join(f"(y{op}{bounds[op]})" for op in keys if op in bounds)
+    mapping = {keys[op]: _number(bounds[op]) for op in keys if op in bounds}
+    return ParsedPV('constraint', pv, 'numeric', '', json.dumps(mapping))
+
+
+def _parse_range(text: str, tokens: List[Token]) -> Optional[ParsedPV]:
+    low, i = _signed_number(tokens, 0)
+    if low is None or i >= len(tokens) or not (tokens[i].kind == 'DASH' or tokens[i].text.lower() == 'to'):
+        return None
+    high, j = _signed_number(tokens, i + 1)
+    if high is None or _number(low) > _number(high) or any(t.kind != 'WORD' for t in tokens[j:]):
+        return None
+    unit = text[tokens[j - 1].end:].strip(_STRIP_CHARS)
+    if len(unit) > MAX_UNIT_LENGTH:
+        return None
+    mapping = {'min': _number(low), 'max': _number(high)}
+    if unit:
+        mapping['unit'] = unit
+    return ParsedPV('range', f"(y>={low}) & (y<={high})", 'numeric', unit, json.dumps(mapping, ensure_ascii=False))
+
+
+def _parse_pipe_list(text: str) -> Optional[ParsedPV]:
+    if '|' not in text:
+        return None
+    items = [item.strip(_STRIP_CHARS) for item in text.split('|')]
+    if len(items) < 2 or not all(items) or len(set(items)) != len(items):
+        return None
+    value_format = 'ordinal' if all(re.fullmatch(r'-?\d+', item) for item in items) else 'categorical'
+    return ParsedPV('pipe_list', '|'.join(items), value_format, '', '')
+
+
+# --- 3. ENTRY POINT ---
+
+@lru_cache(maxsize=None)
+def parse_pv(value: str) -> Optional[ParsedPV]:
+    """Parses one PV string; None when it is empty or not recognized. Memoized per string."""
+    text = unicodedata.normalize('NFKC', value).translate(_QUOTE_TABLE).strip(_STRIP_CHARS)
+    if not text or text.lower() == 'nan':
+        return None
+    tokens = tokenize(text)
+    return (_parse_code_label(text, tokens) or _parse_constraint(tokens)
+            or _parse_range(text, tokens) or _parse_pipe_list(text))
+
+
+_UNPARSED = (None,) * len(ParsedPV._fields)
+
+
+def parse_series(values: pd.Series) -> pd.DataFrame:
+    """Parses every value; one column per ParsedPV field, all None where a value is not recognized."""
+    records = [(parse_pv(value) if isinstance(value, str) else None) or _UNPARSED for value in values]
+    return pd.DataFrame.from_records(records, columns=list(ParsedPV._fields), index=values.index, nrows=len(records))
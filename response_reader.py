@@ -0,0 +1,164 @@
+# response_reader.py
+# Purpose: The single reader for Stage 3 model responses, shared by the passes and the review tools.
+# Handles both the raw API envelope (candidates[0].content.parts[0].text) and bare
+# JSON lists, decodes with orjson when available, falls back to json_repair for
+# malformed output, and memoizes parsed files by (path, mtime, size).
+
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, NamedTuple, Tuple
+
+from json_repair import repair_json
+
+# Fast JSON decoding (falls back to the standard library)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# --- 1. CONFIGURATION ---
+
+RESPONSE_EXTENSIONS = ('.json', '.txt')
+PARSE_CACHE_MAX_ENTRIES = 50000
+
+
+class ParsedResponse(NamedTuple):
+    """Result of reading one response. `items` is shared with the cache; treat it as read-only."""
+    items: List[Dict[str, Any]]
+    status: str             # 'valid' | 'repaired' | 'empty' | 'malformed'
+    error: Optional[str] = None
+
+
+# --- 2. DECODING ---
+
+def decode_json(data) -> Any:
+    """Decodes JSON bytes or text once, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def extract_response_text(response_json: Any) -> str:
+    """
+    Returns the model text from an API response envelope, or an empty string.
+    Accepts the standard parts layout as well as `content` given as {"text": ...} or a bare string.
+    """
+    if not isinstance(response_json, dict):
+        return ""
+    candidates = response_json.get("candidates") or [{}]
+    candidate = candidates[0] if isinstance(candidates[0], dict) else {}
+    content = candidate.get("content", candidate)
+    if isinstance(content, dict) and content.get("parts"):
+        part = content["parts"][0]
+        return part.get("text", "") if isinstance(part, dict) else ""
+    if isinstance(content, dict) and isinstance(content.get("text"), str):
+        return content["text"]
+    if isinstance(content, str):
+        return content
+    return ""
+
+
+def _decode_or_repair(text) -> Tuple[Any, str]:
+    """Decodes JSON, repairing it with json_repair if needed. Returns (data, 'valid' | 'repaired')."""
+    try:
+        return decode_json(text), 'valid'
+    except ValueError:
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', errors='replace')
+        repaired = repair_json(text, return_objects=True)
+        # json_repair returns "" when nothing could be salvaged
+        if repaired == "" or repaired is None:
+            raise ValueError("JSON is malformed and could not be repaired.")
+        return repaired, 'repaired'
+
+
+def _as_items(data: Any) -> List[Dict[str, Any]]:
+    """Keeps the per-CDE objects of a decoded suggestions list."""
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        raise TypeError(f"Expected a JSON array of suggestions, got {type(data).__name__}.")
+    return [item for item in data if isinstance(item, dict)]
+
+
+def parse_text(text) -> ParsedResponse:
+    """Parses model output text (a JSON array of per-CDE objects)."""
+    if not text or not text.strip():
+        return ParsedResponse([], 'empty')
+    try:
+        data, status = _decode_or_repair(text)
+        return ParsedResponse(_as_items(data), status)
+    except (ValueError, TypeError) as e:
+        return ParsedResponse([], 'malformed', str(e))
+
+
+def parse_response(raw) -> ParsedResponse:
+    """Parses a recorded response: either an API envelope or a bare JSON list."""
+    if not raw or not raw.strip():
+        return ParsedResponse([], 'empty')
+    try:
+        data, envelope_status = _decode_or_repair(raw)
+    except ValueError as e:
+        return ParsedResponse([], 'malformed', str(e))
+
+    if isinstance(data, dict) and "candidates" in data:
+        parsed = parse_text(extract_response_text(data))
+        if envelope_status == 'repaired' and parsed.status == 'valid':
+            return parsed._replace(status='repaired')
+        return parsed
+    try:
+        return ParsedResponse(_as_items(data), envelope_status)
+    except TypeError as e:
+        return ParsedResponse([], 'malformed', str(e))
+
+
+# --- 3. CACHED FILE READING ---
+
+_PARSE_CACHE: "OrderedDict[Tuple[str, int, int], ParsedResponse]" = OrderedDict()
+_PARSE_CACHE_LOCK = threading.Lock()
+
+
+def read_response(path: str) -> ParsedResponse:
+    """Reads and parses a recorded response file, reusing the result while the file is unchanged."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _PARSE_CACHE_LOCK:
+        cached = _PARSE_CACHE.get(key)
+        if cached is not None:
+            _PARSE_CACHE.move_to_end(key)
+            return cached
+
+    with open(path, 'rb') as f:
+        parsed = parse_response(f.read())
+
+    with _PARSE_CACHE_LOCK:
+        _PARSE_CACHE[key] = parsed
+        if len(_PARSE_CACHE) > PARSE_CACHE_MAX_ENTRIES:
+            _PARSE_CACHE.popitem(last=False)
+    return parsed
+
+
+def list_response_files(directory: str, extensions: Tuple[str, ...] = RESPONSE_EXTENSIONS) -> List[str]:
+    """Returns the response files in a directory, in a stable order."""
+    return sorted(f for f in os.listdir(directory) if f.endswith(extensions))
+
+
+def load_suggestions(directory: str, extensions: Tuple[str, ...] = RESPONSE_EXTENSIONS) -> Tuple[Dict[str, Dict], List[Dict[str, str]]]:
+    """
+    Aggregates {CDE ID: suggestions} over every response file in a directory.
+    Returns (suggestions, failed files as {"file", "error", "content"}).
+    """
+    all_suggestions, failed_files = {}, []
+    for filename in list_response_files(directory, extensions):
+        filepath = os.path.join(directory, filename)
+        parsed = read_response(filepath)
+        if parsed.status == 'malformed':
+            with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
+                failed_files.append({"file": filename, "error": parsed.error, "content": f.read()})
+            continue
+        for item in parsed.items:
+            if cde_id := item.get("ID"):
+                all_suggestions[str(cde_id)] = item.get("suggestions", {})
+    return all_suggestions, failed_files
@@ -5,7 +5,8 @@
 
 import os
 import json
-from tqdm import tqdm
+
+import response_reader as reader
 
 # --- CONFIGURATION ---
 SUGGESTIONS_DIR = os.path.join('outputs', 'stage_3', 'raw_responses') 
@@ -16,30 +17,13 @@ AI_CONFIDENCE_SCORE_FOR_DELETION = 5
 # --- DATA LOADING ---
 def load_all_suggestions(suggestions_dir: str) -> dict:
     """Aggregates all raw suggestions from Pass 1 into a single dictionary."""
-    all_suggestions = {}
     if not os.path.exists(suggestions_dir):
         print(f"Error: Suggestions directory not found at '{suggestions_dir}'.")
         return {}
 
-    files_to_process = [f for f in os.listdir(suggestions_dir) if f.endswith(('.json', '.txt'))]
     print("Loading all AI suggestions...")
-    for filename in tqdm(files_to_process, desc="Processing files"):
-        filepath = os.path.join(suggestions_dir, filename)
-        with open(filepath, 'r', encoding='utf-8') as f:
-            try:
-                data = json.load(f)
-                suggestions_list = []
-                if isinstance(data, dict) and "candidates" in data:
-                    text_content = data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-                    if text_content: suggestions_list = json.loads(text_content)
-                elif isinstance(data, list):
-                    suggestions_list = data
-                for sug in suggestions_list:
-                    if cde_id := sug.get("ID"):
-                        all_suggestions[str(cde_id)] = sug.get("suggestions", {})
-            except Exception:
-                # Silently skip malformed files in this utility
-                continue
+    # Malformed files are silently skipped in this utility
+    all_suggestions, _ = reader.load_suggestions(suggestions_dir)
     return all_suggestions
 
 def load_review_state() -> dict:
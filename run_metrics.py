@@ -0,0 +1,322 @@
+# run_metrics.py
+# Purpose: A local metrics surface for long Stage 3 runs.
+# Serves Prometheus text format on a localhost port, writes a periodic JSON
+# snapshot, and optionally records per-group trace spans
+# (build -> request -> validate -> persist) as JSON lines.
+# Uses only the standard library; counters are updated even when serving is off.
+
+import os
+import json
+import time
+import bisect
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Any
+
+# --- 1. CONFIGURATION ---
+
+ENABLE_METRICS = False          # Serve /metrics and write JSON snapshots
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+SNAPSHOT_INTERVAL_S = 60
+SNAPSHOT_FILENAME_TEMPLATE = "metrics_snapshot_{worker_id}.json"
+ENABLE_TRACING = False          # Write one JSON line per span
+TRACE_FILENAME_TEMPLATE = "trace_{pass_name}_{worker_id}.jsonl"
+
+# Host and process: several workers (see work_queue) can share one log directory
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+# Histogram upper bounds in seconds (generateContent calls run from seconds to minutes)
+LATENCY_BUCKETS = [1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 420]
+PHASE_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300]
+
+
+# --- 2. METRIC TYPES ---
+
+class Histogram:
+    """A cumulative-bucket histogram in the Prometheus style (not thread-safe; guarded by RunMetrics)."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bucket bound containing the q-quantile (coarse, but stable)."""
+        if not self.count:
+            return None
+        target, running = q * self.count, 0
+        for bound, bucket_count in zip(self.buckets + [float('inf')], self.counts):
+            running += bucket_count
+            if running >= target:
+                return bound
+        return float('inf')
+
+    def prometheus_lines(self, name: str, labels: str = "") -> List[str]:
+        sep = "," if labels else ""
+        lines, running = [], 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            running += bucket_count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound:g}"}} {running}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.total:.6f}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class RunMetrics:
+    """All counters for one Stage 3 run (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pass_name = "stage_3"
+        self.started_at = time.time()
+        self.in_flight = 0
+        self.requests_by_status: Dict[str, int] = {}
+        self.groups_by_status: Dict[str, int] = {}
+        self.request_latency = Histogram(LATENCY_BUCKETS)
+        self.phase_seconds: Dict[str, Histogram] = {}
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+        self.retries = 0
+        self.hedges = 0
+        self.caches_created = 0
+        self.queue_depth = 0
+
+    # -- Recording --
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, latency_s: float, status: str):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests_by_status[status] = self.requests_by_status.get(status, 0) + 1
+            self.request_latency.observe(latency_s)
+
+    def record_usage(self, usage: Dict[str, int], cost_usd: float):
+        with self._lock:
+            self.prompt_tokens += usage.get("promptTokenCount", 0)
+            self.cached_tokens += usage.get("cachedContentTokenCount", 0)
+            self.output_tokens += usage.get("candidatesTokenCount", 0)
+            self.cost_usd += cost_usd
+
+    def record_phase(self, phase: str, seconds: float):
+        with self._lock:
+            if phase not in self.phase_seconds:
+                self.phase_seconds[phase] = Histogram(PHASE_BUCKETS)
+            self.phase_seconds[phase].observe(seconds)
+
+    def record_retry(self, count: int = 1):
+        with self._lock:
+            self.retries += count
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def record_cache_created(self):
+        with self._lock:
+            self.caches_created += 1
+
+    def set_queue_depth(self, depth: int):
+        with self._lock:
+            self.queue_depth = depth
+
+    def group_finished(self, status: str):
+        """Counts a finished group and shrinks the queue depth."""
+        with self._lock:
+            self.groups_by_status[status] = self.groups_by_status.get(status, 0) + 1
+            self.queue_depth = max(0, self.queue_depth - 1)
+
+    # -- Reporting --
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = max(time.time() - self.started_at, 1e-9)
+            total_tokens = self.prompt_tokens + self.output_tokens
+            return {
+                "pass": self.pass_name,
+                "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                "elapsed_s": round(elapsed, 1),
+                "in_flight_requests": self.in_flight,
+                "queue_depth": self.queue_depth,
+                "requests_by_status": dict(self.requests_by_status),
+                "groups_by_status": dict(self.groups_by_status),
+                "latency_s": {
+                    "count": self.request_latency.count,
+                    "mean": round(self.request_latency.total / self.request_latency.count, 3) if self.request_latency.count else None,
+                    "p50_bucket": self.request_latency.quantile(0.50),
+                    "p95_bucket": self.request_latency.quantile(0.95),
+                },
+                "phase_mean_s": {phase: round(h.total / h.count, 4) for phase, h in self.phase_seconds.items() if h.count},
+                "tokens": {"prompt": self.prompt_tokens, "cached": self.cached_tokens, "output": self.output_tokens},
+                "tokens_per_s": round(total_tokens / elapsed, 2),
+                "cost_usd": round(self.cost_usd, 6),
+                "cost_per_s_usd": round(self.cost_usd / elapsed, 8),
+                "cache_hit_ratio": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else None,
+                "caches_created": self.caches_created,
+                "retries": self.retries,
+                "hedges": self.hedges,
+            }
+
+    def render_prometheus(self) -> str:
+        snap = self.snapshot()
+        p = f'pass="{snap["pass"]}"'
+        lines = [
+            "# TYPE stage3_in_flight_requests gauge", f"stage3_in_flight_requests{{{p}}} {snap['in_flight_requests']}",
+            "# TYPE stage3_queue_depth gauge", f"stage3_queue_depth{{{p}}} {snap['queue_depth']}",
+            "# TYPE stage3_requests_total counter",
+        ]
+        lines += [f'stage3_requests_total{{{p},status="{s}"}} {n}' for s, n in snap["requests_by_status"].items()]
+        lines.append("# TYPE stage3_groups_total counter")
+        lines += [f'stage3_groups_total{{{p},status="{s}"}} {n}' for s, n in snap["groups_by_status"].items()]
+        lines.append("# TYPE stage3_tokens_total counter")
+        lines += [f'stage3_tokens_total{{{p},kind="{k}"}} {n}' for k, n in snap["tokens"].items()]
+        lines += [
+            "# TYPE stage3_tokens_per_second gauge", f"stage3_tokens_per_second{{{p}}} {snap['tokens_per_s']}",
+            "# TYPE stage3_cost_usd_total counter", f"stage3_cost_usd_total{{{p}}} {snap['cost_usd']}",
+            "# TYPE stage3_cost_usd_per_second gauge", f"stage3_cost_usd_per_second{{{p}}} {snap['cost_per_s_usd']}",
+            "# TYPE stage3_cache_hit_ratio gauge", f"stage3_cache_hit_ratio{{{p}}} {snap['cache_hit_ratio'] or 0}",
+            "# TYPE stage3_caches_created_total counter", f"stage3_caches_created_total{{{p}}} {snap['caches_created']}",
+            "# TYPE stage3_retries_total counter", f"stage3_retries_total{{{p}}} {snap['retries']}",
+            "# TYPE stage3_hedges_total counter", f"stage3_hedges_total{{{p}}} {snap['hedges']}",
+            "# TYPE stage3_request_latency_seconds histogram",
+        ]
+        with self._lock:
+            lines += self.request_latency.prometheus_lines("stage3_request_latency_seconds", p)
+            lines.append("# TYPE stage3_phase_seconds histogram")
+            for phase, hist in self.phase_seconds.items():
+                lines += hist.prometheus_lines("stage3_phase_seconds", f'{p},phase="{phase}"')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = RunMetrics()
+
+
+# --- 3. TRACE SPANS ---
+
+_TRACE_LOCK = threading.Lock()
+_trace_path: Optional[str] = None
+
+
+@contextmanager
+def span(phase: str, group_id: str):
+    """Times one phase of a group. Feeds the phase histogram and, if tracing is on, the trace file."""
+    start_wall, start = time.time(), time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        METRICS.record_phase(phase, duration)
+        if ENABLE_TRACING and _trace_path:
+            record = {"group_id": group_id, "phase": phase, "start": round(start_wall, 6),
+                      "duration_ms": round(duration * 1000, 3), "status": status,
+                      "thread": threading.current_thread().name}
+            with _TRACE_LOCK, open(_trace_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
+
+
+# --- 4. SERVING AND SNAPSHOTS ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') in ('', '/metrics'):
+            body, content_type = METRICS.render_prometheus().encode('utf-8'), "text/plain; version=0.0.4"
+        elif self.path.rstrip('/') == '/snapshot':
+            body, content_type = json.dumps(METRICS.snapshot(), indent=2).encode('utf-8'), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the pipeline log
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_snapshot_stop = threading.Event()
+_snapshot_thread: Optional[threading.Thread] = None
+_snapshot_path: Optional[str] = None
+
+
+def _write_snapshot():
+    if not _snapshot_path:
+        return
+    tmp_path = _snapshot_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(METRICS.snapshot(), f, indent=2)
+    os.replace(tmp_path, _snapshot_path)
+
+
+def _snapshot_loop():
+    while not _snapshot_stop.wait(SNAPSHOT_INTERVAL_S):
+        try:
+            _write_snapshot()
+        except OSError as e:
+            logging.warning(f"Could not write metrics snapshot: {e}")
+
+
+def start(pass_name: str, log_dir: str):
+    """Starts the metrics endpoint, the snapshot writer and the trace file for a pass."""
+    global _server, _snapshot_thread, _snapshot_path, _trace_path
+    METRICS.pass_name = pass_name
+    METRICS.started_at = time.time()
+    os.makedirs(log_dir, exist_ok=True)
+    if ENABLE_TRACING:
+        _trace_path = os.path.join(log_dir, TRACE_FILENAME_TEMPLATE.format(pass_name=pass_name, worker_id=WORKER_ID))
+        logging.info(f"Tracing spans to {_trace_path}")
+    if not ENABLE_METRICS:
+        return
+
+    _snapshot_path = os.path.join(log_dir, SNAPSHOT_FILENAME_TEMPLATE.format(worker_id=WORKER_ID))
+    try:
+        _server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        logging.info(f"Metrics available at http://{METRICS_HOST}:{METRICS_PORT}/metrics (snapshot: {_snapshot_path})")
+    except OSError as e:
+        # A second worker on the same machine will find the port taken; snapshots still work.
+        logging.warning(f"Could not bind metrics port {METRICS_PORT}: {e}. Continuing with JSON snapshots only.")
+        _server = None
+    _snapshot_stop.clear()
+    _snapshot_thread = threading.Thread(target=_snapshot_loop, name="metrics-snapshot", daemon=True)
+    _snapshot_thread.start()
+
+
+def stop():
+    """Writes a final snapshot and stops serving."""
+    global _server
+    if _snapshot_thread:
+        _snapshot_stop.set()
+        _snapshot_thread.join(timeout=5)
+    if ENABLE_METRICS:
+        try:
+            _write_snapshot()
+        except OSError as e:
+            logging.warning(f"Could not write final metrics snapshot: {e}")
+    if _server:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
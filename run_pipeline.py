@@ -0,0 +1,351 @@
+# run_pipeline.py
+# Purpose: Runs the pipeline stages as a small DAG with content-hash caching.
+# Each stage's key is a hash of its input files, its code and its configuration.
+# A stage is skipped when its key and its recorded outputs are unchanged, so a
+# no-op rerun only stats files. When inputs change, the stage reruns and its
+# downstream stages see new input hashes. Stage 2's embedding and graph
+# checkpoints are invalidated separately, according to the settings each depends on.
+# Every run and skip is appended to a lineage log.
+
+import os
+import ast
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import subprocess
+from typing import List, Dict, Any, Optional, Callable
+
+# --- 1. CONFIGURATION ---
+
+STATE_PATH = os.path.join('outputs', 'pipeline_state.json')
+LINEAGE_PATH = os.path.join('outputs', 'pipeline_lineage.jsonl')
+HASH_CHUNK_BYTES = 1024 * 1024
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# --- 2. HASHING ---
+
+class FileHasher:
+    """SHA-256 of files, memoized by (size, mtime) across runs so unchanged inputs are never re-read."""
+
+    def __init__(self, cache: Dict[str, List]):
+        self.cache = cache
+
+    def file_digest(self, path: str) -> Optional[str]:
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        cached = self.cache.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+                digest.update(chunk)
+        self.cache[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def dir_digest(self, path: str) -> Optional[str]:
+        """Digest of a directory listing (names, sizes and mtimes); used for large response folders."""
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha256()
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                stat = os.stat(full)
+                digest.update(f"{os.path.relpath(full, path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def digest(self, path: str) -> Optional[str]:
+        return self.dir_digest(path) if os.path.isdir(path) else self.file_digest(path)
+
+
+def hash_values(*values: Any) -> str:
+    """Stable hash of JSON-serialisable values."""
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def read_constants(script_path: str, names: List[str]) -> Dict[str, Any]:
+    """
+    Reads module-level constants from a stage script without importing it
+    (importing Stage 2 would load torch). `os.path.join` of literals is supported.
+    """
+    with open(script_path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name not in names:
+                continue
+            value = node.value
+            if isinstance(value, ast.Call) and ast.unparse(value.func) == 'os.path.join':
+                values[name] = os.path.join(*[ast.literal_eval(arg) for arg in value.args])
+            else:
+                try:
+                    values[name] = ast.literal_eval(value)
+                except ValueError:
+                    values[name] = ast.unparse(value)
+    return values
+
+
+def function_sources(script_path: str, function_names: List[str]) -> Dict[str, str]:
+    """Returns the source of selected functions, so a checkpoint only depends on the code that builds it."""
+    with open(script_path, 'r', encoding='utf-8') as f:
+        source = f.read()
+    tree = ast.parse(source)
+    return {node.name: ast.get_source_segment(source, node) for node in tree.body
+            if isinstance(node, ast.FunctionDef) and node.name in function_names}
+
+
+# --- 3. STAGE DEFINITIONS ---
+
+STAGE_1_SCRIPT = 'v2_stage_1_filter.py'
+STAGE_2_SCRIPT = 'v3_stage_2.py'
+
+_S1 = read_constants(STAGE_1_SCRIPT, ['DATABASE_PATH', 'TABLE_NAME', 'ORIGINAL_CSV_PATH', 'MAPPING_FILE_PATH', 'OUTPUT_DIR',
+                                      'FINAL_CATALOG_FILENAME', 'PARQUET_CATALOG_FILENAME', 'PROVENANCE_LOG_FILENAME', 'PROVENANCE_CSV_FILENAME',
+                                      'UNPARSABLE_LOG_FILENAME', 'UNPARSED_PV_REPORT_FILENAME', 'QUARANTINE_FILENAME', 'ROW_HASHES_FILENAME', 'DELTA_FILENAME'])
+_S2 = read_constants(STAGE_2_SCRIPT, ['DATABASE_PATH', 'TABLE_NAME', 'OUTPUT_DIR', 'GRAPH_CHECKPOINT_FILENAME',
+                                      'EMBEDDINGS_CHECKPOINT_FILENAME', 'COMMUNITY_DEFINITIONS_FILENAME',
+                                      'STATS_OUTPUT_FILENAME', 'SAMPLES_OUTPUT_FILENAME', 'EMBEDDING_MODEL',
+                                      'SEMANTIC_FIELDS', 'TOP_K_NEIGHBORS', 'LEXICAL_BOOST_FACTOR',
+                                      'STRUCTURAL_BOOST_FACTOR'])
+
+PROCESSED_CATALOG = os.path.join(_S1['OUTPUT_DIR'], _S1['FINAL_CATALOG_FILENAME'])
+PROCESSED_CATALOG_PARQUET = os.path.join(_S1['OUTPUT_DIR'], _S1['PARQUET_CATALOG_FILENAME'])
+COMMUNITY_DEFINITIONS = os.path.join(_S2['OUTPUT_DIR'], _S2['COMMUNITY_DEFINITIONS_FILENAME'])
+STAGE_3_OUTPUT_DIR = 'stage3_adjudication_output'
+
+
+def _stage_3_complete(manifest_name: str) -> Callable[[], bool]:
+    """A Stage 3 pass is only up to date once every group in its manifest succeeded."""
+    def _check() -> bool:
+        manifest_path = os.path.join(STAGE_3_OUTPUT_DIR, manifest_name)
+        if not os.path.exists(manifest_path):
+            return False
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        return bool(manifest) and all(status == "success" for status in manifest.values())
+    return _check
+
+
+# Each stage: script, upstream stages, input files, code files its results depend on, extra config
+# values, outputs, and the outputs that must be archived (not deleted) when the stage is invalidated.
+STAGES: List[Dict[str, Any]] = [
+    {
+        "name": "stage_1",
+        "script": STAGE_1_SCRIPT,
+        "depends_on": [],
+        "inputs": [_S1['DATABASE_PATH'], _S1['ORIGINAL_CSV_PATH'], _S1['MAPPING_FILE_PATH']],
+        "code": [STAGE_1_SCRIPT, 'catalog_sources.py', 'catalog_delta.py', 'pv_mapping.py', 'pv_classifier.py', 'pv_parser.py', 'csv_ingest.py',
+                 'catalog_io.py', 'provenance.py'],
+        "config": {"table": _S1['TABLE_NAME']},
+        "outputs": [PROCESSED_CATALOG, PROCESSED_CATALOG_PARQUET,
+                    os.path.join(_S1['OUTPUT_DIR'], _S1['PROVENANCE_LOG_FILENAME']),
+                    os.path.join(_S1['OUTPUT_DIR'], _S1['PROVENANCE_CSV_FILENAME']),
+                    os.path.join(_S1['OUTPUT_DIR'], _S1['ROW_HASHES_FILENAME']),
+                    os.path.join(_S1['OUTPUT_DIR'], _S1['DELTA_FILENAME']),
+                    os.path.join(_S1['OUTPUT_DIR'], _S1['UNPARSED_PV_REPORT_FILENAME']),
+                    os.path.join(_S1['OUTPUT_DIR'], _S1['QUARANTINE_FILENAME'])],
+    },
+    {
+        "name": "stage_2",
+        "script": STAGE_2_SCRIPT,
+        "depends_on": [],
+        "inputs": [_S2['DATABASE_PATH']],
+        "code": [STAGE_2_SCRIPT, 'catalog_sources.py', 'catalog_io.py'],
+        "config": {"table": _S2['TABLE_NAME']},
+        "outputs": [COMMUNITY_DEFINITIONS,
+                    os.path.join(_S2['OUTPUT_DIR'], _S2['STATS_OUTPUT_FILENAME']),
+                    os.path.join(_S2['OUTPUT_DIR'], _S2['SAMPLES_OUTPUT_FILENAME'])],
+    },
+    {
+        "name": "stage_3_pass_1",
+        "script": 'v4_stage_3_pass_1.py',
+        "depends_on": ["stage_1", "stage_2"],
+        "inputs": [PROCESSED_CATALOG, PROCESSED_CATALOG_PARQUET, COMMUNITY_DEFINITIONS],
+        "code": ['v4_stage_3_pass_1.py', 'shared_utils.py', 'payload_encoder.py', 'community_context.py', 'catalog_io.py'],
+        "config": {},
+        "outputs": [os.path.join(STAGE_3_OUTPUT_DIR, "manifest_pass_1.json"), os.path.join(STAGE_3_OUTPUT_DIR, "pass_1_raw_responses")],
+        "archive_on_invalidate": True,  # Paid API output: never delete it
+        "is_complete": _stage_3_complete("manifest_pass_1.json"),
+        "optional": True,
+    },
+    {
+        "name": "stage_3_pass_2",
+        "script": 'v4_stage_3_pass_2.py',
+        "depends_on": ["stage_3_pass_1"],
+        "inputs": [PROCESSED_CATALOG, PROCESSED_CATALOG_PARQUET, COMMUNITY_DEFINITIONS, os.path.join(STAGE_3_OUTPUT_DIR, "pass_1_raw_responses")],
+        "code": ['v4_stage_3_pass_2.py', 'shared_utils.py', 'payload_encoder.py', 'community_context.py', 'response_reader.py',
+                 'catalog_io.py'],
+        "config": {},
+        "outputs": [os.path.join(STAGE_3_OUTPUT_DIR, "manifest_pass_2.json"), os.path.join(STAGE_3_OUTPUT_DIR, "pass_2_raw_responses")],
+        "archive_on_invalidate": True,
+        "is_complete": _stage_3_complete("manifest_pass_2.json"),
+        "optional": True,
+    },
+]
+
+
+def stage_2_checkpoint_keys(hasher: FileHasher) -> Dict[str, str]:
+    """
+    Keys for Stage 2's internal checkpoints: embeddings depend on the data, model and fields;
+    the graph additionally depends on the neighbour and boost settings.
+    """
+    sources = function_sources(STAGE_2_SCRIPT, ['load_and_select_candidates', 'generate_embeddings',
+                                                'build_similarity_graph', 'jaccard_similarity'])
+    embeddings_key = hash_values(hasher.digest(_S2['DATABASE_PATH']), _S2['TABLE_NAME'], _S2['EMBEDDING_MODEL'],
+                                 _S2['SEMANTIC_FIELDS'], sources.get('load_and_select_candidates'), hasher.digest('catalog_sources.py'),
+                                 sources.get('generate_embeddings'))
+    graph_key = hash_values(embeddings_key, _S2['TOP_K_NEIGHBORS'], _S2['LEXICAL_BOOST_FACTOR'],
+                            _S2['STRUCTURAL_BOOST_FACTOR'], sources.get('build_similarity_graph'),
+                            sources.get('jaccard_similarity'))
+    return {
+        os.path.join(_S2['OUTPUT_DIR'], _S2['EMBEDDINGS_CHECKPOINT_FILENAME']): embeddings_key,
+        os.path.join(_S2['OUTPUT_DIR'], _S2['GRAPH_CHECKPOINT_FILENAME']): graph_key,
+    }
+
+
+# --- 4. RUNNER ---
+
+def load_state() -> Dict[str, Any]:
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {"file_hashes": {}, "stages": {}, "checkpoints": {}}
+
+
+def save_state(state: Dict[str, Any]):
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    tmp_path = STATE_PATH + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def append_lineage(record: Dict[str, Any]):
+    os.makedirs(os.path.dirname(LINEAGE_PATH), exist_ok=True)
+    with open(LINEAGE_PATH, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def stage_input_key(stage: Dict[str, Any], hasher: FileHasher) -> (str, Dict[str, Optional[str]]):
+    """Returns the stage key and the per-file digests that make it up."""
+    digests = {path: hasher.digest(path) for path in stage["inputs"] + stage["code"]}
+    return hash_values(stage["name"], digests, stage["config"]), digests
+
+
+def is_up_to_date(stage: Dict[str, Any], key: str, record: Optional[Dict[str, Any]], hasher: FileHasher) -> (bool, str):
+    """Returns (up to date?, reason)."""
+    if not record:
+        return False, "never run"
+    if record.get("input_key") != key:
+        return False, "inputs, code or config changed"
+    for path, recorded in record.get("outputs", {}).items():
+        if hasher.digest(path) != recorded:
+            return False, f"output changed or missing: {path}"
+    if "is_complete" in stage and not stage["is_complete"]():
+        return False, "previous run left unfinished groups"
+    return True, "up to date"
+
+
+def invalidate_stage_2_checkpoints(state: Dict[str, Any], hasher: FileHasher, dry_run: bool):
+    """Deletes only the Stage 2 checkpoints whose key changed since they were built."""
+    for path, key in stage_2_checkpoint_keys(hasher).items():
+        recorded = state["checkpoints"].get(path)
+        if os.path.exists(path) and recorded != key:
+            logging.info(f"  Checkpoint is stale, removing: {path}")
+            if not dry_run:
+                os.remove(path)
+        if not dry_run:
+            state["checkpoints"][path] = key
+
+
+def archive_outputs(stage: Dict[str, Any], dry_run: bool):
+    """Moves a stage's previous outputs aside instead of deleting them."""
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    for path in stage["outputs"]:
+        if os.path.exists(path):
+            target = f"{path.rstrip(os.sep)}.stale_{stamp}"
+            logging.info(f"  Archiving stale output: {path} -> {target}")
+            if not dry_run:
+                shutil.move(path, target)
+
+
+def run_pipeline(targets: Optional[List[str]] = None, include_stage_3: bool = False, force: Optional[List[str]] = None,
+                 dry_run: bool = False, extra_args: Optional[List[str]] = None):
+    """Runs the requested stages (and their upstream stages) in dependency order, skipping up-to-date ones."""
+    state = load_state()
+    hasher = FileHasher(state["file_hashes"])
+    force = set(force or [])
+    stages = [s for s in STAGES if include_stage_3 or not s.get("optional")]
+    if targets:
+        wanted, pending = set(), list(targets)
+        by_name = {s["name"]: s for s in STAGES}
+        while pending:
+            name = pending.pop()
+            if name not in wanted:
+                wanted.add(name)
+                pending.extend(by_name[name]["depends_on"])
+        stages = [s for s in STAGES if s["name"] in wanted]
+
+    logging.info(f"--- Pipeline: {', '.join(s['name'] for s in stages)}{' (DRY RUN)' if dry_run else ''} ---")
+    for stage in stages:
+        name = stage["name"]
+        key, input_digests = stage_input_key(stage, hasher)
+        record = state["stages"].get(name)
+        up_to_date, reason = is_up_to_date(stage, key, record, hasher)
+        if name in force:
+            up_to_date, reason = False, "forced"
+
+        if up_to_date:
+            logging.info(f"[{name}] skipped ({reason}).")
+            append_lineage({"stage": name, "event": "skipped", "at": time.strftime('%Y-%m-%dT%H:%M:%S'), "input_key": key})
+            continue
+
+        logging.info(f"[{name}] running: {reason}.")
+        if stage.get("archive_on_invalidate") and record and record.get("input_key") != key:
+            archive_outputs(stage, dry_run)
+        if name == "stage_2":
+            invalidate_stage_2_checkpoints(state, hasher, dry_run)
+        if dry_run:
+            continue
+
+        started = time.time()
+        result = subprocess.run([sys.executable, stage["script"]] + (extra_args or []))
+        duration = round(time.time() - started, 1)
+        output_digests = {path: hasher.digest(path) for path in stage["outputs"]}
+        append_lineage({
+            "stage": name, "event": "ran", "at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "exit_code": result.returncode, "duration_s": duration, "input_key": key,
+            "inputs": input_digests, "outputs": output_digests,
+        })
+        if result.returncode != 0:
+            save_state(state)
+            logging.error(f"[{name}] failed with exit code {result.returncode} after {duration}s. Downstream stages not run.")
+            return
+        state["stages"][name] = {"input_key": key, "outputs": output_digests, "completed_at": time.strftime('%Y-%m-%dT%H:%M:%S')}
+        save_state(state)
+        logging.info(f"[{name}] finished in {duration}s.")
+
+    save_state(state)
+    logging.info("--- Pipeline complete ---")
+
+
+if __name__ == "__main__":
+    # --- CONFIGURE YOUR RUN HERE ---
+    TARGET_STAGES = None       # e.g. ["stage_2"]; None runs every stage (Stage 3 only if included)
+    INCLUDE_STAGE_3 = False    # Stage 3 calls the paid API; include it deliberately
+    FORCE_STAGES = []          # Stages to rerun even when up to date
+    DRY_RUN_MODE = False       # Report what would run or be invalidated, without running anything
+    # --------------------------------
+
+    # Flags such as --profile are passed through to each stage script
+    run_pipeline(targets=TARGET_STAGES, include_stage_3=INCLUDE_STAGE_3, force=FORCE_STAGES,
+                 dry_run=DRY_RUN_MODE, extra_args=sys.argv[1:])
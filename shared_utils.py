@@ -8,12 +8,19 @@ import json
 import time
 import logging
 import sys
+import signal
+import threading
+import concurrent.futures
 import requests
 from typing import List, Dict, Any, Optional
 
 # Pydantic for validation
 from pydantic import BaseModel, ValidationError, RootModel
 
+# Response decoding is shared with the review tools
+from response_reader import decode_json, extract_response_text
+from run_metrics import METRICS
+
 # --- 1. CORE CONFIGURATION (Corrected) ---
 
 # -- Directory and File Paths --
@@ -30,6 +37,9 @@ PIPELINE_LOG_FILENAME = "pipeline.log"
 
 # -- Worker and Safety Controls --
 MAX_WORKERS = 8
+REQUEST_TIMEOUT_S = 420
+# On Ctrl-C/SIGTERM: how long to wait for in-flight calls before abandoning them
+SHUTDOWN_DEADLINE_S = 120
 MAX_CONSECUTIVE_ERRORS = 10
 COST_LIMIT_USD = 250.0
 
@@ -124,6 +134,14 @@ def log_error(group_id: str, err: Any, details: Dict[str, Any] = None):
     logging.error(f"Logged critical error for group {group_id}. See {error_log_path}.")
 
 
+def compute_call_cost(usage_metadata: Dict[str, int]) -> float:
+    """Returns the USD cost of a call from its usage metadata."""
+    prompt_tokens = usage_metadata.get('promptTokenCount', 0)
+    cached_tokens = usage_metadata.get('cachedContentTokenCount', 0)
+    output_tokens = usage_metadata.get('candidatesTokenCount', 0)
+    return (prompt_tokens * TOKEN_PRICING["input"]) + (output_tokens * TOKEN_PRICING["output"]) + (cached_tokens * TOKEN_PRICING["cached"])
+
+
 def log_token_usage(group_id: str, usage_metadata: Dict[str, int], pass_name: str):
     """Appends a token usage record to the CSV log."""
     token_log_path = os.path.join(LOG_DIR, TOKEN_LOG_FILENAME)
@@ -137,7 +155,8 @@ def log_token_usage(group_id: str, usage_metadata: Dict[str, int], pass_name: st
     output_tokens = usage_metadata.get('candidatesTokenCount', 0)
     total_tokens = usage_metadata.get('totalTokenCount', 0)
     
-    cost = (prompt_tokens * TOKEN_PRICING["input"]) + (output_tokens * TOKEN_PRICING["output"]) + (cached_tokens * TOKEN_PRICING["cached"])
+    cost = compute_call_cost(usage_metadata)
+    METRICS.record_usage(usage_metadata, cost)
 
     with open(token_log_path, "a") as f:
         f.write(f"{group_id},{pass_name},{prompt_tokens},{cached_tokens},{output_tokens},{total_tokens},{cost:.8f}\n")
@@ -173,46 +192,192 @@ def create_cache_via_rest(api_key: str, system_prompt: str, community_context: s
         resp.raise_for_status()
         name = resp.json().get("name")
         logging.info(f"Cache created successfully: {name}")
+        METRICS.record_cache_created()
+        with _LIVE_CACHES_LOCK:
+            _LIVE_CACHES.add(name)
         return name
     except requests.exceptions.RequestException as e:
-        log_error("CACHE_CREATE", e, {"response_body": e.response.text if e.response else "N/A"})
+        log_error("CACHE_CREATE", e, {"response_body": e.response.text if e.response is not None else "N/A"})
         return None
 
 
 def delete_cache(cache_name: str, api_key: str):
-    """Deletes a cache."""
+    """Deletes a cache. It stays registered as live until the API confirms, so a shutdown retries failed deletes."""
     if not cache_name:
         return
+    with _LIVE_CACHES_LOCK:
+        if cache_name in _DELETED_CACHES:
+            return
     logging.info(f"Deleting cache: {cache_name}...")
     url = f"{BASE_API_URL}/{cache_name}?key={api_key}"
     try:
-        requests.delete(url, timeout=15)
+        resp = requests.delete(url, timeout=15)
+        resp.raise_for_status()
     except requests.exceptions.RequestException as e:
-        log_error(f"CACHE_DELETE_{cache_name}", e)
+        log_error(f"CACHE_DELETE_{cache_name}", e, {"response_body": e.response.text if e.response is not None else "N/A"})
+        return
+    with _LIVE_CACHES_LOCK:
+        _LIVE_CACHES.discard(cache_name)
+        _DELETED_CACHES.add(cache_name)
+
+
+def list_caches_via_rest(api_key: str) -> List[Dict[str, Any]]:
+    """Lists all cachedContents owned by this API key (follows pagination)."""
+    url = f"{BASE_API_URL}/cachedContents"
+    entries, page_token = [], None
+    while True:
+        params = {"key": api_key, "pageSize": 100}
+        if page_token:
+            params["pageToken"] = page_token
+        resp = requests.get(url, params=params, timeout=60)
+        resp.raise_for_status()
+        page = resp.json()
+        entries.extend(page.get("cachedContents", []))
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return entries
 
 
-def generate_content_via_rest(prompt_text: str, cache_name: str, api_key: str, raw_response_dir: str) -> dict:
-    """Generates content using the REST API with a cached context."""
+def post_generate_content(prompt_text: str, cache_name: str, api_key: str, session: Optional[requests.Session] = None) -> requests.Response:
+    """Sends a generateContent request with a cached context and returns the raw HTTP response."""
     url = f"{BASE_API_URL}/{MODEL_NAME}:generateContent?key={api_key}"
     body = {
         "cachedContent": cache_name,
         "contents": [{"role": "user", "parts": [{"text": prompt_text}]}],
         "generationConfig": {"temperature": 0.2, "responseMimeType": "application/json"}
     }
-    
-    resp = requests.post(url, headers={"Content-Type": "application/json"}, json=body, timeout=420)
+    poster = session or requests
+    METRICS.request_started()
+    start, status = time.monotonic(), "error"
+    try:
+        resp = poster.post(url, headers={"Content-Type": "application/json"}, json=body, timeout=REQUEST_TIMEOUT_S)
+        status = str(resp.status_code)
+        return resp
+    finally:
+        METRICS.request_finished(time.monotonic() - start, status)
+
+
+def save_raw_response(resp: requests.Response, raw_response_dir: str, group_id: str):
+    """Saves a raw API response for auditing, writing the body bytes exactly as received."""
+    os.makedirs(raw_response_dir, exist_ok=True)
+    raw_response_path = os.path.join(raw_response_dir, f"{group_id}_response.json")
+    with open(raw_response_path, 'wb') as f:
+        f.write(resp.content)
+
+
+def generate_content_via_rest(prompt_text: str, cache_name: str, api_key: str, raw_response_dir: str, group_id: Optional[str] = None) -> dict:
+    """
+    Generates content using the REST API with a cached context.
+    The body is saved as-is and decoded exactly once.
+    """
+    resp = post_generate_content(prompt_text, cache_name, api_key)
     
     # Save raw response for auditing before checking status
-    try:
-        group_id_from_prompt = json.loads(prompt_text).get("group_id_for_request", f"unknown_{int(time.time())}")
-        os.makedirs(raw_response_dir, exist_ok=True)
-        raw_response_path = os.path.join(raw_response_dir, f"{group_id_from_prompt}_response.json")
-        with open(raw_response_path, 'w', encoding='utf-8') as f:
-            json.dump(resp.json(), f, indent=2)
-    except Exception:
-        # If response body isn't json, write raw text
-        with open(raw_response_path, 'w', encoding='utf-8') as f:
-            f.write(resp.text)
+    if group_id is None:
+        # Legacy callers: recover the group id from the prompt payload
+        try:
+            group_id = json.loads(prompt_text).get("group_id_for_request", f"unknown_{int(time.time())}")
+        except ValueError:
+            group_id = f"unknown_{int(time.time())}"
+    save_raw_response(resp, raw_response_dir, group_id)
             
     resp.raise_for_status()
-    return resp.json()
+    return decode_json(resp.content)
+
+
+def count_tokens_via_rest(api_key: str, prompt_text: str) -> Optional[dict]:
+    """
+    Calls the countTokens endpoint to get a token count for a given prompt.
+    Note: This does not include cached context tokens.
+    """
+    url = f"{BASE_API_URL}/{MODEL_NAME}:countTokens?key={api_key}"
+    body = {
+        "contents": [{"role": "user", "parts": [{"text": prompt_text}]}]
+    }
+    try:
+        resp = requests.post(url, headers={"Content-Type": "application/json"}, json=body, timeout=60)
+        resp.raise_for_status()
+        return resp.json()
+    except requests.exceptions.RequestException as e:
+        log_error("TOKEN_COUNT", e, {"response_body": e.response.text if e.response is not None else "N/A"})
+        return None
+
+
+# --- 4. GRACEFUL SHUTDOWN ---
+
+_SHUTDOWN_EVENT = threading.Event()
+_LIVE_CACHES = set()
+_DELETED_CACHES = set()
+_LIVE_CACHES_LOCK = threading.Lock()
+
+
+def install_shutdown_handlers():
+    """
+    Makes the first Ctrl-C/SIGTERM request a graceful shutdown: dispatch stops,
+    in-flight calls get SHUTDOWN_DEADLINE_S to finish, then manifests, logs and
+    caches are cleaned up. A second signal aborts immediately.
+    """
+    def _handle_signal(signum, frame):
+        if _SHUTDOWN_EVENT.is_set():
+            raise KeyboardInterrupt
+        logging.warning(f"Received {signal.Signals(signum).name}: stopping dispatch and waiting up to "
+                        f"{SHUTDOWN_DEADLINE_S}s for in-flight calls. Press Ctrl-C again to abort immediately.")
+        _SHUTDOWN_EVENT.set()
+
+    signal.signal(signal.SIGINT, _handle_signal)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, _handle_signal)
+
+
+def shutdown_requested() -> bool:
+    """Returns True once a graceful shutdown has been requested."""
+    return _SHUTDOWN_EVENT.is_set()
+
+
+def wait_for_shutdown(timeout_s: float) -> bool:
+    """Sleeps up to `timeout_s`, returning early (True) if a graceful shutdown is requested."""
+    return _SHUTDOWN_EVENT.wait(timeout_s)
+
+
+def iter_completed(futures, deadline_s: float = SHUTDOWN_DEADLINE_S):
+    """
+    Like `concurrent.futures.as_completed`, but shutdown-aware: once a shutdown is
+    requested, futures that have not started are cancelled (their groups stay
+    unprocessed in the manifest) and waiting stops after `deadline_s`.
+    """
+    pending, deadline = set(futures), None
+    while pending:
+        if shutdown_requested():
+            if deadline is None:
+                deadline = time.monotonic() + deadline_s
+                cancelled = {f for f in pending if f.cancel()}
+                pending -= cancelled
+                logging.warning(f"Shutdown: cancelled {len(cancelled)} queued call(s), {len(pending)} still in flight.")
+            if time.monotonic() >= deadline:
+                logging.warning(f"Shutdown deadline reached; abandoning {len(pending)} in-flight call(s).")
+                return
+        done, pending = concurrent.futures.wait(pending, timeout=1.0, return_when=concurrent.futures.FIRST_COMPLETED)
+        yield from done
+
+
+def delete_live_caches(api_key: str):
+    """Deletes every cache this process created and has not deleted yet."""
+    with _LIVE_CACHES_LOCK:
+        live_caches = list(_LIVE_CACHES)
+    for cache_name in live_caches:
+        delete_cache(cache_name, api_key)
+
+
+def finish_shutdown(api_key: str):
+    """
+    Completes a graceful shutdown after the caller has saved its manifest:
+    deletes live caches, flushes the logs and exits without waiting for
+    abandoned worker threads.
+    """
+    if not shutdown_requested():
+        return
+    delete_live_caches(api_key)
+    logging.warning("Graceful shutdown complete. Unfinished groups will be retried on the next run.")
+    for handler in logging.root.handlers:
+        handler.flush()
+    os._exit(130)
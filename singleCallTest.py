@@ -6,12 +6,12 @@
 import os
 import json
 import logging
-import pandas as pd
 from dotenv import load_dotenv
 import time
 
 # --- Import from the shared utility module ---
 import shared_utils as utils
+from catalog_io import load_processed_catalog
 # --- Import prompts from the main scripts ---
 from v4_stage_3_pass_1 import SYSTEM_PROMPT_PASS_1
 from v4_stage_3_pass_2 import SYSTEM_PROMPT_PASS_2, AIResponsePass2, aggregate_and_filter_pass_1_results, create_pass_2_batches
@@ -50,9 +50,9 @@ def run_test(api_key: str, pass_number: int, group_id: str):
         with open(community_definitions_path, 'r') as f:
             community_definitions = [utils.ParentCommunity.model_validate(item) for item in json.load(f)]
         
-        cde_df = pd.read_csv(processed_catalog_path, dtype={'ID': str}, low_memory=False)
+        cde_df = load_processed_catalog(csv_path=processed_catalog_path)
         # --- FIX: Ensure title column is treated as string to prevent type errors ---
-        cde_df['title'] = cde_df['title'].astype(str).fillna('')
+        cde_df['title'] = cde_df['title'].fillna('')
         cde_lookup = cde_df.set_index('ID').to_dict('index')
     except Exception as e:
         logging.fatal(f"Could not load critical input files: {e}")
@@ -73,44 +73,51 @@ def run_stage_1_processing(df: pd.DataFrame, mapping_dict: dict) -> tuple[pd.Dat
     
     # --- Step 2: Permissible Values Standardization (Two-Pass) ---
     logging.info("Step 2: Standardizing 'permissible_values' column...")
-    df_processed['__processed_pv'] = False
-
-    # Pass 2a: Direct Mapping from Dictionary
-    for index, row in df_processed.iterrows():
-        original_value = str(row[pv_col]).strip()
-        if not original_value or original_value.lower() == 'nan':
-            df_processed.loc[index, '__processed_pv'] = True
-            continue
-        
-        if original_value in mapping_dict:
-            cde_id = row[id_col]
-            map_entry = mapping_dict[original_value]
-            summary_counters['transformed_from_map'] += 1
-            
-            # Apply all defined transformations from the map
-            for key, std_val in map_entry.items():
-                target_col = COLUMN_MAP.get(key)
-                # Check if there is a value to apply and a valid target column
-                if pd.notna(std_val) and std_val != '' and target_col:
-                    # Always overwrite the target column with the standardized value
-                    original_target_val = row[target_col]
-                    df_processed.loc[index, target_col] = std_val
-                    change_log.append({
-                        'cde_id': cde_id,
-                        'column_changed': target_col,
-                        'action_taken': f'Applied from map: {original_value}',
-                        'original_value': original_target_val,
-                        'new_value': std_val
-                    })
-            
-            df_processed.loc[index, 'pv_was_standardized'] = True
-            df_processed.loc[index, '__processed_pv'] = True
-    
+    # Join the normalized PV key against the mapping table rather than iterating rows
+    pv_key = df_processed[pv_col].astype(str).str.strip()
+    is_blank = (pv_key == '') | (pv_key.str.lower() == 'nan')
+    is_mapped = (~is_blank & pv_key.isin(mapping_dict.keys())).to_numpy()
+    summary_counters['transformed_from_map'] += int(is_mapped.sum())
+
+    if is_mapped.any():
+        mapped_pos = np.flatnonzero(is_mapped)
+        mapped_keys = pv_key.to_numpy()[mapped_pos]
+        map_table = pd.DataFrame.from_dict(mapping_dict, orient='index').reindex(mapped_keys)
+        target_cols = {key: COLUMN_MAP[key] for key in map_table.columns if COLUMN_MAP.get(key)}
+        # Snapshot the values being replaced before any column is overwritten
+        originals = {col: df_processed[col].to_numpy()[mapped_pos] for col in target_cols.values()}
+        cde_ids = df_processed[id_col].to_numpy()[mapped_pos]
+
+        log_parts = []
+        for key_order, (key, target_col) in enumerate(target_cols.items()):
+            std_vals = map_table[key].to_numpy()
+            applies = pd.notna(std_vals) & (std_vals != '')
+            if not applies.any():
+                continue
+            if df_processed[target_col].dtype != object:
+                # e.g. an all-NaN float column receiving strings; the single-cell writes upcast it the same way
+                df_processed[target_col] = df_processed[target_col].astype(object)
+            df_processed.iloc[mapped_pos[applies], df_processed.columns.get_loc(target_col)] = std_vals[applies]
+            log_parts.append(pd.DataFrame({
+                '__row': mapped_pos[applies],
+                '__key': key_order,
+                'cde_id': cde_ids[applies],
+                'column_changed': target_col,
+                'action_taken': 'Applied from map: ' + pd.Series(mapped_keys[applies], dtype=object),
+                'original_value': originals[target_col][applies],
+                'new_value': std_vals[applies],
+            }))
+
+        # Same order as the row-by-row version: by row, then by mapping key
+        if log_parts:
+            log_df = pd.concat(log_parts, ignore_index=True).sort_values(['__row', '__key'], kind='stable')
+            change_log.extend(log_df.drop(columns=['__row', '__key']).to_dict('records'))
+
+    df_processed['pv_was_standardized'] = is_mapped
+
     # Pass 2b: General Regex for Remainder (if any)
     # This can be expanded in the future if new general patterns are found
     
-    df_processed.drop(columns=['__processed_pv'], inplace=True)
-    
     # --- Step 3: General Quality Heuristics for All Fields ---
     logging.info("Step 3: Applying general quality heuristics to all key fields...")
     is_null_var = pd.isna(df_processed[var_name_col]) | (df_processed[var_name_col] == '')
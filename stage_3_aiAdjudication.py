@@ -9,6 +9,8 @@ from pydantic import BaseModel
 from tqdm import tqdm
 import sys
 
+import response_reader as reader
+
 # This script uses the google-genai library.
 import google.genai as genai
 from google.genai import types
@@ -318,16 +320,11 @@ def process_cde_group(group_data: Dict[str, Any], api_key: str, cache_name: str,
         json.dump(response_json, dbg, indent=2)
 
     # 3) extract text payload
-    candidate = response_json.get("candidates", [{}])[0]
-    content   = candidate.get("content", candidate)
-    if isinstance(content, dict) and "parts" in content:
-        output_text = content["parts"][0].get("text", "")
-    elif isinstance(content, dict) and "text" in content:
-        output_text = content["text"]
-    elif isinstance(content, str):
-        output_text = content
-    else:
-        output_text = json.dumps(content)
+    output_text = reader.extract_response_text(response_json)
+    if not output_text:
+        # No text part (e.g. a safety-blocked candidate): keep the candidate content as the debug artifact
+        candidate = (response_json.get("candidates") or [{}])[0]
+        output_text = json.dumps(candidate.get("content", candidate))
 
     # 4) write parsed text
     raw_file = os.path.join(RAW_DIR, f"group_{group_id}_raw.txt")
@@ -335,26 +332,11 @@ def process_cde_group(group_data: Dict[str, Any], api_key: str, cache_name: str,
         f.write(output_text)
 
     # --- JSON auto-fix & validation (100% swallowed) ---
-    def fix_truncated_json(txt: str) -> str:
-        # close dangling quotes
-        if txt.count('"') % 2:
-            txt += '"'
-        # balance brackets/braces
-        opens  = txt.count('[') - txt.count(']')
-        braces = txt.count('{') - txt.count('}')
-        return txt + (']' * opens) + ('}' * braces)
-
-    try:
-        json.loads(output_text)
-    except Exception as ve:
-        # try auto-fix once
-        fixed = fix_truncated_json(output_text)
-        try:
-            json.loads(fixed)
-            output_text = fixed
-            log_error(group_id, Exception("auto-fixed JSON"), {"stage":"auto_fix"})
-        except Exception as ve2:
-           log_error(group_id, ve2, {"stage":"validation_failed"})
+    parsed = reader.parse_text(output_text)
+    if parsed.status == 'repaired':
+        log_error(group_id, Exception("auto-fixed JSON"), {"stage":"auto_fix"})
+    elif parsed.status == 'malformed':
+        log_error(group_id, ValueError(parsed.error), {"stage":"validation_failed"})
 
     # never return error for parsing issues—only real exceptions above do that
     return {"group_id": group_id, "status": "success"}
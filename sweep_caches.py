@@ -0,0 +1,87 @@
+# sweep_caches.py
+# Purpose: A standalone utility to delete orphaned Stage 3 context caches.
+# A killed run can leave cachedContents alive until their TTL expires, and they
+# are billed for storage until then. This lists every cache owned by the API key,
+# matches our display-name prefixes and deletes the stale ones.
+
+import os
+import re
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Any, Optional
+from dotenv import load_dotenv
+
+# --- Import from the shared utility module ---
+import shared_utils as utils
+
+# --- CONFIGURATION ---
+# Caches whose displayName starts with one of these prefixes are ours.
+CACHE_PREFIXES = [
+    utils.CACHE_DISPLAY_NAME_PASS_1,
+    utils.CACHE_DISPLAY_NAME_PASS_2,
+    "test_cache_",  # Created by the single-group test harness
+]
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parses an RFC 3339 timestamp (nanosecond precision is truncated to microseconds)."""
+    if not value:
+        return None
+    value = re.sub(r'(\.\d{6})\d+', r'\1', value).replace('Z', '+00:00')
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def find_stale_caches(entries: List[Dict[str, Any]], min_age_minutes: float) -> List[Dict[str, Any]]:
+    """Returns our caches that are older than `min_age_minutes`."""
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=min_age_minutes)
+    stale = []
+    for entry in entries:
+        display_name = entry.get("displayName", "")
+        if not any(display_name.startswith(prefix) for prefix in CACHE_PREFIXES):
+            continue
+        created = _parse_timestamp(entry.get("createTime"))
+        if created is None or created <= cutoff:
+            stale.append(entry)
+    return stale
+
+
+def sweep_caches(api_key: str, dry_run: bool, min_age_minutes: float):
+    """Lists cachedContents and deletes stale entries that match our prefixes."""
+    utils.setup_logging()
+    logging.info("--- Starting Orphaned Cache Sweeper ---")
+    if dry_run:
+        logging.info("--- OPERATING IN DRY RUN MODE (nothing will be deleted) ---")
+
+    try:
+        entries = utils.list_caches_via_rest(api_key)
+    except Exception as e:
+        utils.log_error("CACHE_LIST", e)
+        return
+
+    stale = find_stale_caches(entries, min_age_minutes)
+    logging.info(f"Found {len(entries)} cache(s); {len(stale)} match our prefixes and are older than {min_age_minutes:g} minutes.")
+
+    for entry in stale:
+        logging.info(f"  - {entry.get('name')} | {entry.get('displayName')} | created {entry.get('createTime')} | "
+                     f"expires {entry.get('expireTime')} | {entry.get('usageMetadata', {}).get('totalTokenCount', '?')} tokens")
+        if not dry_run:
+            utils.delete_cache(entry.get("name"), api_key)
+
+    logging.info("--- Cache Sweeper Finished ---")
+
+
+if __name__ == '__main__':
+    # --- CONFIGURE YOUR SWEEP HERE ---
+    DRY_RUN_MODE = True     # Set to False to actually delete the stale caches.
+    MIN_AGE_MINUTES = 15    # Leave caches younger than this alone (a run may still be using them).
+    # --------------------------------
+
+    load_dotenv()
+    google_api_key = os.getenv("GOOGLE_API_KEY")
+    if not google_api_key:
+        logging.fatal("FATAL: GOOGLE_API_KEY environment variable not found.")
+    else:
+        sweep_caches(api_key=google_api_key, dry_run=DRY_RUN_MODE, min_age_minutes=MIN_AGE_MINUTES)
@@ -6,8 +6,30 @@ import re
 import json
 import logging
 import sqlite3
+import tempfile
+import concurrent.futures
 from collections import defaultdict
 
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import profiling
+from provenance import ProvenanceWriter
+from catalog_io import CatalogParquetWriter, load_processed_catalog
+from catalog_sources import coalesce_merged, join_sources, iter_sqlite_chunks, read_sqlite_table
+import catalog_delta
+import csv_ingest
+from pv_mapping import PVMappingIndex
+from pv_classifier import classify_series, STRUCTURED_FEATURES
+from pv_parser import parse_series
+
 # --- Basic Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -18,10 +40,56 @@ TABLE_NAME = "CDE_Dictionary_Condensed"                    # <-- Set name of the
 ORIGINAL_CSV_PATH = 'cdeCatalogs/cdeCatalog.csv' # <-- Set path to the original CSV
 
 MAPPING_FILE_PATH = 'mapping/permissible_values_map.csv'
+CANONICAL_PV_MATCHING = True   # Also match PVs that differ from a mapping key only in quotes, spacing, case or trailing punctuation
 OUTPUT_DIR = "outputs/stage_1"
 FINAL_CATALOG_FILENAME = "cde_catalog_processed.csv"
-PROVENANCE_LOG_FILENAME = "change_provenance_log.csv"
+PARQUET_CATALOG_FILENAME = "cde_catalog_processed.parquet" # Typed copy read by downstream stages (needs pyarrow)
+PROVENANCE_LOG_FILENAME = "change_provenance_log.parquet"
+PROVENANCE_CSV_FILENAME = "change_provenance_log.csv"
+WRITE_PROVENANCE_CSV = False   # Also write the provenance log as CSV (always done when pyarrow is missing)
 UNPARSABLE_LOG_FILENAME = "unparsable_values_log.csv"
+UNPARSED_PV_REPORT_FILENAME = "unparsed_pv_report.csv" # Distinct PVs neither mapped nor parsed, by CDE count
+QUARANTINE_FILENAME = "quarantined_csv_lines.csv" # Source CSV records that could not be parsed, with line numbers
+
+# -- Streaming --
+# Process the catalog in ID-ordered chunks so peak memory stays flat as it grows.
+# Both sources are spilled to a temporary SQLite file in OUTPUT_DIR first.
+STREAMING_MODE = False
+STREAM_CHUNK_SIZE = 20000
+
+# -- Incremental runs (in-memory mode only) --
+# Reprocess only CDEs whose merged source row changed since the last run and carry the rest
+# forward from the previous catalog. A change to the mapping file, the source columns or
+# STAGE_1_LOGIC_VERSION triggers a full rebuild. The provenance log keeps the previous
+# run's entries for carried CDEs; the delta file lists what was added, changed or removed.
+INCREMENTAL_MODE = True
+STAGE_1_LOGIC_VERSION = 5      # Bump whenever run_stage_1_processing changes its output
+ROW_HASHES_FILENAME = "cde_catalog_row_hashes.json"
+DELTA_FILENAME = "cde_catalog_delta.csv"
+
+# -- Per-value rules --
+# PV strings repeat heavily across the catalog, so the PV-dependent rules (pre-clean, mapping
+# lookup, constraint/pipe detection) run once per unique value and are broadcast back by code.
+FACTORIZE_PV_RULES = True
+
+# -- JSON PVs --
+# Some sources put the whole value_mapping JSON object in permissible_values. Step 0 moves
+# such objects into an empty value_mapping and clears the PV (formerly moveJSONtoValMap.py,
+# a separate pass over the CSV). Only PVs starting with '{' are decoded, once per unique value.
+MOVE_JSON_PVS = True
+
+# -- Structured PV parsing --
+# PVs the mapping table does not cover are run through pv_parser (Step 2b): code/label lists,
+# "(y>=a)" constraints, numeric ranges and pipe lists become a standardized PV plus, where
+# it applies, value_mapping/unit/format. CDEs whose value_mapping was derived this way are
+# marked `pv_was_parsed` and skipped by Stage 3 Pass 2.
+PARSE_STRUCTURED_PVS = True
+
+# -- Parallel heuristics --
+# Pre-cleaning (Step 1) and the heuristics (Steps 3-4) are row-local, so large frames are
+# split into row ranges and run in a process pool. Partitions travel as Arrow tables.
+PARALLEL_WORKERS = 1           # 1 runs everything in-process
+PARALLEL_MIN_ROWS = 100_000    # Smaller frames (e.g. streaming chunks) are not worth the transfer
 
 # --- Column Names ---
 COLUMN_MAP = {
@@ -36,13 +104,228 @@ COLUMN_MAP = {
 }
 # --- End of Configuration ---
 
+def per_unique(func, values: pd.Series) -> tuple:
+    """
+    Evaluates a per-value rule once per unique value (via pd.factorize) and broadcasts the
+    result back to the rows. Returns (result aligned with `values`, number of unique values).
+    """
+    if not FACTORIZE_PV_RULES:
+        return func(values), len(values)
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    result = func(pd.Series(uniques, name=values.name))
+    return result.iloc[codes].set_axis(values.index), len(uniques)
+
+def apply_pv_mapping(df_processed: pd.DataFrame, mapping_dict, summary_counters: dict):
+    """
+    Step 2: applies the PV mapping table (a dict or a prebuilt PVMappingIndex) in place and
+    sets `pv_was_standardized`. Provenance is recorded by the caller as a before/after diff
+    of the mapped columns.
+    """
+    pv_col = COLUMN_MAP['PV']
+    mapping_index = mapping_dict if isinstance(mapping_dict, PVMappingIndex) else PVMappingIndex(mapping_dict, canonical=False)
+
+    def _resolve(pvs: pd.Series) -> pd.DataFrame:
+        pv_key = pvs.astype(str).str.strip()
+        keys, via_canonical = mapping_index.resolve(pv_key)
+        is_blank = (pv_key == '') | (pv_key.str.lower() == 'nan')
+        return pd.DataFrame({'key': keys, 'via_canonical': via_canonical, 'is_blank': is_blank.to_numpy()})
+
+    # Resolve each unique PV against the mapping index rather than iterating rows
+    resolved, _ = per_unique(_resolve, df_processed[pv_col])
+    matched_keys, via_canonical = resolved['key'].to_numpy(), resolved['via_canonical'].to_numpy()
+    is_mapped = ~resolved['is_blank'].to_numpy(dtype=bool) & pd.notna(matched_keys)
+    summary_counters['transformed_from_map'] += int(is_mapped.sum())
+    summary_counters['transformed_from_map_canonical_key'] += int((is_mapped & via_canonical).sum())
+    df_processed['pv_was_standardized'] = is_mapped
+    if not is_mapped.any():
+        return
+
+    mapped_pos = np.flatnonzero(is_mapped)
+    map_table = mapping_index.table.reindex(matched_keys[mapped_pos])
+    for key in map_table.columns:
+        target_col = COLUMN_MAP.get(key)
+        if target_col:
+            _write_values(df_processed, target_col, mapped_pos, map_table[key].to_numpy())
+
+def _write_values(df_processed: pd.DataFrame, col: str, positions: np.ndarray, values: np.ndarray):
+    """Writes `values` into `col` at row `positions`, skipping missing and empty values."""
+    applies = pd.notna(values) & (values != '')
+    if not applies.any():
+        return
+    if df_processed[col].dtype != object:
+        # e.g. an all-NaN float column receiving strings; the single-cell writes upcast it the same way
+        df_processed[col] = df_processed[col].astype(object)
+    df_processed.iloc[positions[applies], df_processed.columns.get_loc(col)] = values[applies]
+
+def _is_blank(values: pd.Series) -> np.ndarray:
+    return (pd.isna(values) | values.astype(str).str.strip().str.lower().isin(['', 'nan'])).to_numpy(dtype=bool)
+
+def _json_object_text(value: str):
+    """Re-serializes a PV holding a JSON object; None for anything else."""
+    try:
+        parsed = orjson.loads(value) if orjson is not None else json.loads(value)
+    except ValueError:
+        try:
+            # json also accepts what orjson rejects (NaN/Infinity literals, lone surrogates)
+            parsed = json.loads(value)
+        except ValueError:
+            return None
+    return json.dumps(parsed) if isinstance(parsed, dict) else None
+
+def move_json_pvs(df_processed: pd.DataFrame, summary_counters: dict):
+    """
+    Step 0: where value_mapping is empty and the PV is a JSON object, moves the object into
+    value_mapping and clears the PV.
+    """
+    pv_col, vm_col = COLUMN_MAP['PV'], COLUMN_MAP['VM']
+    pvs = df_processed[pv_col]
+    # Cheap prefilter: only PVs that start with '{' can hold an object
+    is_candidate = pvs.astype(str).str.lstrip().str.startswith('{', na=False).to_numpy(dtype=bool)
+    candidates = np.flatnonzero(is_candidate & _is_blank(df_processed[vm_col]))
+    if not len(candidates):
+        return
+    decoded, _ = per_unique(lambda values: values.map(_json_object_text).astype(object), pvs.iloc[candidates])
+    decoded = decoded.to_numpy()
+    is_object = pd.notna(decoded)
+    positions = candidates[is_object]
+    _write_values(df_processed, vm_col, positions, decoded[is_object])
+    df_processed.iloc[positions, df_processed.columns.get_loc(pv_col)] = ''
+    summary_counters['moved_json_to_value_mapping'] += len(positions)
+
+def apply_pv_parser(df_processed: pd.DataFrame, summary_counters: dict):
+    """
+    Step 2b: parses the PVs of CDEs the mapping table did not standardize and that have no
+    value_mapping yet. The parsed PV replaces the original; value format and unit only fill
+    empty cells. Sets `pv_was_parsed` where a value_mapping was derived.
+    """
+    pv_col, vf_col, um_col, vm_col = COLUMN_MAP['PV'], COLUMN_MAP['VF'], COLUMN_MAP['UM'], COLUMN_MAP['VM']
+    df_processed['pv_was_parsed'] = False
+    candidates = np.flatnonzero(~df_processed['pv_was_standardized'].to_numpy(dtype=bool) & _is_blank(df_processed[vm_col]))
+    if not len(candidates):
+        return
+    parsed, _ = per_unique(parse_series, df_processed[pv_col].iloc[candidates])
+    is_parsed = parsed['kind'].notna().to_numpy()
+    positions, parsed = candidates[is_parsed], parsed[is_parsed]
+    for kind, count in parsed['kind'].value_counts().items():
+        summary_counters[f'parsed_pv_{kind}'] += int(count)
+
+    _write_values(df_processed, pv_col, positions, parsed['permissible_values'].to_numpy())
+    for field, col in (('value_format', vf_col), ('unit_of_measure', um_col)):
+        is_empty = _is_blank(df_processed[col].iloc[positions])
+        _write_values(df_processed, col, positions[is_empty], parsed[field].to_numpy()[is_empty])
+    has_mapping = (parsed['value_mapping'] != '').to_numpy()
+    _write_values(df_processed, vm_col, positions[has_mapping], parsed['value_mapping'].to_numpy()[has_mapping])
+    df_processed.iloc[positions[has_mapping], df_processed.columns.get_loc('pv_was_parsed')] = True
+    summary_counters['transformed_by_parser'] += int(has_mapping.sum())
+
+def unparsed_pv_counts(df_processed: pd.DataFrame) -> pd.DataFrame:
+    """Non-empty PVs without a value_mapping that were neither mapped, parsed nor are otherwise structured, with their CDE counts."""
+    pv_col = COLUMN_MAP['PV']
+    is_unparsed = (~df_processed['pv_was_standardized'].to_numpy(dtype=bool)
+                   & ~df_processed['pv_was_parsed'].to_numpy(dtype=bool)
+                   & ~_is_blank(df_processed[pv_col]) & _is_blank(df_processed[COLUMN_MAP['VM']])
+                   & ~df_processed['pv_format_class'].isin(STRUCTURED_FEATURES).to_numpy())
+    unparsed = df_processed.loc[is_unparsed, [pv_col, 'pv_format_class']].astype(str)
+    return unparsed.groupby([pv_col, 'pv_format_class']).size().rename('n_cdes').reset_index()
+
+def write_unparsed_report(counts: pd.DataFrame, report_path: str):
+    """Writes the unparsed-PV report, most frequent first (chunk counts are summed)."""
+    pv_col = COLUMN_MAP['PV']
+    report = counts.groupby([pv_col, 'pv_format_class'], as_index=False)['n_cdes'].sum()
+    report = report.sort_values(['n_cdes', pv_col], ascending=[False, True])[[pv_col, 'n_cdes', 'pv_format_class']]
+    report.to_csv(report_path, index=False)
+    logging.info(f"Saved {len(report)} distinct unparsed PVs ({int(report['n_cdes'].sum())} CDEs) to: {report_path}")
+
+def pre_clean_pv(pv: pd.Series) -> pd.Series:
+    """Step 1: strips PV boilerplate and clears placeholder values."""
+    pv = pv.astype(str).fillna('').str.strip()
+    for phrase in ['Permissible values range', 'Permissible values']:
+        pv = pv.str.replace(phrase, '', case=False, regex=False)
+    pv = pv.str.strip().str.lstrip(':')
+    pv[pv.isin(['1', 'Response'])] = ''
+    return pv
+
+def _word_count(values: pd.Series) -> pd.Series:
+    # Missing values count as no words (not as the one word 'nan'), even when the whole column is missing
+    return values.fillna('').astype(str).str.split().str.len()
+
+def quality_heuristic_flags(df: pd.DataFrame) -> pd.DataFrame:
+    """Step 3: flags weak variable names, titles and descriptions."""
+    var_name_col, title_col, desc_col = COLUMN_MAP['VAR_NAME'], COLUMN_MAP['TITLE'], COLUMN_MAP['SHORT_DESC']
+    flags = pd.DataFrame(index=df.index)
+    is_null_var = pd.isna(df[var_name_col]) | (df[var_name_col] == '')
+    is_bad_format = ~df[var_name_col].astype(str).str.match(r'^[a-z_][a-z0-9_]*$', na=False)
+    is_too_long = df[var_name_col].astype(str).str.len() > 30
+    flags['flag_bad_variable_name'] = is_null_var | is_bad_format | is_too_long
+
+    is_null_title = pd.isna(df[title_col]) | (df[title_col] == '')
+    is_too_short = _word_count(df[title_col]) < 3
+    flags['flag_bad_title'] = is_null_title | is_too_short
+
+    is_null_desc = pd.isna(df[desc_col]) | (df[desc_col] == '')
+    is_desc_too_short = _word_count(df[desc_col]) < 5
+    is_redundant = (df[title_col] == df[desc_col]) & (df[title_col] != '')
+    flags['flag_bad_description'] = is_null_desc | is_desc_too_short | is_redundant
+    return flags
+
+def _is_free_entry(vf: pd.Series) -> pd.Series:
+    return vf.str.lower() == 'free entry'
+
+def pv_structure_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Step 4: classifies each PV's format in a single scan (`pv_format_class`) and flags PVs
+    that are neither pipe-delimited, a constraint, empty nor free entry.
+    """
+    is_free_entry, _ = per_unique(_is_free_entry, df[COLUMN_MAP['VF']])
+    features, _ = per_unique(classify_series, df[COLUMN_MAP['PV']])
+    is_structured = features[list(STRUCTURED_FEATURES)].any(axis=1)
+    return pd.DataFrame({'flag_bad_permissibles': ~is_structured & ~is_free_entry,
+                         'pv_format_class': features['format_class']})
+
+def _pre_clean_partition(df: pd.DataFrame) -> pd.DataFrame:
+    return per_unique(pre_clean_pv, df[COLUMN_MAP['PV']])[0].to_frame()
+
+def _all_heuristic_flags(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.concat([quality_heuristic_flags(df), pv_structure_columns(df)], axis=1)
+
+def _run_partition(func, payload):
+    """Pool task: unpacks one row range (an Arrow table, or a frame if Arrow could not hold it) and applies `func`."""
+    df = payload.to_pandas() if pa is not None and isinstance(payload, pa.Table) else payload
+    return func(df)
+
+_EXECUTOR = None
+
+def _parallel_executor() -> concurrent.futures.ProcessPoolExecutor:
+    """The worker pool, started on first use and reused for the rest of the run."""
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        logging.info(f"Starting {PARALLEL_WORKERS} worker processes for Steps 1, 3 and 4.")
+        _EXECUTOR = concurrent.futures.ProcessPoolExecutor(max_workers=PARALLEL_WORKERS)
+    return _EXECUTOR
+
+def run_partitioned(func, df: pd.DataFrame, executor: concurrent.futures.Executor, n_parts: int):
+    """Applies a row-local step to contiguous row ranges in the pool and concatenates the results in row order."""
+    bounds = np.linspace(0, len(df), n_parts + 1, dtype=int)
+    payloads = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        part = df.iloc[start:stop]
+        if pa is not None:
+            try:
+                part = pa.Table.from_pandas(part, preserve_index=False)
+            except (pa.ArrowTypeError, pa.ArrowInvalid):
+                pass  # Mixed-type column: fall back to pickling the frame
+        payloads.append(part)
+    results = list(executor.map(_run_partition, [func] * len(payloads), payloads))
+    combined = pd.concat(results, ignore_index=True)
+    combined.index = df.index
+    return combined
+
 # The run_stage_1_processing function remains the same as before.
 # All changes are in the main() function's data loading section.
-def run_stage_1_processing(df: pd.DataFrame, mapping_dict: dict) -> tuple[pd.DataFrame, list, dict]:
+def run_stage_1_processing(df: pd.DataFrame, mapping_dict: dict, provenance: ProvenanceWriter = None) -> tuple[pd.DataFrame, dict]:
     # ... (This function from your existing script does not need to be changed) ...
     # For brevity, its code is omitted here, but should be kept in your file.
     logging.info("Starting complete Stage 1 data processing workflow...")
-    change_log = []
     summary_counters = defaultdict(int)
     
     # --- Ensure all required columns exist ---
@@ -55,170 +338,362 @@ def run_stage_1_processing(df: pd.DataFrame, mapping_dict: dict) -> tuple[pd.Dat
 
     df_processed = df.copy()
     df_processed['pv_was_standardized'] = False
+    df_processed['pv_was_parsed'] = False
+    parallel = PARALLEL_WORKERS > 1 and len(df_processed) >= PARALLEL_MIN_ROWS
+    executor = _parallel_executor() if parallel else None
     
     # --- Get column names from map for easier access ---
     id_col, pv_col, vf_col, um_col, vm_col, var_name_col, title_col, desc_col = [COLUMN_MAP.get(k) for k in ['ID', 'PV', 'VF', 'UM', 'VM', 'VAR_NAME', 'TITLE', 'SHORT_DESC']]
 
+    # --- Step 0: JSON Objects in the PV Column ---
+    if MOVE_JSON_PVS:
+        logging.info("Step 0: Moving JSON objects from 'permissible_values' to 'value_mapping'...")
+        with profiling.phase("step_0_json_to_value_mapping"):
+            before = df_processed[[pv_col, vm_col]].copy() if provenance is not None else None
+            move_json_pvs(df_processed, summary_counters)
+            if provenance is not None:
+                for col in (pv_col, vm_col):
+                    provenance.record_diff(df_processed[id_col], col, 'json_to_vm', before[col], df_processed[col])
+            del before
+
     # --- Step 1: Pre-Cleaning of PV Column ---
     logging.info("Step 1: Applying pre-cleaning rules...")
-    df_processed[pv_col] = df_processed[pv_col].astype(str).fillna('').str.strip()
-    for phrase in ['Permissible values range', 'Permissible values']:
-        df_processed[pv_col] = df_processed[pv_col].str.replace(phrase, '', case=False, regex=False)
-    df_processed[pv_col] = df_processed[pv_col].str.strip().str.lstrip(':')
-    df_processed.loc[df_processed[pv_col].isin(['1', 'Response']), pv_col] = ''
+    with profiling.phase("step_1_pre_clean"):
+        pv_before = df_processed[pv_col].copy() if provenance is not None else None
+        if executor is not None and not FACTORIZE_PV_RULES:
+            df_processed[pv_col] = run_partitioned(_pre_clean_partition, df_processed[[pv_col]], executor, PARALLEL_WORKERS)[pv_col]
+        else:
+            # Factorized, the rule only sees the unique PVs: not worth shipping to the pool
+            df_processed[pv_col], n_unique = per_unique(pre_clean_pv, df_processed[pv_col])
+            if FACTORIZE_PV_RULES:
+                summary_counters['pv_unique_values'] = n_unique
+                logging.info(f"Per-value rules run on {n_unique:,} unique PVs for {len(df_processed):,} rows "
+                             f"({n_unique / max(len(df_processed), 1):.1%}).")
+        if provenance is not None:
+            provenance.record_diff(df_processed[id_col], pv_col, 'pre_clean', pv_before, df_processed[pv_col])
+        del pv_before
     
     # --- Step 2: Permissible Values Standardization (Two-Pass) ---
     logging.info("Step 2: Standardizing 'permissible_values' column...")
-    df_processed['__processed_pv'] = False
-    for index, row in df_processed.iterrows():
-        original_value = str(row[pv_col]).strip()
-        if not original_value or original_value.lower() == 'nan':
-            df_processed.loc[index, '__processed_pv'] = True
-            continue
-        
-        if original_value in mapping_dict:
-            cde_id = row[id_col]
-            map_entry = mapping_dict[original_value]
-            summary_counters['transformed_from_map'] += 1
-            for key, std_val in map_entry.items():
-                target_col = COLUMN_MAP.get(key)
-                if pd.notna(std_val) and std_val != '' and target_col:
-                    original_target_val = row[target_col]
-                    df_processed.loc[index, target_col] = std_val
-                    change_log.append({
-                        'cde_id': cde_id,
-                        'column_changed': target_col,
-                        'action_taken': f'Applied from map: {original_value}',
-                        'original_value': original_target_val,
-                        'new_value': std_val
-                    })
-            df_processed.loc[index, 'pv_was_standardized'] = True
-            df_processed.loc[index, '__processed_pv'] = True
-    df_processed.drop(columns=['__processed_pv'], inplace=True)
+    with profiling.phase("step_2_pv_mapping"):
+        mapped_cols = [pv_col, um_col, vf_col, vm_col]
+        before = df_processed[mapped_cols].copy() if provenance is not None else None
+        apply_pv_mapping(df_processed, mapping_dict, summary_counters)
+        if provenance is not None:
+            for col in mapped_cols:
+                provenance.record_diff(df_processed[id_col], col, 'pv_map', before[col], df_processed[col])
+        del before
+
+    # --- Step 2b: Structured Parsing of the Remaining PVs ---
+    if PARSE_STRUCTURED_PVS:
+        logging.info("Step 2b: Parsing the remaining 'permissible_values' into structured definitions...")
+        with profiling.phase("step_2b_pv_parser"):
+            before = df_processed[mapped_cols].copy() if provenance is not None else None
+            apply_pv_parser(df_processed, summary_counters)
+            if provenance is not None:
+                for col in mapped_cols:
+                    provenance.record_diff(df_processed[id_col], col, 'pv_parse', before[col], df_processed[col])
+            del before
     
-    # --- Step 3: General Quality Heuristics for All Fields ---
+    # --- Steps 3 and 4: General Quality Heuristics and Final PV Quality Check ---
     logging.info("Step 3: Applying general quality heuristics to all key fields...")
-    is_null_var = pd.isna(df_processed[var_name_col]) | (df_processed[var_name_col] == '')
-    is_bad_format = ~df_processed[var_name_col].astype(str).str.match(r'^[a-z_][a-z0-9_]*$', na=False)
-    is_too_long = df_processed[var_name_col].astype(str).str.len() > 30
-    df_processed['flag_bad_variable_name'] = is_null_var | is_bad_format | is_too_long
-    summary_counters['flagged_bad_variable_name'] = int(df_processed['flag_bad_variable_name'].sum())
-
-    is_null_title = pd.isna(df_processed[title_col]) | (df_processed[title_col] == '')
-    is_too_short = df_processed[title_col].astype(str).str.split().str.len() < 3
-    df_processed['flag_bad_title'] = is_null_title | is_too_short
-    summary_counters['flagged_bad_title'] = int(df_processed['flag_bad_title'].sum())
-
-    is_null_desc = pd.isna(df_processed[desc_col]) | (df_processed[desc_col] == '')
-    is_desc_too_short = df_processed[desc_col].astype(str).str.split().str.len() < 5
-    is_redundant = (df_processed[title_col] == df_processed[desc_col]) & (df_processed[title_col] != '')
-    df_processed['flag_bad_description'] = is_null_desc | is_desc_too_short | is_redundant
-    summary_counters['flagged_bad_description'] = int(df_processed['flag_bad_description'].sum())
-    
-    # --- Step 4: Final PV Quality Check ---
     logging.info("Step 4: Running final check on 'permissible_values' structure...")
-    is_free_entry = df_processed[vf_col].str.lower() == 'free entry'
-    is_constraint = df_processed[pv_col].astype(str).str.match(r'^\(y\s*[<>=!].*\)$', na=False)
-    is_pipe = df_processed[pv_col].astype(str).str.contains('|', regex=False, na=False)
-    is_empty_or_nan = pd.isna(df_processed[pv_col]) | (df_processed[pv_col].astype(str).isin(['', 'nan']))
-    is_structured = is_pipe | is_constraint | is_empty_or_nan
-    df_processed['flag_bad_permissibles'] = ~is_structured & ~is_free_entry
-    summary_counters['flagged_bad_permissibles'] = int(df_processed['flag_bad_permissibles'].sum())
+    heuristic_cols = [var_name_col, title_col, desc_col, pv_col, vf_col]
+    if executor is not None:
+        with profiling.phase("step_3_4_parallel_heuristics"):
+            flags = run_partitioned(_all_heuristic_flags, df_processed[heuristic_cols], executor, PARALLEL_WORKERS)
+    else:
+        with profiling.phase("step_3_quality_heuristics"):
+            flags = quality_heuristic_flags(df_processed)
+        with profiling.phase("step_4_pv_structure_check"):
+            flags = pd.concat([flags, pv_structure_columns(df_processed)], axis=1)
+    for col in flags.columns:
+        df_processed[col] = flags[col].to_numpy()
+        if col.startswith('flag_'):
+            summary_counters[col.replace('flag_', 'flagged_', 1)] = int(flags[col].sum())
 
     # --- Step 5: Create Final Audit Flag ---
-    flag_cols = [col for col in df_processed.columns if col.startswith('flag_')]
-    df_processed['needs_audit'] = df_processed[flag_cols].any(axis=1)
-    summary_counters['total_cde_needs_audit'] = int(df_processed['needs_audit'].sum())
+    with profiling.phase("step_5_audit_flag"):
+        flag_cols = [col for col in df_processed.columns if col.startswith('flag_')]
+        df_processed['needs_audit'] = df_processed[flag_cols].any(axis=1)
+        summary_counters['total_cde_needs_audit'] = int(df_processed['needs_audit'].sum())
     
-    return df_processed, change_log, summary_counters
+    return df_processed, summary_counters
+
+def load_mapping_dict(mapping_path: str) -> dict:
+    """Loads the PV mapping table as {original_expression: {'PV', 'UM', 'VF', 'VM'}}."""
+    df_map = pd.read_csv(mapping_path, keep_default_na=False)
+    return {
+        row['original_expression'].strip(): {
+            'PV': row['standardized_pv'], 'UM': row['standardized_unit'],
+            'VF': row['standardized_value_format'], 'VM': row['standardized_value_mapping']
+        } for _, row in df_map.iterrows()
+    }
+
+def write_outputs(df_processed: pd.DataFrame, output_path: str, unparsable_path: str,
+                  catalog_writer: CatalogParquetWriter = None, append: bool = False):
+    """Writes the processed catalog (CSV and typed Parquet) and the unparsable-values dump (appending when streaming)."""
+    unparsable_df = df_processed[df_processed['flag_bad_permissibles']]
+    if not unparsable_df.empty:
+        if not append:
+            logging.warning(f"Found {len(unparsable_df)} CDEs with unparsable 'permissible_values' metadata. Saving to dump file.")
+        unparsable_df[[COLUMN_MAP['ID'], COLUMN_MAP['PV']]].to_csv(
+            unparsable_path, index=False, mode='a' if append else 'w',
+            header=not (append and os.path.exists(unparsable_path)))
+
+    # Final cleaning step before saving
+    final_cols_to_drop = [col for col in df_processed.columns if isinstance(col, str) and 'Unnamed:' in col]
+    if final_cols_to_drop:
+        df_processed.drop(columns=final_cols_to_drop, inplace=True, errors='ignore')
+        if not append:
+            logging.info(f"Removed final unwanted columns: {final_cols_to_drop}")
+
+    df_processed.to_csv(output_path, index=False, mode='a' if append else 'w',
+                        header=not (append and os.path.exists(output_path)))
+    if catalog_writer is not None:
+        catalog_writer.write(df_processed)
+
+# --- Incremental mode ---
+
+def run_incremental(df_cde: pd.DataFrame, mapping_dict: dict, provenance: ProvenanceWriter, output_path: str,
+                    parquet_path: str, hashes_path: str) -> tuple:
+    """
+    Reprocesses only new or changed rows of the merged catalog and carries the others forward
+    from the previous outputs. Returns (df_processed, summary_counters, state), where `state`
+    is saved with save_incremental_state once the outputs are written.
+    """
+    fingerprint = catalog_delta.run_fingerprint(MAPPING_FILE_PATH, [STAGE_1_LOGIC_VERSION, CANONICAL_PV_MATCHING, PARSE_STRUCTURED_PVS, MOVE_JSON_PVS],
+                                                df_cde.columns)
+    hashes = catalog_delta.row_hashes(df_cde)
+    previous_fingerprint, previous_hashes = catalog_delta.load_row_hashes(hashes_path)
+    full_rebuild = previous_fingerprint != fingerprint
+    if full_rebuild and previous_fingerprint is not None:
+        logging.info("Mapping file, source columns or logic version changed since the last run: reprocessing every CDE.")
+    to_process, delta = catalog_delta.diff_rows(df_cde['ID'], hashes, previous_hashes, full_rebuild)
+
+    carried, carried_pos = None, None
+    if not to_process.all():
+        try:
+            carried = load_processed_catalog(csv_path=output_path, parquet_path=parquet_path, categorical=False)
+            carried_ids = pd.Index(carried['ID'])
+            carried_pos = carried_ids.get_indexer(df_cde['ID'][~to_process]) if carried_ids.is_unique else np.array([-1])
+        except Exception as e:
+            logging.warning(f"Could not read the previous catalog ({e}).")
+            carried_pos = np.array([-1])
+        if (carried_pos < 0).any():
+            logging.warning("The previous catalog does not match its row hashes: reprocessing every CDE.")
+            carried = None
+            delta = catalog_delta.diff_rows(df_cde['ID'], hashes, previous_hashes, True)[1]
+            to_process = np.ones(len(df_cde), dtype=bool)
+
+    logging.info(f"Incremental mode: reprocessing {int(to_process.sum())} of {len(df_cde)} CDEs.")
+    summary_counters = defaultdict(int)
+    parts = []
+    if to_process.any():
+        df_processed, summary_counters = run_stage_1_processing(df_cde[to_process].reset_index(drop=True), mapping_dict, provenance)
+        df_processed.index = np.flatnonzero(to_process)
+        parts.append(df_processed)
+    if carried is not None:
+        df_carried = carried.iloc[carried_pos]
+        df_carried.index = np.flatnonzero(~to_process)
+        parts.append(df_carried)
+        provenance.carry_forward(df_cde['ID'][~to_process])
+    df_processed = pd.concat(parts).sort_index().reset_index(drop=True) if len(parts) > 1 else parts[0].reset_index(drop=True)
+
+    # Counts cover the whole catalog, not just the reprocessed rows
+    summary_counters['transformed_from_map'] = int(df_processed['pv_was_standardized'].sum())
+    summary_counters['transformed_by_parser'] = int(df_processed['pv_was_parsed'].sum())
+    for col in [col for col in df_processed.columns if col.startswith('flag_')]:
+        summary_counters[col.replace('flag_', 'flagged_', 1)] = int(df_processed[col].sum())
+    summary_counters['total_cde_needs_audit'] = int(df_processed['needs_audit'].sum())
+    summary_counters['incremental_reprocessed'] = int(to_process.sum())
+    summary_counters['incremental_carried_forward'] = int((~to_process).sum())
+    return df_processed, summary_counters, (fingerprint, df_cde['ID'], hashes, delta)
+
+def save_incremental_state(state: tuple, hashes_path: str, delta_path: str):
+    fingerprint, ids, hashes, delta = state
+    catalog_delta.write_delta(delta_path, delta)
+    catalog_delta.save_row_hashes(hashes_path, fingerprint, ids, hashes)
+
+# --- Streaming mode ---
+
+def _quote(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _spill_to_sqlite(chunks, conn: sqlite3.Connection, table_name: str) -> list:
+    """Copies a chunked source into the spill database as TEXT, dropping rows without an ID. Returns its columns."""
+    columns, rows = None, 0
+    for chunk in chunks:
+        chunk = chunk.dropna(subset=['ID'])
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        chunk['ID'] = chunk['ID'].astype(str)
+        if columns is None:
+            columns = list(chunk.columns)
+        chunk.to_sql(table_name, conn, if_exists='append', index=False, dtype={col: 'TEXT' for col in chunk.columns})
+        rows += len(chunk)
+    if columns is None:
+        raise ValueError(f"No rows were read into '{table_name}'.")
+    conn.execute(f"CREATE INDEX idx_{table_name}_id ON {table_name} (ID)")
+    conn.commit()
+    logging.info(f"Spilled {rows} rows with valid IDs to '{table_name}'.")
+    return columns
+
+def _merged_query(csv_columns: list, sqlite_columns: list) -> str:
+    """SQL outer merge of the spilled sources: same column order as join_sources (after coalescing), ordered by ID."""
+    csv_only = [col for col in csv_columns if col != 'ID']
+    sqlite_only = [col for col in sqlite_columns if col != 'ID']
+    common = set(csv_only) & set(sqlite_only)
+    select = []
+    for col in csv_columns:
+        if col == 'ID':
+            select.append('ids.ID AS ID')
+        else:
+            select.append(f"c.{_quote(col)} AS {_quote(f'{col}_csv' if col in common else col)}")
+    if 'ID' not in csv_columns:
+        select.insert(0, 'ids.ID AS ID')
+    for col in sqlite_only:
+        select.append(f"s.{_quote(col)} AS {_quote(f'{col}_sqlite' if col in common else col)}")
+    return (f"SELECT {', '.join(select)} "
+            f"FROM (SELECT ID FROM csv_source UNION SELECT ID FROM db_source) AS ids "
+            f"LEFT JOIN csv_source AS c ON c.ID = ids.ID "
+            f"LEFT JOIN db_source AS s ON s.ID = ids.ID "
+            f"ORDER BY ids.ID")
+
+def run_streaming(mapping_dict: dict, provenance: ProvenanceWriter, catalog_writer: CatalogParquetWriter,
+                  output_path: str, unparsable_path: str, report_path: str, quarantine_path: str) -> dict:
+    """
+    Bounded-memory Stage 1: both sources are spilled to a temporary SQLite database,
+    merged there and streamed back in ID-ordered chunks. Each chunk goes through the
+    full processing and is appended to the outputs. Source values are kept as text.
+    """
+    summary_counters = defaultdict(int)
+    unparsed_counts = []
+    spill_fd, spill_path = tempfile.mkstemp(prefix="stage_1_spill_", suffix=".sqlite", dir=OUTPUT_DIR)
+    os.close(spill_fd)
+    for path in (output_path, unparsable_path):
+        if os.path.exists(path):
+            os.remove(path)
+    try:
+        spill = sqlite3.connect(spill_path)
+        with profiling.phase("spill_sources"):
+            logging.info(f"Streaming mode: spilling both sources to {spill_path} in chunks of {STREAM_CHUNK_SIZE}...")
+            sqlite_columns = _spill_to_sqlite(
+                iter_sqlite_chunks(DATABASE_PATH, TABLE_NAME, chunk_size=STREAM_CHUNK_SIZE), spill, 'db_source')
+            with csv_ingest.checked_csv(ORIGINAL_CSV_PATH, quarantine_path) as stream, \
+                    pd.read_csv(stream, sep=',', engine=csv_ingest.PARSER_ENGINE, dtype=str, chunksize=STREAM_CHUNK_SIZE) as reader:
+                csv_columns = _spill_to_sqlite(reader, spill, 'csv_source')
+
+        total_rows = 0
+        for chunk_num, chunk in enumerate(pd.read_sql_query(_merged_query(csv_columns, sqlite_columns), spill,
+                                                             chunksize=STREAM_CHUNK_SIZE)):
+            with profiling.phase("stream_chunk"):
+                df_processed, chunk_counters = run_stage_1_processing(coalesce_merged(chunk), mapping_dict, provenance)
+                for action, count in chunk_counters.items():
+                    summary_counters[action] += count
+                write_outputs(df_processed, output_path, unparsable_path, catalog_writer, append=True)
+                unparsed_counts.append(unparsed_pv_counts(df_processed))
+                total_rows += len(df_processed)
+                logging.info(f"Processed chunk {chunk_num} ({total_rows:,} CDEs so far).")
+        spill.close()
+    finally:
+        if os.path.exists(spill_path):
+            os.remove(spill_path)
+
+    if summary_counters['flagged_bad_permissibles']:
+        logging.warning(f"Found {summary_counters['flagged_bad_permissibles']} CDEs with unparsable 'permissible_values' metadata. Saved to dump file.")
+    if unparsed_counts:
+        write_unparsed_report(pd.concat(unparsed_counts, ignore_index=True), report_path)
+    logging.info(f"Saved processed catalog with {total_rows} CDEs to: {output_path}")
+    return summary_counters
 
 def main():
     """Main function to run the complete, full-scope Stage 1 process."""
     # Setup Paths
     output_path = os.path.join(OUTPUT_DIR, FINAL_CATALOG_FILENAME)
     provenance_path = os.path.join(OUTPUT_DIR, PROVENANCE_LOG_FILENAME)
+    provenance_csv_path = os.path.join(OUTPUT_DIR, PROVENANCE_CSV_FILENAME)
     unparsable_path = os.path.join(OUTPUT_DIR, UNPARSABLE_LOG_FILENAME)
+    report_path = os.path.join(OUTPUT_DIR, UNPARSED_PV_REPORT_FILENAME)
+    quarantine_path = os.path.join(OUTPUT_DIR, QUARANTINE_FILENAME)
+    parquet_path = os.path.join(OUTPUT_DIR, PARQUET_CATALOG_FILENAME)
+    hashes_path = os.path.join(OUTPUT_DIR, ROW_HASHES_FILENAME)
+    delta_path = os.path.join(OUTPUT_DIR, DELTA_FILENAME)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    # --- START: New Data Integration Logic ---
+    # Load the mapping file
     try:
-        # 1. Load data from the SQLite database
-        logging.info(f"Connecting to database: {DATABASE_PATH}")
-        conn = sqlite3.connect(DATABASE_PATH)
-        query = f"SELECT * FROM {TABLE_NAME}"
-        df_sqlite = pd.read_sql_query(query, conn)
-        conn.close()
-        logging.info(f"Successfully loaded {len(df_sqlite)} rows from the SQLite database.")
-        
-        # Clean SQLite data: ensure ID is a string and not null
-        df_sqlite.dropna(subset=['ID'], inplace=True)
-        df_sqlite['ID'] = df_sqlite['ID'].astype(str)
-
-        # 2. Load data from the original CSV file
-        logging.info(f"Loading original CDE catalog from: {ORIGINAL_CSV_PATH}")
-        df_csv = pd.read_csv(ORIGINAL_CSV_PATH, sep=',', engine='python', on_bad_lines='warn', dtype={'ID': str})
-        
-        # Clean CSV data: drop rows without an ID
-        df_csv.dropna(subset=['ID'], inplace=True)
-        logging.info(f"Successfully loaded {len(df_csv)} rows with valid IDs from the CSV file.")
-
-        # 3. Merge the two data sources
-        logging.info("Merging data from SQLite and CSV sources...")
-        # Use an outer merge to keep all records from both sources
-        # Use suffixes to distinguish columns that exist in both
-        df_merged = pd.merge(df_csv, df_sqlite, on='ID', how='outer', suffixes=('_csv', '_sqlite'))
-
-        # 4. Coalesce columns, prioritizing the CSV file for competing values
-        common_cols = [col.replace('_csv', '') for col in df_merged.columns if '_csv' in col]
-        
-        for col in common_cols:
-            csv_col = f"{col}_csv"
-            sqlite_col = f"{col}_sqlite"
-            # The CSV value takes priority. If it's missing, the SQLite value is used.
-            df_merged[col] = df_merged[csv_col].combine_first(df_merged[sqlite_col])
-        
-        # Drop the temporary, suffixed columns
-        cols_to_drop = [col for col in df_merged.columns if '_csv' in col or '_sqlite' in col]
-        df_merged.drop(columns=cols_to_drop, inplace=True)
-        
-        df_cde = df_merged # This is now our master DataFrame for processing
-        logging.info(f"Merge complete. Resulting catalog has {len(df_cde)} CDEs.")
-        
-        # Load the mapping file
-        logging.info(f"Loading mapping file from: {MAPPING_FILE_PATH}")
-        df_map = pd.read_csv(MAPPING_FILE_PATH, keep_default_na=False)
-        mapping_dict = {
-            row['original_expression'].strip(): {
-                'PV': row['standardized_pv'], 'UM': row['standardized_unit'],
-                'VF': row['standardized_value_format'], 'VM': row['standardized_value_mapping']
-            } for _, row in df_map.iterrows()
-        }
+        with profiling.phase("load_mapping"):
+            logging.info(f"Loading mapping file from: {MAPPING_FILE_PATH}")
+            mapping_dict = PVMappingIndex(load_mapping_dict(MAPPING_FILE_PATH), canonical=CANONICAL_PV_MATCHING)
     except Exception as e:
-        logging.error(f"A critical error occurred during data loading and merging: {e}")
+        logging.error(f"A critical error occurred while loading the mapping file: {e}")
         sys.exit(1)
-    # --- END: New Data Integration Logic ---
 
-    # --- Run Full Processing Workflow on the unified data ---
-    df_processed, change_log, summary_counters = run_stage_1_processing(df_cde, mapping_dict)
-    
-    # ... (The rest of the main function for saving outputs and printing the summary remains the same) ...
-    unparsable_df = df_processed[df_processed['flag_bad_permissibles']].copy()
-    if not unparsable_df.empty:
-        logging.warning(f"Found {len(unparsable_df)} CDEs with unparsable 'permissible_values' metadata. Saving to dump file.")
-        unparsable_df[[COLUMN_MAP['ID'], COLUMN_MAP['PV']]].to_csv(unparsable_path, index=False)
-    
-    # Final cleaning step before saving
-    final_cols_to_drop = [col for col in df_processed.columns if isinstance(col, str) and 'Unnamed:' in col]
-    if final_cols_to_drop:
-        df_processed.drop(columns=final_cols_to_drop, inplace=True, errors='ignore')
-        logging.info(f"Removed final unwanted columns: {final_cols_to_drop}")
+    provenance = ProvenanceWriter(provenance_path, provenance_csv_path, write_csv=WRITE_PROVENANCE_CSV,
+                                  keep_previous=INCREMENTAL_MODE and not STREAMING_MODE)
+    incremental_state = None
+    if STREAMING_MODE or not INCREMENTAL_MODE:
+        # A full run rewrites every CDE, so the next incremental run must not trust older row hashes
+        for path in (hashes_path, delta_path):
+            if os.path.exists(path):
+                os.remove(path)
+    if STREAMING_MODE:
+        catalog_writer = CatalogParquetWriter(parquet_path)
+        try:
+            summary_counters = run_streaming(mapping_dict, provenance, catalog_writer, output_path, unparsable_path, report_path,
+                                             quarantine_path)
+        except Exception as e:
+            logging.error(f"A critical error occurred during streaming: {e}")
+            sys.exit(1)
+    else:
+        # --- START: New Data Integration Logic ---
+        try:
+            # 1. Load data from the SQLite database (rows without an ID are dropped in SQL, IDs arrive as text)
+            with profiling.phase("load_sqlite"):
+                logging.info(f"Connecting to database: {DATABASE_PATH}")
+                df_sqlite = read_sqlite_table(DATABASE_PATH, TABLE_NAME)
+                logging.info(f"Successfully loaded {len(df_sqlite)} rows with valid IDs from the SQLite database.")
 
-    logging.info(f"Saving processed catalog to: {output_path}")
-    df_processed.to_csv(output_path, index=False)
-    
-    if change_log:
-        logging.info(f"Saving provenance log with {len(change_log)} entries to: {provenance_path}")
-        pd.DataFrame(change_log).to_csv(provenance_path, index=False)
+            # 2. Load data from the original CSV file
+            with profiling.phase("load_csv"):
+                logging.info(f"Loading original CDE catalog from: {ORIGINAL_CSV_PATH}")
+                # Records that would not parse are quarantined (with line numbers) instead of dropped
+                df_csv = csv_ingest.read_csv_checked(ORIGINAL_CSV_PATH, quarantine_path, sep=',', dtype={'ID': str})
+
+                # Clean CSV data: drop rows without an ID
+                df_csv.dropna(subset=['ID'], inplace=True)
+                logging.info(f"Successfully loaded {len(df_csv)} rows with valid IDs from the CSV file.")
+
+            # 3. Join the two data sources on ID (an outer join keeps all records from both)
+            with profiling.phase("join_sources"):
+                logging.info("Merging data from SQLite and CSV sources...")
+                df_cde = join_sources(df_csv, df_sqlite) # This is now our master DataFrame for processing
+                del df_csv, df_sqlite
+                logging.info(f"Merge complete. Resulting catalog has {len(df_cde)} CDEs.")
+        except Exception as e:
+            logging.error(f"A critical error occurred during data loading and merging: {e}")
+            sys.exit(1)
+        # --- END: New Data Integration Logic ---
+
+        # --- Run Full Processing Workflow on the unified data ---
+        with profiling.phase("stage_1_processing"):
+            if INCREMENTAL_MODE:
+                df_processed, summary_counters, incremental_state = run_incremental(
+                    df_cde, mapping_dict, provenance, output_path, parquet_path, hashes_path)
+            else:
+                df_processed, summary_counters = run_stage_1_processing(df_cde, mapping_dict, provenance)
+
+        with profiling.phase("write_outputs"):
+            logging.info(f"Saving processed catalog to: {output_path}")
+            catalog_writer = CatalogParquetWriter(parquet_path)
+            write_outputs(df_processed, output_path, unparsable_path, catalog_writer)
+            write_unparsed_report(unparsed_pv_counts(df_processed), report_path)
+
+    catalog_writer.close()
+    if incremental_state is not None:
+        save_incremental_state(incremental_state, hashes_path, delta_path)
+    for rule_id, count in provenance.close().items():
+        summary_counters[f'provenance_{rule_id}'] = count
 
     logging.info("--- Stage 1 Summary Report ---")
     if not summary_counters:
@@ -232,4 +707,9 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Pass --profile (or --profile=sampling) to write a run report to outputs/profiles
+    profiling.start_run("stage_1")
+    try:
+        main()
+    finally:
+        profiling.finish_run()
\ No newline at end of file
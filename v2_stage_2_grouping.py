@@ -94,8 +94,10 @@ def load_and_select_candidates(db_path: str, table_name: str) -> pd.DataFrame:
         if 'ID' not in df.columns:
             raise ValueError("The database table must have an 'ID' column.")
         
-        df['ID'] = pd.to_numeric(df['ID'], errors='coerce').astype('Int64').astype(str)
-        df.dropna(subset=['ID'], inplace=True)
+        # Non-numeric IDs are dropped (as <NA> they used to survive astype(str) as the string '<NA>')
+        ids = pd.to_numeric(df['ID'], errors='coerce').astype('Int64')
+        df = df[ids.notna()].copy()
+        df['ID'] = ids[ids.notna()].astype(str)
 
         logging.info(f"Data loading and initial preparation complete. {len(df)} valid rows selected.")
         return df
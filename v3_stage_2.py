@@ -12,8 +12,11 @@ import community.community_louvain as community_louvain
 import torch
 from tqdm import tqdm
 import pickle
-import sqlite3
 import random
+
+import profiling
+from catalog_sources import read_sqlite_table
+from catalog_io import apply_schema
 # --- NEW: Import plotting libraries ---
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -54,31 +57,30 @@ SEMANTIC_FIELDS = [
     'alternate_titles',
 ]
 
+# Only these columns are read from the database (graph edges also use variable_name and value_format)
+SOURCE_COLUMNS = SEMANTIC_FIELDS + ['variable_name', 'permissible_values', 'value_format']
+
 # -- Graph Tuning Parameters --
 LEXICAL_BOOST_FACTOR = 0.2
 STRUCTURAL_BOOST_FACTOR = 0.15
 
 # --- 2. HELPER FUNCTIONS (No changes from previous version) ---
 def load_and_select_candidates(db_path: str, table_name: str) -> pd.DataFrame:
-    """Connects to the source SQLite database, reads the CDE table, and returns a DataFrame."""
+    """Reads the needed CDE columns from the source SQLite database; rows without an integer ID are dropped in SQL."""
     logging.info(f"Connecting to source SQLite database at: {db_path}")
     if not os.path.exists(db_path):
         raise FileNotFoundError(f"Database file not found: {db_path}")
-    try:
-        conn = sqlite3.connect(db_path)
-        query = f"SELECT * FROM {table_name}"
-        df = pd.read_sql_query(query, conn)
-        logging.info(f"Successfully loaded {len(df):,} rows from the database.")
-        if 'ID' not in df.columns: raise ValueError("The database table must have an 'ID' column.")
-        df['ID'] = pd.to_numeric(df['ID'], errors='coerce').astype('Int64').astype(str)
-        df.dropna(subset=['ID'], inplace=True)
-        for col in SEMANTIC_FIELDS + ['variable_name', 'permissible_values']:
-            if col in df.columns:
-                df[col] = df[col].astype(str).fillna('')
-        logging.info(f"Data loading and preparation complete. {len(df)} valid rows selected.")
-        return df
-    finally:
-        if conn: conn.close()
+    df = read_sqlite_table(db_path, table_name, columns=SOURCE_COLUMNS, id_filter="numeric")
+    logging.info(f"Successfully loaded {len(df):,} rows ({len(df.columns)} columns) from the database.")
+    df = apply_schema(df)
+    # Cheap once the columns are Arrow strings or categories (bench_catalog_load.py reports the before/after)
+    logging.info(f"Catalog dtypes applied: {df.memory_usage(deep=True).sum() / 2**20:.1f} MiB in memory.")
+    # Missing text becomes '' (astype(str) first used to turn NaN into the word 'nan')
+    for col in SEMANTIC_FIELDS + ['variable_name', 'permissible_values']:
+        if col in df.columns:
+            df[col] = df[col].fillna('')
+    logging.info(f"Data loading and preparation complete. {len(df)} valid rows selected.")
+    return df
 
 def generate_embeddings(df: pd.DataFrame, fields: list, model_name: str) -> np.ndarray:
     """Generates embeddings for CDEs using a SentenceTransformer model."""
@@ -332,39 +334,50 @@ def main():
     graph_checkpoint_path = os.path.join(OUTPUT_DIR, GRAPH_CHECKPOINT_FILENAME)
     embeddings_checkpoint_path = os.path.join(OUTPUT_DIR, EMBEDDINGS_CHECKPOINT_FILENAME)
 
-    candidate_df = load_and_select_candidates(DATABASE_PATH, TABLE_NAME)
+    with profiling.phase("load_and_select_candidates"):
+        candidate_df = load_and_select_candidates(DATABASE_PATH, TABLE_NAME)
     if candidate_df.empty:
         logging.info("No candidate CDEs loaded. Exiting.")
         return
 
     if os.path.exists(graph_checkpoint_path):
         logging.info(f"Loading graph from checkpoint: {graph_checkpoint_path}")
-        with open(graph_checkpoint_path, 'rb') as f: similarity_graph = pickle.load(f)
+        with profiling.phase("load_graph_checkpoint"):
+            with open(graph_checkpoint_path, 'rb') as f: similarity_graph = pickle.load(f)
     else:
         # Generate or load embeddings
-        if os.path.exists(embeddings_checkpoint_path) and len(np.load(embeddings_checkpoint_path)) == len(candidate_df):
-            logging.info(f"Loading embeddings from checkpoint: {embeddings_checkpoint_path}")
-            embeddings = np.load(embeddings_checkpoint_path)
-        else:
-            logging.info("No valid checkpoints found or size mismatch. Running full embedding process.")
-            embeddings = generate_embeddings(candidate_df, SEMANTIC_FIELDS, EMBEDDING_MODEL)
-            np.save(embeddings_checkpoint_path, embeddings)
-
-        similarity_graph = build_similarity_graph(candidate_df, embeddings)
+        with profiling.phase("embeddings"):
+            if os.path.exists(embeddings_checkpoint_path) and len(np.load(embeddings_checkpoint_path)) == len(candidate_df):
+                logging.info(f"Loading embeddings from checkpoint: {embeddings_checkpoint_path}")
+                embeddings = np.load(embeddings_checkpoint_path)
+            else:
+                logging.info("No valid checkpoints found or size mismatch. Running full embedding process.")
+                embeddings = generate_embeddings(candidate_df, SEMANTIC_FIELDS, EMBEDDING_MODEL)
+                np.save(embeddings_checkpoint_path, embeddings)
+
+        with profiling.phase("build_similarity_graph"):
+            similarity_graph = build_similarity_graph(candidate_df, embeddings)
         logging.info(f"Saving graph checkpoint to: {graph_checkpoint_path}")
         with open(graph_checkpoint_path, 'wb') as f: pickle.dump(similarity_graph, f)
 
-    community_definitions = detect_and_format_communities_hub_spoke(similarity_graph)
+    with profiling.phase("detect_communities"):
+        community_definitions = detect_and_format_communities_hub_spoke(similarity_graph)
     
     if community_definitions:
-        save_output(community_definitions, OUTPUT_DIR, COMMUNITY_DEFINITIONS_FILENAME)
-        generate_basic_stats_and_samples(community_definitions, candidate_df, OUTPUT_DIR)
-        # --- NEW: Call the advanced stats generation function ---
-        generate_advanced_community_stats(community_definitions, candidate_df, OUTPUT_DIR)
+        with profiling.phase("write_outputs_and_stats"):
+            save_output(community_definitions, OUTPUT_DIR, COMMUNITY_DEFINITIONS_FILENAME)
+            generate_basic_stats_and_samples(community_definitions, candidate_df, OUTPUT_DIR)
+            # --- NEW: Call the advanced stats generation function ---
+            generate_advanced_community_stats(community_definitions, candidate_df, OUTPUT_DIR)
     else:
         logging.warning("No communities were detected or formatted. Output files will be empty.")
 
     logging.info("--- Stage 2 complete. ---")
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Pass --profile (or --profile=sampling) to write a run report to outputs/profiles
+    profiling.start_run("stage_2")
+    try:
+        main()
+    finally:
+        profiling.finish_run()
\ No newline at end of file
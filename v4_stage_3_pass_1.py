@@ -5,7 +5,6 @@
 import os
 import json
 import logging
-import pandas as pd
 import concurrent.futures
 from dotenv import load_dotenv
 from tqdm import tqdm
@@ -13,6 +12,14 @@ from pydantic import ValidationError
 
 # --- Import from the shared utility module ---
 import shared_utils as utils
+import payload_encoder as encoder
+import hedged_requests as hedging
+import work_queue
+import response_reader as reader
+import run_metrics as metrics
+import profiling
+from catalog_io import load_processed_catalog
+from community_context import CommunityContextBuilder
 
 # --- 1. PASS 1: SYSTEM PROMPT ---
 # This prompt is taken directly from the original v3_stage_3.py script.
@@ -75,41 +82,32 @@ def process_group_pass_1(
     group_id = group_to_process.get("group_id", "unknown_group")
     
     try:
-        # Construct the prompt payload for the API
-        cde_group_data = []
-        for cde_id in group_to_process.get("member_cde_ids", []):
-            cde_details = cde_lookup.get(str(cde_id))
-            if cde_details:
-                cde_group_data.append({
-                    "ID": cde_details.get('ID'),
-                    "title": cde_details.get('title'),
-                    "short_description": cde_details.get('short_description'),
-                    "variable_name": cde_details.get('variable_name'),
-                    "permissible_values": cde_details.get('permissible_values'),
-                    "value_mapping": cde_details.get('value_mapping'),
-                    "quality_flags": {"is_bad_variable_name": cde_details.get('flag_bad_variable_name', False)},
-                })
-        
-        if not cde_group_data:
-            return {"group_id": group_id, "status": "skipped_no_valid_cdes", "data": None, "usage": None}
+        # Construct the compact prompt payload for the API (empty fields are dropped)
+        with metrics.span("build", group_id):
+            cde_group_data = []
+            for cde_id in group_to_process.get("member_cde_ids", []):
+                cde_details = cde_lookup.get(str(cde_id))
+                if cde_details:
+                    cde_group_data.append(encoder.build_pass_1_record(str(cde_id), cde_details, encoder.USE_SHORT_KEYS))
+            
+            if not cde_group_data:
+                return {"group_id": group_id, "status": "skipped_no_valid_cdes", "data": None, "usage": None}
 
-        prompt_payload = {
-            "group_id_for_request": group_id,
-            "cde_group_for_review": cde_group_data,
             # Community context is not sent in the main prompt, it's in the cache
-        }
-        prompt_text = json.dumps(prompt_payload)
-        
+            prompt_text = encoder.encode_prompt_payload(group_id, cde_group_data)
+
         # Call the API - This function saves the raw response before returning
-        response_json = utils.generate_content_via_rest(prompt_text, cache_name, api_key, utils.RAW_DIR_PASS_1)
-        output_text = response_json.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+        with metrics.span("request", group_id):
+            response_json = hedging.generate_content_hedged(prompt_text, cache_name, api_key, utils.RAW_DIR_PASS_1, group_id)
+        output_text = reader.extract_response_text(response_json)
         
         if not output_text:
             raise ValueError("No text payload in API response.")
             
         # --- RESILIENT Pydantic Validation ---
         try:
-            validated_response = utils.AIResponsePass1.model_validate_json(output_text)
+            with metrics.span("validate", group_id):
+                validated_response = utils.AIResponsePass1.model_validate_json(output_text)
             return {
                 "group_id": group_id,
                 "status": "success",
@@ -129,81 +127,145 @@ def process_group_pass_1(
 
 # --- 3. MAIN ORCHESTRATION ---
 
+def run_community(
+    community_id: str,
+    groups_to_process: list,
+    community_context_text: str,
+    cde_lookup: dict,
+    api_key: str,
+    max_workers: int,
+    results: dict
+):
+    """
+    Creates the community cache, processes the groups in parallel and deletes the cache.
+    Each finished group's status is written into `results` as it completes.
+    """
+    cache_name = None
+    executor = None
+    try:
+        # Create a short-lived cache for this community's context
+        cache_name = utils.create_cache_via_rest(api_key, encoder.system_prompt_with_legend(SYSTEM_PROMPT_PASS_1), community_context_text, utils.CACHE_DISPLAY_NAME_PASS_1)
+        if not cache_name:
+            logging.error(f"Failed to create cache for {community_id}. Skipping community.")
+            for group in groups_to_process:
+                results[group["group_id"]] = "cache_create_failed"
+                metrics.METRICS.group_finished("cache_create_failed")
+            return
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        future_to_group = {
+            executor.submit(process_group_pass_1, group, community_context_text, cde_lookup, cache_name, api_key): group
+            for group in groups_to_process
+        }
+
+        # Stops dispatching and waits for in-flight calls up to a deadline on Ctrl-C
+        for future in tqdm(utils.iter_completed(future_to_group), total=len(future_to_group), desc=f"Groups in {community_id}"):
+            group_id = future_to_group[future].get("group_id", "unknown")
+            try:
+                result = future.result()
+                status = result.get("status", "unknown_error")
+                results[group_id] = status
+                metrics.METRICS.group_finished(status)
+                
+                # Log token usage if the API call was made
+                with metrics.span("persist", group_id):
+                    if result.get("usage"):
+                        utils.log_token_usage(group_id, result["usage"], "pass_1")
+                    hedging.log_loser_usage("pass_1")
+                    
+            except Exception as exc:
+                results[group_id] = "future_failed"
+                metrics.METRICS.group_finished("future_failed")
+                utils.log_error(group_id, exc, {"note": "Error retrieving result from future."})
+
+    finally:
+        if executor:
+            # Don't block on abandoned calls during a graceful shutdown
+            executor.shutdown(wait=not utils.shutdown_requested(), cancel_futures=True)
+        if cache_name:
+            utils.delete_cache(cache_name, api_key)
+
+
 def main(api_key: str):
     """Main function to run the complete Pass 1 adjudication process."""
     utils.setup_logging()
+    utils.install_shutdown_handlers()
     logging.info("--- CDE Harmonization: STARTING Stage 3, Pass 1 (Triage & Enrichment) ---")
     
     # --- Load Inputs ---
     # File paths are relative to the root project directory
     community_definitions_path = os.path.join('outputs', 'stage_2', 'community_definitions.json')
-    processed_catalog_path = os.path.join('outputs', 'stage_1', 'cde_catalog_processed.csv')
     manifest_path = os.path.join(utils.OUTPUT_DIR, "manifest_pass_1.json")
 
-    try:
-        with open(community_definitions_path, 'r') as f:
-            community_definitions = [utils.ParentCommunity.model_validate(item) for item in json.load(f)]
-        
-        cde_df = pd.read_csv(processed_catalog_path, dtype={'ID': str}, low_memory=False)
-        cde_lookup = cde_df.set_index('ID').to_dict('index')
-    except Exception as e:
-        logging.fatal(f"Could not load critical input files: {e}")
-        return
+    with profiling.phase("load_inputs"):
+        try:
+            with open(community_definitions_path, 'r') as f:
+                community_definitions = [utils.ParentCommunity.model_validate(item) for item in json.load(f)]
+    
+            cde_df = load_processed_catalog(columns=encoder.PASS_1_CATALOG_COLUMNS)
+            cde_lookup = cde_df.set_index('ID').to_dict('index')
+        except Exception as e:
+            logging.fatal(f"Could not load critical input files: {e}")
+            return
 
     manifest = utils.load_manifest(manifest_path)
-    total_cost = 0.0
-
-    # --- Process Each Community ---
-    for community in tqdm(community_definitions, desc="Processing Communities"):
-        community_id = community.community_id
-        cache_name = None
-        
-        # Define community context for the cache
-        community_member_titles = [cde_lookup.get(str(id), {}).get('title', '') for id in community.member_cde_ids]
-        community_context_text = "\n- ".join(filter(None, community_member_titles))
-
-        groups_to_process = [g.model_dump() for g in community.sub_groups if manifest.get(g.group_id) != "success"]
-        
-        if not groups_to_process:
-            logging.info(f"All groups in {community_id} already processed. Skipping.")
-            continue
+    context_builder = CommunityContextBuilder(cde_lookup, community_definitions)
+
+    # Queue depth counts groups still to do
+    metrics.start("pass_1", utils.LOG_DIR)
+    pending_ids = [g.group_id for c in community_definitions for g in c.sub_groups if manifest.get(g.group_id) != "success"]
+    metrics.METRICS.set_queue_depth(len(pending_ids))
+
+    with profiling.phase("process_groups"):
+        if work_queue.WORK_QUEUE_DB_PATH:
+            # --- Shared-queue mode: several workers split the run via leases ---
+            queue = work_queue.WorkQueue(work_queue.WORK_QUEUE_DB_PATH, "pass_1")
+            queue.enqueue([(g.group_id, c.community_id) for c in community_definitions for g in c.sub_groups], manifest)
+            groups_by_id = {g.group_id: g.model_dump() for c in community_definitions for g in c.sub_groups}
+
+            def process_claim(claimed, max_workers):
+                community_id = claimed[0][1]
+                results = {}
+                run_community(community_id, [groups_by_id[group_id] for group_id, _ in claimed],
+                              context_builder.get(community_id), cde_lookup, api_key, max_workers, results)
+                return results
+
+            work_queue.run_queue_worker(queue, process_claim, manifest_path)
+        else:
+            # Groups that failed in an earlier run are retried now (the queue counts its own retries)
+            metrics.METRICS.record_retry(sum(1 for group_id in pending_ids if group_id in manifest))
+
+            # --- Process Each Community ---
+            for community in tqdm(community_definitions, desc="Processing Communities"):
+                if utils.shutdown_requested():
+                    break
+                community_id = community.community_id
             
-        logging.info(f"Processing {len(groups_to_process)} groups for community {community_id}.")
-
-        try:
-            # Create a short-lived cache for this community's context
-            cache_name = utils.create_cache_via_rest(api_key, SYSTEM_PROMPT_PASS_1, community_context_text, utils.CACHE_DISPLAY_NAME_PASS_1)
-            if not cache_name:
-                logging.error(f"Failed to create cache for {community_id}. Skipping community.")
-                continue
-
-            with concurrent.futures.ThreadPoolExecutor(max_workers=utils.MAX_WORKERS) as executor:
-                future_to_group = {
-                    executor.submit(process_group_pass_1, group, community_context_text, cde_lookup, cache_name, api_key): group
-                    for group in groups_to_process
-                }
-
-                for future in tqdm(concurrent.futures.as_completed(future_to_group), total=len(future_to_group), desc=f"Groups in {community_id}"):
-                    group_id = future_to_group[future].get("group_id", "unknown")
-                    try:
-                        result = future.result()
-                        status = result.get("status", "unknown_error")
-                        manifest[group_id] = status
-                        
-                        # Log token usage if the API call was made
-                        if result.get("usage"):
-                            utils.log_token_usage(group_id, result["usage"], "pass_1")
-                            
-                    except Exception as exc:
-                        manifest[group_id] = "future_failed"
-                        utils.log_error(group_id, exc, {"note": "Error retrieving result from future."})
-
-        finally:
-            if cache_name:
-                utils.delete_cache(cache_name, api_key)
-            # Save manifest periodically
-            utils.save_manifest(manifest_path, manifest)
-
+                groups_to_process = [g.model_dump() for g in community.sub_groups if manifest.get(g.group_id) != "success"]
+            
+                if not groups_to_process:
+                    logging.info(f"All groups in {community_id} already processed. Skipping.")
+                    continue
+
+                # Deduplicated, hub-ranked and token-capped context for the cache (built only when needed)
+                community_context_text = context_builder.get(community_id)
+                
+                logging.info(f"Processing {len(groups_to_process)} groups for community {community_id}.")
+
+                try:
+                    run_community(community_id, groups_to_process, community_context_text, cde_lookup, api_key, utils.MAX_WORKERS, manifest)
+                finally:
+                    # Save manifest periodically
+                    utils.save_manifest(manifest_path, manifest)
+
+    if utils.shutdown_requested():
+        hedging.log_loser_usage("pass_1")
+        metrics.stop()
+        profiling.finish_run()
+        utils.finish_shutdown(api_key)
+
+    hedging.finish_run("pass_1")
+    metrics.stop()
     logging.info(f"--- Stage 3, Pass 1 COMPLETE ---")
 
 
@@ -214,4 +276,9 @@ if __name__ == "__main__":
     if not google_api_key:
         logging.fatal("FATAL: GOOGLE_API_KEY environment variable not found.")
     else:
-        main(api_key=google_api_key)
\ No newline at end of file
+        # Pass --profile=sampling to include the worker threads in the run report
+        profiling.start_run("stage_3_pass_1")
+        try:
+            main(api_key=google_api_key)
+        finally:
+            profiling.finish_run()
\ No newline at end of file
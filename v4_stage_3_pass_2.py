@@ -5,8 +5,8 @@
 
 import os
 import json
+import hashlib
 import logging
-import pandas as pd
 import concurrent.futures
 from dotenv import load_dotenv
 from tqdm import tqdm
@@ -15,6 +15,14 @@ from typing import List, Dict, Any, Optional
 
 # --- Import from the shared utility module ---
 import shared_utils as utils
+import payload_encoder as encoder
+import hedged_requests as hedging
+import work_queue
+import response_reader as reader
+import run_metrics as metrics
+import profiling
+from catalog_io import load_processed_catalog
+from community_context import CommunityContextBuilder
 
 # --- 1. PYDANTIC MODELS for PASS 2 VALIDATION ---
 # These models are defined here to validate the specific nested output required by Pass 2.
@@ -128,30 +136,38 @@ def aggregate_and_filter_pass_1_results(pass_1_dir: str) -> List[str]:
         logging.error(f"Pass 1 output directory not found: {pass_1_dir}")
         return []
 
-    pass_1_files = [f for f in os.listdir(pass_1_dir) if f.endswith(".json")]
+    pass_1_files = reader.list_response_files(pass_1_dir, (".json",))
     for filename in tqdm(pass_1_files, desc="Aggregating Pass 1 Results"):
-        filepath = os.path.join(pass_1_dir, filename)
-        with open(filepath, 'r', encoding='utf-8') as f:
-            try:
-                response_data = json.load(f)
-                content_text = response_data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-                if not content_text:
-                    continue
-                
-                suggestions_list = json.loads(content_text)
-                
-                for suggestion in suggestions_list:
-                    if suggestion.get("suggestions", {}).get("requires_advanced_value_review") is True:
-                        cdes_for_pass_2.append(suggestion["ID"])
-            except (json.JSONDecodeError, KeyError, IndexError, TypeError) as e:
-                logging.warning(f"Could not parse or find data in Pass 1 response file: {filename}. Error: {e}")
+        parsed = reader.read_response(os.path.join(pass_1_dir, filename))
+        if parsed.status == 'malformed':
+            logging.warning(f"Could not parse or find data in Pass 1 response file: {filename}. Error: {parsed.error}")
+            continue
+
+        for suggestion in parsed.items:
+            suggestions = suggestion.get("suggestions")
+            if isinstance(suggestions, dict) and suggestions.get("requires_advanced_value_review") is True and suggestion.get("ID"):
+                cdes_for_pass_2.append(str(suggestion["ID"]))
 
     logging.info(f"Found {len(cdes_for_pass_2)} CDEs flagged for advanced value review in Pass 2.")
-    return list(set(cdes_for_pass_2)) # Return unique IDs
+    # Unique IDs in a stable order, so batch IDs are identical across runs and workers
+    return sorted(set(cdes_for_pass_2))
 
 
-def create_pass_2_batches(cdes_to_process: List[str], community_definitions: List[Dict], cde_lookup: Dict) -> List[Dict]:
-    """Groups the filtered CDEs into new batches for Pass 2 processing."""
+def pass_2_batch_id(community_id: str, cde_ids: List[str]) -> str:
+    """
+    A batch ID derived from the batch's content, so the same CDEs get the same ID on every
+    worker and run, and a different batch can never match an existing queue or manifest entry.
+    """
+    digest = hashlib.sha1(json.dumps([community_id, sorted(cde_ids)]).encode('utf-8')).hexdigest()
+    return f"p2_{digest[:16]}"
+
+
+def create_pass_2_batches(cdes_to_process: List[str], community_definitions: List[Dict], cde_lookup: Dict,
+                          skip_ids: frozenset = frozenset()) -> List[Dict]:
+    """
+    Groups the flagged CDEs into new batches for Pass 2 processing. CDEs in `skip_ids` are
+    dropped from their batch after batching, so the other batches keep their content and IDs.
+    """
     logging.info("Creating new batches for Pass 2 processing...")
     community_map = {str(cde_id): comm['community_id'] for comm in community_definitions for cde_id in comm['member_cde_ids']}
     
@@ -162,51 +178,56 @@ def create_pass_2_batches(cdes_to_process: List[str], community_definitions: Lis
             community_groups.setdefault(comm_id, []).append(cde_id)
             
     pass_2_batches = []
-    group_counter = 0
     BATCH_SIZE_PASS_2 = 25
 
     for comm_id, cde_ids in community_groups.items():
         for i in range(0, len(cde_ids), BATCH_SIZE_PASS_2):
-            batch_cde_ids = cde_ids[i:i + BATCH_SIZE_PASS_2]
-            batch_data = [cde_lookup[cde_id] for cde_id in batch_cde_ids if cde_id in cde_lookup]
+            batch_cde_ids = [cde_id for cde_id in cde_ids[i:i + BATCH_SIZE_PASS_2] if cde_id not in skip_ids]
+            if not batch_cde_ids:
+                continue
+            # Project each row onto the Pass 2 columns only (empty fields are dropped)
+            batch_data = [
+                encoder.build_pass_2_record(cde_id, cde_lookup[cde_id], encoder.USE_SHORT_KEYS)
+                for cde_id in batch_cde_ids if cde_id in cde_lookup
+            ]
             
             pass_2_batches.append({
-                "group_id": f"p2_grp_{group_counter}",
+                "group_id": pass_2_batch_id(comm_id, batch_cde_ids),
                 "community_id": comm_id,
+                "cde_ids": batch_cde_ids,
                 "cde_data": batch_data
             })
-            group_counter += 1
             
     logging.info(f"Created {len(pass_2_batches)} new batches for Pass 2.")
     return pass_2_batches
 
 
-def process_group_pass_2(batch: dict, community_context_map: dict, api_key: str) -> dict:
+def process_group_pass_2(batch: dict, context_builder: CommunityContextBuilder, api_key: str) -> dict:
     """Processes a single batch for Pass 2."""
     group_id = batch["group_id"]
     community_id = batch["community_id"]
-    community_context = community_context_map.get(community_id, "")
     cache_name = None
     
     try:
-        cache_name = utils.create_cache_via_rest(api_key, SYSTEM_PROMPT_PASS_2, community_context, utils.CACHE_DISPLAY_NAME_PASS_2)
+        # Context is ranked towards the sub-groups this batch's CDEs came from
+        community_context = context_builder.get_for_cdes(community_id, batch["cde_ids"])
+        cache_name = utils.create_cache_via_rest(api_key, encoder.system_prompt_with_legend(SYSTEM_PROMPT_PASS_2), community_context, utils.CACHE_DISPLAY_NAME_PASS_2)
         if not cache_name:
             raise Exception("Failed to create cache for Pass 2.")
 
         # For Pass 2, the prompt only needs the CDEs to be processed
-        prompt_payload = {
-            "group_id_for_request": group_id,
-            "cde_group_for_review": batch["cde_data"],
-        }
-        prompt_text = json.dumps(prompt_payload)
+        with metrics.span("build", group_id):
+            prompt_text = encoder.encode_prompt_payload(group_id, batch["cde_data"])
         
-        response_json = utils.generate_content_via_rest(prompt_text, cache_name, api_key, utils.RAW_DIR_PASS_2)
-        output_text = response_json.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+        with metrics.span("request", group_id):
+            response_json = hedging.generate_content_hedged(prompt_text, cache_name, api_key, utils.RAW_DIR_PASS_2, group_id)
+        output_text = reader.extract_response_text(response_json)
         if not output_text:
             raise ValueError("No text payload in API response.")
 
         try:
-            AIResponsePass2.model_validate_json(output_text)
+            with metrics.span("validate", group_id):
+                AIResponsePass2.model_validate_json(output_text)
             return {"group_id": group_id, "status": "success", "usage": response_json.get("usageMetadata")}
         except ValidationError as e:
             utils.log_error(group_id, e, {"stage": "pydantic_validation_pass_2", "ai_output_text": output_text})
@@ -222,69 +243,136 @@ def process_group_pass_2(batch: dict, community_context_map: dict, api_key: str)
 
 # --- 4. MAIN ORCHESTRATION ---
 
+def run_batches(batches: List[Dict], context_builder: CommunityContextBuilder, api_key: str, max_workers: int, results: dict, manifest_path: Optional[str] = None):
+    """
+    Processes Pass 2 batches in parallel, writing each batch's status into `results`.
+    When `manifest_path` is given, `results` is saved after every batch.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        future_to_batch = {
+            executor.submit(process_group_pass_2, batch, context_builder, api_key): batch
+            for batch in batches
+        }
+        
+        # Stops dispatching and waits for in-flight calls up to a deadline on Ctrl-C
+        for future in tqdm(utils.iter_completed(future_to_batch), total=len(future_to_batch), desc="Processing Pass 2 Batches"):
+            batch_id = future_to_batch[future]["group_id"]
+            try:
+                result = future.result()
+                status = result.get("status", "unknown_error")
+                results[batch_id] = status
+                metrics.METRICS.group_finished(status)
+
+                with metrics.span("persist", batch_id):
+                    if result.get("usage"):
+                        utils.log_token_usage(batch_id, result["usage"], "pass_2")
+                    hedging.log_loser_usage("pass_2")
+            
+            except Exception as exc:
+                results[batch_id] = "future_failed"
+                metrics.METRICS.group_finished("future_failed")
+                utils.log_error(batch_id, exc, {"note": "Error retrieving result from future."})
+            
+            finally:
+                if manifest_path:
+                    with metrics.span("persist", batch_id):
+                        utils.save_manifest(manifest_path, results)
+    finally:
+        # Don't block on abandoned calls during a graceful shutdown
+        executor.shutdown(wait=not utils.shutdown_requested(), cancel_futures=True)
+        if manifest_path:
+            utils.save_manifest(manifest_path, results)
+
+
 def main(api_key: str):
     """Main function to run the complete Pass 2 adjudication process."""
     utils.setup_logging()
+    utils.install_shutdown_handlers()
     logging.info("--- CDE Harmonization: STARTING Stage 3, Pass 2 (Specialized Value Mapping) ---")
 
     # --- Load Supporting Files ---
     community_definitions_path = os.path.join('outputs', 'stage_2', 'community_definitions.json')
-    processed_catalog_path = os.path.join('outputs', 'stage_1', 'cde_catalog_processed.csv')
     manifest_path = os.path.join(utils.OUTPUT_DIR, "manifest_pass_2.json")
 
-    try:
-        with open(community_definitions_path, 'r', encoding='utf-8') as f:
-            community_definitions = json.load(f)
-        
-        cde_df = pd.read_csv(processed_catalog_path, dtype={'ID': str}, low_memory=False)
-        cde_lookup = cde_df.set_index('ID').to_dict('index')
+    with profiling.phase("load_inputs"):
+        try:
+            with open(community_definitions_path, 'r', encoding='utf-8') as f:
+                community_definitions = json.load(f)
+    
+            cde_df = load_processed_catalog(columns=encoder.PASS_2_CATALOG_COLUMNS)
+            cde_lookup = cde_df.set_index('ID').to_dict('index')
 
-        community_context_map = {
-            comm['community_id']: "\n- ".join(filter(None, [cde_lookup.get(str(id), {}).get('title', '') for id in comm['member_cde_ids']]))
-            for comm in community_definitions
-        }
-    except Exception as e:
-        logging.fatal(f"Could not load critical input files: {e}")
-        return
+            # Contexts are built lazily, per batch, instead of for every community up front
+            context_builder = CommunityContextBuilder(cde_lookup, community_definitions)
+        except Exception as e:
+            logging.fatal(f"Could not load critical input files: {e}")
+            return
 
     # --- Step 1: Aggregate and Batch ---
-    cdes_to_process = aggregate_and_filter_pass_1_results(utils.RAW_DIR_PASS_1)
-    if not cdes_to_process:
+    with profiling.phase("aggregate_pass_1_results"):
+        cdes_to_process = aggregate_and_filter_pass_1_results(utils.RAW_DIR_PASS_1)
+        # Stage 1 already derived a value_mapping for these deterministically (pv_parser). They are
+        # dropped inside their batches, so the batch boundaries of a resumed run do not shift.
+        parsed_ids = frozenset(cde_id for cde_id in cdes_to_process if cde_lookup.get(cde_id, {}).get('pv_was_parsed') is True)
+        if parsed_ids:
+            logging.info(f"Skipping {len(parsed_ids)} flagged CDEs whose value mapping was parsed in Stage 1.")
+    if len(parsed_ids) == len(cdes_to_process):
         logging.info("No CDEs were flagged for Pass 2 review. Stage complete.")
         return
         
-    pass_2_batches = create_pass_2_batches(cdes_to_process, community_definitions, cde_lookup)
+    with profiling.phase("create_batches"):
+        pass_2_batches = create_pass_2_batches(cdes_to_process, community_definitions, cde_lookup, parsed_ids)
     manifest = utils.load_manifest(manifest_path)
-    batches_to_process = [b for b in pass_2_batches if manifest.get(b['group_id']) != "success"]
-    
-    if not batches_to_process:
-        logging.info("All required Pass 2 batches have already been processed successfully.")
-        return
+
+    # Queue depth counts batches still to do
+    metrics.start("pass_2", utils.LOG_DIR)
+    pending_ids = [b['group_id'] for b in pass_2_batches if manifest.get(b['group_id']) != "success"]
+    metrics.METRICS.set_queue_depth(len(pending_ids))
 
     # --- Step 2: Execute Pass 2 in Parallel ---
-    with concurrent.futures.ThreadPoolExecutor(max_workers=utils.MAX_WORKERS) as executor:
-        future_to_batch = {
-            executor.submit(process_group_pass_2, batch, community_context_map, api_key): batch
-            for batch in batches_to_process
-        }
+    with profiling.phase("process_batches"):
+        if work_queue.WORK_QUEUE_DB_PATH:
+            # Shared-queue mode: several workers split the batches via leases
+            queue = work_queue.WorkQueue(work_queue.WORK_QUEUE_DB_PATH, "pass_2")
+            queue.enqueue([(b['group_id'], b['community_id']) for b in pass_2_batches], manifest)
+            batches_by_id = {b['group_id']: b for b in pass_2_batches}
+
+            def process_claim(claimed, max_workers):
+                results = {}
+                # Another worker may have enqueued batches this one did not build (its view of Pass 1
+                # or the catalog differs); reject them so MAX_ATTEMPTS parks them instead of crashing
+                for batch_id, _ in claimed:
+                    if batch_id not in batches_by_id:
+                        logging.warning(f"Claimed Pass 2 batch {batch_id} is not among this worker's batches; rejecting it.")
+                        results[batch_id] = "unknown_batch"
+                        metrics.METRICS.group_finished("unknown_batch")
+                known = [batches_by_id[batch_id] for batch_id, _ in claimed if batch_id in batches_by_id]
+                if known:
+                    run_batches(known, context_builder, api_key, max_workers, results)
+                return results
+
+            work_queue.run_queue_worker(queue, process_claim, manifest_path)
+        else:
+            # Batches that failed in an earlier run are retried now (the queue counts its own retries)
+            metrics.METRICS.record_retry(sum(1 for batch_id in pending_ids if batch_id in manifest))
+            batches_to_process = [b for b in pass_2_batches if manifest.get(b['group_id']) != "success"]
         
-        for future in tqdm(concurrent.futures.as_completed(future_to_batch), total=len(future_to_batch), desc="Processing Pass 2 Batches"):
-            batch_id = future_to_batch[future]["group_id"]
-            try:
-                result = future.result()
-                status = result.get("status", "unknown_error")
-                manifest[batch_id] = status
+            if not batches_to_process:
+                logging.info("All required Pass 2 batches have already been processed successfully.")
+                metrics.stop()
+                return
 
-                if result.get("usage"):
-                    utils.log_token_usage(batch_id, result["usage"], "pass_2")
-            
-            except Exception as exc:
-                manifest[batch_id] = "future_failed"
-                utils.log_error(batch_id, exc, {"note": "Error retrieving result from future."})
-            
-            finally:
-                utils.save_manifest(manifest_path, manifest)
+            run_batches(batches_to_process, context_builder, api_key, utils.MAX_WORKERS, manifest, manifest_path)
+
+    if utils.shutdown_requested():
+        hedging.log_loser_usage("pass_2")
+        metrics.stop()
+        profiling.finish_run()
+        utils.finish_shutdown(api_key)
 
+    hedging.finish_run("pass_2")
+    metrics.stop()
     logging.info("--- Stage 3, Pass 2 COMPLETE ---")
 
 
@@ -294,4 +382,9 @@ if __name__ == "__main__":
     if not google_api_key:
         logging.fatal("FATAL: GOOGLE_API_KEY environment variable not found.")
     else:
-        main(api_key=google_api_key)
+        # Pass --profile=sampling to include the worker threads in the run report
+        profiling.start_run("stage_3_pass_2")
+        try:
+            main(api_key=google_api_key)
+        finally:
+            profiling.finish_run()
@@ -0,0 +1,256 @@
+# work_queue.py
+# Purpose: A lease-based work queue on a shared SQLite database, so several
+# Stage 3 Pass 1 / Pass 2 workers (on one machine or several machines sharing a
+# filesystem) can split a run. Workers claim groups with expiring leases, keep
+# them alive with heartbeats, and release them on failure. Each worker sizes its
+# thread pool to its share of the global MAX_WORKERS budget.
+#
+# Enable by setting CDE_WORK_QUEUE_DB to a path on storage every worker can reach.
+# The database uses the default rollback journal (not WAL), which relies only on
+# file locking and is therefore safe on network filesystems.
+
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from typing import List, Dict, Tuple, Iterable, Optional
+
+import shared_utils as utils
+from run_metrics import METRICS, WORKER_ID
+
+# --- 1. CONFIGURATION ---
+
+WORK_QUEUE_DB_PATH = os.getenv("CDE_WORK_QUEUE_DB")  # None = single-process manifest mode
+LEASE_SECONDS = 900             # Must comfortably exceed utils.REQUEST_TIMEOUT_S
+HEARTBEAT_SECONDS = 60
+WORKER_STALE_SECONDS = 180      # Workers silent for longer no longer count towards the rate-limit split
+MAX_ATTEMPTS = 3                # Groups that fail this many times are parked as 'failed'
+CLAIM_MULTIPLIER = 2            # Claim up to (rate-limit share x this) groups at a time
+IDLE_POLL_SECONDS = 30          # Wait between claims while other workers still hold leases
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    pass_name     TEXT NOT NULL,
+    group_id      TEXT NOT NULL,
+    community_id  TEXT,
+    status        TEXT NOT NULL DEFAULT 'pending',  -- pending | leased | done | failed
+    worker_id     TEXT,
+    lease_expires REAL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    last_status   TEXT,
+    updated_at    REAL,
+    PRIMARY KEY (pass_name, group_id)
+);
+CREATE INDEX IF NOT EXISTS idx_work_items_claim ON work_items (pass_name, status, lease_expires);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id  TEXT PRIMARY KEY,
+    pass_name  TEXT NOT NULL,
+    hostname   TEXT,
+    last_seen  REAL
+);
+"""
+
+
+# --- 2. QUEUE ---
+
+class WorkQueue:
+    """A shared queue of Stage 3 groups for one pass. Safe to use from several threads."""
+
+    def __init__(self, db_path: str, pass_name: str, worker_id: Optional[str] = None):
+        self.pass_name = pass_name
+        self.worker_id = worker_id or f"{WORKER_ID}-{uuid.uuid4().hex[:6]}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._touch_worker()
+        logging.info(f"Work-queue mode: worker '{self.worker_id}' on {db_path} ({pass_name}).")
+
+    def _execute_in_transaction(self, fn):
+        """Runs `fn(cursor)` inside BEGIN IMMEDIATE so claims are atomic across processes."""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(cursor)
+                cursor.execute("COMMIT")
+                return result
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def _touch_worker(self):
+        now = time.time()
+        self._execute_in_transaction(lambda c: c.execute(
+            "INSERT INTO workers (worker_id, pass_name, hostname, last_seen) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(worker_id) DO UPDATE SET last_seen = excluded.last_seen",
+            (self.worker_id, self.pass_name, socket.gethostname(), now)))
+
+    def enqueue(self, items: Iterable[Tuple[str, str]], manifest: Optional[Dict[str, str]] = None):
+        """Adds (group_id, community_id) items; groups already successful in `manifest` start as done."""
+        manifest = manifest or {}
+        now = time.time()
+        rows = [
+            (self.pass_name, group_id, community_id,
+             'done' if manifest.get(group_id) == "success" else 'pending',
+             manifest.get(group_id), now)
+            for group_id, community_id in items
+        ]
+        self._execute_in_transaction(lambda c: c.executemany(
+            "INSERT OR IGNORE INTO work_items (pass_name, group_id, community_id, status, last_status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)", rows))
+
+    def claim(self, limit: int) -> List[Tuple[str, str]]:
+        """
+        Leases up to `limit` claimable groups (pending, or leased with an expired lease).
+        All claimed groups belong to the same community so they can share one cache.
+        """
+        now = time.time()
+
+        def _claim(cursor):
+            claimable = "pass_name = ? AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?))"
+            row = cursor.execute(
+                f"SELECT community_id FROM work_items WHERE {claimable} ORDER BY rowid LIMIT 1",
+                (self.pass_name, now)).fetchone()
+            if row is None:
+                return []
+            rows = cursor.execute(
+                f"SELECT group_id, community_id, attempts FROM work_items WHERE {claimable} AND community_id IS ? "
+                f"ORDER BY rowid LIMIT ?", (self.pass_name, now, row[0], limit)).fetchall()
+            cursor.executemany(
+                "UPDATE work_items SET status = 'leased', worker_id = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE pass_name = ? AND group_id = ?",
+                [(self.worker_id, now + LEASE_SECONDS, now, self.pass_name, group_id) for group_id, _, _ in rows])
+            # Groups that were attempted before (failed or whose lease expired) are retries
+            METRICS.record_retry(sum(1 for _, _, attempts in rows if attempts > 0))
+            return [(group_id, community_id) for group_id, community_id, _ in rows]
+
+        claimed = self._execute_in_transaction(_claim)
+        self._touch_worker()
+        return claimed
+
+    def heartbeat(self, group_ids: Iterable[str]):
+        """Extends the leases this worker holds on `group_ids`."""
+        now = time.time()
+        self._execute_in_transaction(lambda c: c.executemany(
+            "UPDATE work_items SET lease_expires = ?, updated_at = ? "
+            "WHERE pass_name = ? AND group_id = ? AND worker_id = ? AND status = 'leased'",
+            [(now + LEASE_SECONDS, now, self.pass_name, group_id, self.worker_id) for group_id in group_ids]))
+        self._touch_worker()
+
+    def complete(self, group_id: str, status: str):
+        """Records a group's result. Anything but 'success' is released for another attempt."""
+        if status != "success":
+            self.release(group_id, status)
+            return
+        self._execute_in_transaction(lambda c: c.execute(
+            "UPDATE work_items SET status = 'done', last_status = ?, worker_id = NULL, lease_expires = NULL, "
+            "updated_at = ? WHERE pass_name = ? AND group_id = ? AND worker_id = ?",
+            (status, time.time(), self.pass_name, group_id, self.worker_id)))
+
+    def release(self, group_id: str, status: str, count_attempt: bool = True):
+        """Returns a leased group to the queue, or parks it as 'failed' after MAX_ATTEMPTS."""
+        attempt_adjust = 0 if count_attempt else 1
+        self._execute_in_transaction(lambda c: c.execute(
+            "UPDATE work_items SET attempts = attempts - ?, "
+            "status = CASE WHEN attempts - ? >= ? THEN 'failed' ELSE 'pending' END, "
+            "last_status = ?, worker_id = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE pass_name = ? AND group_id = ? AND worker_id = ?",
+            (attempt_adjust, attempt_adjust, MAX_ATTEMPTS, status, time.time(), self.pass_name, group_id, self.worker_id)))
+
+    def active_worker_count(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE pass_name = ? AND last_seen >= ?",
+                (self.pass_name, time.time() - WORKER_STALE_SECONDS)).fetchone()
+        return max(1, row[0])
+
+    def rate_limit_share(self, total_workers: int = utils.MAX_WORKERS) -> int:
+        """This worker's slice of the global concurrency budget."""
+        return max(1, total_workers // self.active_worker_count())
+
+    def has_unfinished(self) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM work_items WHERE pass_name = ? AND status IN ('pending', 'leased')",
+                (self.pass_name,)).fetchone()
+        return row[0] > 0
+
+    def statuses(self) -> Dict[str, str]:
+        """Returns {group_id: last_status} in the manifest format."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT group_id, last_status FROM work_items WHERE pass_name = ? AND last_status IS NOT NULL",
+                (self.pass_name,)).fetchall()
+        return dict(rows)
+
+    def close(self):
+        self._execute_in_transaction(lambda c: c.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,)))
+        with self._lock:
+            self._conn.close()
+
+
+class LeaseHeartbeat:
+    """Context manager that keeps this worker's leases alive while a batch is processed."""
+
+    def __init__(self, queue: WorkQueue, group_ids: Iterable[str]):
+        self.queue = queue
+        self.group_ids = list(group_ids)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(HEARTBEAT_SECONDS):
+            try:
+                self.queue.heartbeat(self.group_ids)
+            except sqlite3.Error as e:
+                logging.warning(f"Lease heartbeat failed: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def run_queue_worker(queue: WorkQueue, process_claim, manifest_path: str):
+    """
+    Claims and processes groups until the queue is drained or a shutdown is requested.
+    `process_claim(claimed, max_workers)` handles one claim (all items share a community)
+    and returns {group_id: status} for the groups it finished.
+    """
+    try:
+        while not utils.shutdown_requested():
+            share = queue.rate_limit_share()
+            claimed = queue.claim(limit=share * CLAIM_MULTIPLIER)
+            if not claimed:
+                if not queue.has_unfinished():
+                    break
+                # Other workers hold the remaining leases; wait in case they expire.
+                utils.wait_for_shutdown(IDLE_POLL_SECONDS)
+                continue
+
+            logging.info(f"Claimed {len(claimed)} group(s) from {claimed[0][1]} (rate-limit share: {share} worker thread(s)).")
+            results = {}
+            try:
+                with LeaseHeartbeat(queue, [group_id for group_id, _ in claimed]):
+                    results = process_claim(claimed, share)
+            finally:
+                for group_id, _ in claimed:
+                    if group_id in results:
+                        queue.complete(group_id, results[group_id])
+                    else:
+                        # Cancelled during shutdown: return it without using an attempt. Otherwise the attempt
+                        # counts, so a claim that keeps failing (e.g. no cache) is parked after MAX_ATTEMPTS.
+                        queue.release(group_id, "not_processed", count_attempt=not utils.shutdown_requested())
+
+        if not queue.has_unfinished():
+            # The queue is the source of truth in this mode; export it in the manifest format.
+            utils.save_manifest(manifest_path, queue.statuses())
+    finally:
+        queue.close()